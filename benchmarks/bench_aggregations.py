@@ -0,0 +1,69 @@
+"""
+Compare the legacy groupby/lambda aggregates in transform_data with the vectorized engine.
+
+    PYTHONPATH=. python benchmarks/bench_aggregations.py --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from modules.aggregation import compute_device_aggregates
+
+
+def make_frame(rows, devices, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "device_id": pd.Series(rng.integers(0, devices, rows)).map(lambda i: f"D{i:06}"),
+        "event_ts": pd.Timestamp("2025-08-01") + pd.to_timedelta(rng.integers(0, 7 * 24 * 3600, rows), unit="s"),
+        "calibrated_temperature": rng.uniform(-10, 50, rows),
+        "calibrated_humidity": rng.uniform(0, 100, rows),
+    })
+    df["event_date"] = df["event_ts"].dt.date
+    df["event_hour"] = df["event_ts"].dt.hour
+    return df
+
+
+def legacy(df):
+    df = df.copy()
+    df["hour_avg_temp"] = df.groupby(["device_id", "event_hour"])["calibrated_temperature"].transform("mean")
+    df["hour_avg_humid"] = df.groupby(["device_id", "event_hour"])["calibrated_humidity"].transform("mean")
+    df["day_avg_temp"] = df.groupby(["device_id", "event_date"])["calibrated_temperature"].transform("mean")
+    df["day_avg_humid"] = df.groupby(["device_id", "event_date"])["calibrated_humidity"].transform("mean")
+    df.sort_values(by=["device_id", "event_ts"], inplace=True)
+    df["rolling_7d_temp"] = df.groupby("device_id")["calibrated_temperature"].transform(
+        lambda x: x.rolling(window=7, min_periods=1).mean()
+    )
+    df["rolling_7d_humid"] = df.groupby("device_id")["calibrated_humidity"].transform(
+        lambda x: x.rolling(window=7, min_periods=1).mean()
+    )
+    return df
+
+
+def timed(func, df, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(df)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--rows-per-device", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'devices':>8} {'legacy_s':>10} {'engine_s':>10} {'engine_7D_s':>12} {'speedup':>8}")
+    for rows in args.sizes:
+        devices = max(1, rows // args.rows_per_device)
+        df = make_frame(rows, devices)
+        legacy_s = timed(legacy, df, args.repeat)
+        engine_s = timed(compute_device_aggregates, df, args.repeat)
+        time_s = timed(lambda frame: compute_device_aggregates(frame, time_window="7D"), df, args.repeat)
+        print(f"{rows:>10} {devices:>8} {legacy_s:>10.3f} {engine_s:>10.3f} {time_s:>12.3f} {legacy_s / engine_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare the Parquet write profiles (PARQUET_PROFILES) on file size, write time and the
+latency of a point read (one device) and a range read (one hour) with pyarrow and DuckDB.
+
+    PYTHONPATH=. python benchmarks/bench_parquet_profiles.py --rows 1000000 --devices 10000
+"""
+import os
+import argparse
+import tempfile
+import time
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from modules.utils.constants import PARQUET_PROFILES
+from modules.utils.parquet_profiles import write_parquet
+
+
+def make_table(rows, devices, seed=0):
+    # Transformed-like rows in arrival order: devices interleaved, time roughly increasing
+    rng = np.random.default_rng(seed)
+    event_ts = pd.Timestamp("2025-08-01") + pd.to_timedelta(np.sort(rng.integers(0, 7 * 24 * 3600, rows)), unit="s")
+    df = pd.DataFrame({
+        "device_id": pd.Series(rng.integers(0, devices, rows)).map(lambda i: f"D{i:06}"),
+        "device_type": rng.choice(["thermo", "hygro", "combo"], rows),
+        "event_ts": event_ts.astype("datetime64[us]"),
+        "calibrated_temperature": rng.normal(22, 5, rows).astype("float32"),
+        "calibrated_humidity": rng.uniform(0, 100, rows).astype("float32"),
+        "anomaly_flag": rng.random(rows) < 0.01,
+    })
+    df["event_date"] = df["event_ts"].dt.date
+    df["event_hour"] = df["event_ts"].dt.hour.astype("int16")
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--profiles", nargs="+", default=list(PARQUET_PROFILES))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    table = make_table(args.rows, args.devices)
+    device = table.column("device_id")[args.rows // 2].as_py()
+    start = pd.Timestamp("2025-08-04 12:00")
+    end = start + pd.Timedelta(hours=1)
+    con = duckdb.connect()
+
+    print(f"{args.rows} rows, {args.devices} devices; point read device_id = {device}, range read {start} .. {end}")
+    print(f"{'profile':>16} {'size_mb':>8} {'row_groups':>10} {'write_s':>8} {'point_pa_ms':>12} {'point_db_ms':>12} {'range_pa_ms':>12} {'range_db_ms':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.profiles:
+            path = os.path.join(tmp_dir, f"{name}.parquet")
+            write_s = timed(lambda: write_parquet(table, path, name), 1)
+
+            point_pa = timed(lambda: pq.read_table(path, filters=[("device_id", "=", device)]), args.repeat)
+            range_pa = timed(lambda: pq.read_table(path, filters=[("event_ts", ">=", start), ("event_ts", "<", end)]), args.repeat)
+            point_db = timed(lambda: con.execute(
+                f"SELECT * FROM read_parquet('{path}') WHERE device_id = ?", [device]).fetchall(), args.repeat)
+            range_db = timed(lambda: con.execute(
+                f"SELECT * FROM read_parquet('{path}') WHERE event_ts >= ? AND event_ts < ?", [start, end]).fetchall(), args.repeat)
+
+            print(
+                f"{name:>16} {os.path.getsize(path) / 2**20:>8.2f} {pq.ParquetFile(path).num_row_groups:>10} {write_s:>8.2f} "
+                f"{point_pa * 1e3:>12.1f} {point_db * 1e3:>12.1f} {range_pa * 1e3:>12.1f} {range_db * 1e3:>12.1f}"
+            )
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
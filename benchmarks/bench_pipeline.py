@@ -0,0 +1,221 @@
+"""
+Time every pipeline stage (ingest/transform/validate/load/report) on synthetic data.
+
+Each size runs in a fresh subprocess with its own scratch TELEMETRY_DATA_ROOT, so checkpoints,
+caches and the warehouse never leak between sizes. Results are written as JSON keyed by the
+git commit; pass --compare with an earlier results file to print per-stage ratios.
+
+    PYTHONPATH=. python benchmarks/bench_pipeline.py --sizes 10000 100000 1000000
+    PYTHONPATH=. python benchmarks/bench_pipeline.py --sizes 10000000 --devices 100000 --compare benchmarks/results/old.json
+    PYTHONPATH=. python benchmarks/bench_pipeline.py --filesystem s3   # generated data uploaded to MinIO
+"""
+import os
+import sys
+import json
+import math
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ["ingest_raw_data", "transform_data", "validate_data", "load_to_iceberg", "generate_report"]
+
+
+class BenchTaskInstance:
+    # Just enough of Airflow's TaskInstance for the XCom hand-offs between stages
+    def __init__(self):
+        self.task_id = None
+        self.xcom = {}
+
+    def xcom_push(self, key, value):
+        self.xcom[(self.task_id, key)] = value
+
+    def xcom_pull(self, task_ids, key):
+        if isinstance(task_ids, str):
+            return self.xcom.get((task_ids, key))
+        return [self.xcom[(task_id, key)] for task_id in task_ids if (task_id, key) in self.xcom]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def run_worker(args):
+    # Imports happen after the parent set TELEMETRY_* so constants resolve to the scratch root
+    import time
+    from telemetry_data_generator import write_telemetry_data
+    from config_data_generator import write_config_data
+    from modules.utils.constants import BUCKET_NAME
+    from modules.utils.profiling import peak_rss_mb
+    import modules.ingestion as ingestion
+    import modules.storage as storage
+    from modules.transformation import transform_data
+    from modules.validation import validate_data
+    from modules.reporting import generate_report
+
+    start = datetime.strptime(args.start, "%Y-%m-%dT%H")
+    # Readings per device-hour first, then as many devices as fit: devices x readings x hours
+    # stays at or below the requested rows (small sizes use fewer devices)
+    devices = min(args.devices, max(1, args.rows // args.hours))
+    rows_per_device = max(1, math.ceil(args.rows / (devices * args.hours)))
+    devices = max(1, min(devices, args.rows // (rows_per_device * args.hours)))
+    landing = os.path.join(args.raw_root, BUCKET_NAME)
+
+    started = time.perf_counter()
+    rows = write_telemetry_data(
+        landing, start, args.hours, devices, rows_per_device,
+        args.null_rate, args.duplicate_rate, args.outlier_rate, args.seed, verbose=False
+    )
+    write_config_data(landing, (start - timedelta(days=1)).strftime("%Y-%m-%d"), devices, args.seed, verbose=False)
+    generate_sec = time.perf_counter() - started
+
+    if args.filesystem == "s3":
+        import pyarrow.fs as pafs
+        pafs.copy_files(landing, BUCKET_NAME, source_filesystem=pafs.LocalFileSystem(), destination_filesystem=ingestion.get_s3_filesystem())
+
+    ti = BenchTaskInstance()
+    context = {
+        "ti": ti,
+        "logical_date": start,
+        "execution_date": start,
+        "run_id": f"bench__{start:%Y%m%dT%H}",
+        "end_hour": start + timedelta(hours=args.hours - 1),
+    }
+
+    def load(**ctx):
+        storage.load_to_iceberg(**ctx)
+        # Benchmark the commit too, not only the staging write
+        storage.flush_staged(force=True)
+
+    callables = {
+        "ingest_raw_data": ingestion.ingest_raw_data,
+        "transform_data": transform_data,
+        "validate_data": validate_data,
+        "load_to_iceberg": load,
+        "generate_report": generate_report,
+    }
+
+    stages = {}
+    for stage in STAGES:
+        ti.task_id = stage
+        started = time.perf_counter()
+        callables[stage](**context)
+        stages[stage] = dict(ti.xcom.get((stage, "task_timing")) or {}, wall_sec=time.perf_counter() - started)
+
+    return {
+        "rows": rows,
+        "requested_rows": args.rows,
+        "devices": devices,
+        "hours": args.hours,
+        "rows_per_device_hour": rows_per_device,
+        "generate_sec": generate_sec,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def run_size(args, rows):
+    scratch = tempfile.mkdtemp(prefix=f"bench-{rows}-", dir=args.workdir)
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+        TELEMETRY_DATA_ROOT=os.path.join(scratch, "data"),
+        TELEMETRY_DUCKDB_EXTENSIONS="",
+    )
+    if args.filesystem == "local":
+        env["TELEMETRY_RAW_ROOT"] = os.path.join(scratch, "raw")
+
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--rows", str(rows), "--raw-root", os.path.join(scratch, "raw"),
+        "--devices", str(args.devices), "--hours", str(args.hours), "--start", args.start,
+        "--null-rate", str(args.null_rate), "--duplicate-rate", str(args.duplicate_rate),
+        "--outlier-rate", str(args.outlier_rate), "--seed", str(args.seed), "--filesystem", args.filesystem,
+    ]
+    try:
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(e.stderr)
+        raise
+    finally:
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {entry["rows"]: entry for entry in json.load(f)["results"]}
+    for entry in results["results"]:
+        previous = baseline.get(entry["rows"])
+        if not previous:
+            continue
+        for stage in STAGES:
+            new, old = entry["stages"][stage]["wall_sec"], previous["stages"][stage]["wall_sec"]
+            print(f"{entry['rows']:>10} {stage:<16} {old:8.3f}s -> {new:8.3f}s  x{new / max(old, 1e-9):.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--start", default="2025-08-01T00")
+    parser.add_argument("--null-rate", type=float, default=0.001)
+    parser.add_argument("--duplicate-rate", type=float, default=0.001)
+    parser.add_argument("--outlier-rate", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--filesystem", choices=["local", "s3"], default="local",
+                        help="read raw data from a local directory or from MinIO (MINIO_* settings)")
+    parser.add_argument("--workdir", default=None, help="scratch parent directory (default: system temp)")
+    parser.add_argument("--output", default=None, help="results JSON (default: benchmarks/results/<commit>-<ts>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    parser.add_argument("--keep", action="store_true", help="keep scratch directories")
+    # Internal: one size inside the isolated subprocess
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--raw-root", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    results = {
+        "commit": git_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("worker", "rows", "raw_root")},
+        "results": [],
+    }
+    for rows in args.sizes:
+        entry = run_size(args, rows)
+        results["results"].append(entry)
+        timings = ", ".join(f"{stage}={entry['stages'][stage]['wall_sec']:.2f}s" for stage in STAGES)
+        print(f"{entry['rows']:>10} rows ({entry['rows'] / entry['requested_rows'] - 1:+.1%} of {entry['requested_rows']}): "
+              f"{timings}, peak RSS {entry['peak_rss_mb']:.0f} MB")
+
+    output = args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results", f"{results['commit']}-{datetime.utcnow():%Y%m%dT%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
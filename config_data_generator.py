@@ -1,27 +1,48 @@
 # generate_config_data.py
-import pandas as pd
+"""
+Synthetic device config in the raw landing layout: {root}/raw/config/YYYY-MM-DD/devices.csv
+
+    python config_data_generator.py --date 2025-07-29 --devices 10
+"""
 import os
-from datetime import datetime
-import random
-
-def generate_config_data(date, num_devices=10):
-    data = []
-    for device_id in range(1, num_devices + 1):
-        row = {
-            "device_id": f"D{device_id:04}",
-            "device_type": random.choice(["soil", "weather", "irrigation"]),
-            "scale": round(random.uniform(0.8, 1.2), 2),
-            "offset": round(random.uniform(-2.0, 2.0), 2),
-            "calibration_date": date
-        }
-        data.append(row)
-    
-    df = pd.DataFrame(data)
-    
-    path = f"data/raw/config/{date}"
+import argparse
+import numpy as np
+import pyarrow as pa
+
+DEVICE_TYPES = np.array(["soil", "weather", "irrigation"])
+
+
+def generate_config_table(date, num_devices=10, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
+    return pa.table({
+        "device_id": [f"D{device_id:04}" for device_id in range(1, num_devices + 1)],
+        "device_type": DEVICE_TYPES[rng.integers(0, len(DEVICE_TYPES), num_devices)],
+        "scale": np.round(rng.uniform(0.8, 1.2, num_devices), 2),
+        "offset": np.round(rng.uniform(-2.0, 2.0, num_devices), 2),
+        "calibration_date": [date] * num_devices,
+    })
+
+
+def write_config_data(root, date, num_devices=10, seed=None, verbose=True):
+    table = generate_config_table(date, num_devices, np.random.default_rng(seed))
+
+    path = os.path.join(root, "raw", "config", date)
     os.makedirs(path, exist_ok=True)
-    df.to_csv(f"{path}/devices.csv", index=False)
-    print(f"Generated device config: {path}/devices.csv")
+    table.to_pandas().to_csv(f"{path}/devices.csv", index=False)
+    if verbose:
+        print(f"Generated device config: {path}/devices.csv")
+    return table.num_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default="data", help="landing root holding raw/config")
+    parser.add_argument("--date", default="2025-07-29")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
 
-# Example usage:
-generate_config_data("2025-07-29")
+if __name__ == "__main__":
+    args = parse_args()
+    write_config_data(args.root, args.date, args.devices, args.seed)
@@ -0,0 +1,231 @@
+import os
+import glob
+import json
+import fcntl
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from contextlib import contextmanager
+from modules.aggregation import AGGREGATE_COLUMNS
+from modules.sharding import shard_ids
+from modules.utils.constants import AGGREGATE_STATE_DIR, AGGREGATE_STATE_PARTITIONS, AGGREGATE_STATE_RETENTION_HOURS
+
+STATE_KEYS = ["device_id", "bucket_ts", "batch_id"]
+# Partitions holding each batch's buckets, so a retry finds all of its earlier buckets
+MANIFEST = "_batches.json"
+SUM_COLUMNS = [f"{suffix}_{stat}" for suffix in AGGREGATE_COLUMNS.values() for stat in ("sum", "count")]
+
+STATE_SCHEMA = pa.schema(
+    [("device_id", pa.string()), ("bucket_ts", pa.timestamp("us")), ("batch_id", pa.string())]
+    + [(col, pa.float64()) for col in SUM_COLUMNS]
+)
+
+
+def batch_id_from_context(context):
+    # Airflow retries and cleared tasks keep their run_id, so they replace their own buckets
+    if context.get("run_id"):
+        return str(context["run_id"])
+    if context.get("execution_date"):
+        return pd.Timestamp(context["execution_date"]).isoformat()
+    return "adhoc"
+
+
+def hourly_buckets(df):
+    """Per-device hourly sums and non-null counts of the calibrated columns."""
+    buckets = df[["device_id", "event_ts"] + list(AGGREGATE_COLUMNS)].copy()
+    buckets["bucket_ts"] = pd.to_datetime(buckets["event_ts"]).dt.floor("h")
+    grouped = buckets.groupby(["device_id", "bucket_ts"], sort=False, observed=True)
+
+    result = grouped[list(AGGREGATE_COLUMNS)].agg(["sum", "count"])
+    result.columns = [f"{AGGREGATE_COLUMNS[col]}_{stat}" for col, stat in result.columns]
+    return result.reset_index().astype({col: "float64" for col in SUM_COLUMNS})
+
+
+class AggregateStateStore:
+    """
+    Persisted per-device hourly buckets (running sums + counts), hash-partitioned by device.
+
+    Each run contributes the buckets of its own rows under its batch id. Re-running a batch
+    (retry, cleared task, out-of-order backfill) replaces exactly that batch's buckets, so
+    day and 7-day statistics never require rescanning history. Each device keeps a ring
+    buffer of its last `retention_hours` buckets. An update reads and rewrites only the
+    partitions of its devices, plus those the batch manifest lists for an earlier attempt
+    of the batch, so its cost follows the batch rather than the whole state.
+    """
+
+    def __init__(self, root=AGGREGATE_STATE_DIR, retention_hours=AGGREGATE_STATE_RETENTION_HOURS,
+                 partitions=AGGREGATE_STATE_PARTITIONS):
+        self.root = root
+        self.retention_hours = retention_hours
+        self.partitions = partitions
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _partition_path(self, partition):
+        return os.path.join(self.root, f"part-{partition:04d}.parquet")
+
+    def _read_partition(self, partition):
+        path = self._partition_path(partition)
+        if not os.path.exists(path):
+            return STATE_SCHEMA.empty_table().to_pandas()
+        return pq.read_table(path).to_pandas()
+
+    def _write_partition(self, partition, state):
+        path = self._partition_path(partition)
+        if not len(state):
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        pq.write_table(pa.Table.from_pandas(state, schema=STATE_SCHEMA, preserve_index=False), f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def _read_manifest(self):
+        # batch_id -> partitions holding its buckets
+        try:
+            with open(os.path.join(self.root, MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_manifest(self, manifest):
+        path = os.path.join(self.root, MANIFEST)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _migrate(self):
+        # Split the single-file state written before partitioning
+        legacy = f"{self.root}.parquet"
+        if not os.path.isfile(legacy):
+            return
+        state = pq.read_table(legacy).to_pandas()
+        parts = shard_ids(state["device_id"], self.partitions)
+        manifest = self._read_manifest()
+        for partition in np.unique(parts):
+            rows = state[parts == partition]
+            self._write_partition(partition, pd.concat([self._read_partition(partition), rows], ignore_index=True))
+            for batch in rows["batch_id"].unique():
+                manifest.setdefault(batch, []).append(int(partition))
+        self._write_manifest(manifest)
+        os.remove(legacy)
+        logging.info(f"Split {len(state)} aggregate state buckets from {legacy} into {self.root}")
+
+    def read(self):
+        paths = sorted(glob.glob(os.path.join(self.root, "part-*.parquet")))
+        if not paths:
+            return STATE_SCHEMA.empty_table().to_pandas()
+        return pa.concat_tables([pq.read_table(path) for path in paths]).to_pandas()
+
+    def update(self, buckets, batch_id):
+        """
+        Replace this batch's buckets, prune the ring buffers of its devices and persist.
+
+        Returns the buckets of the batch's devices (before pruning), for state_averages.
+        """
+        buckets = buckets.assign(batch_id=batch_id)
+        parts = shard_ids(buckets["device_id"], self.partitions)
+        devices = buckets["device_id"].unique()
+        with self._locked():
+            self._migrate()
+            manifest = self._read_manifest()
+            touched = sorted(set(parts.tolist()) | set(manifest.get(batch_id, [])))
+            # Recorded before any partition is rewritten, so a crash leaves a superset
+            manifest[batch_id] = touched
+            self._write_manifest(manifest)
+
+            lookups, remaining, stale = [], {}, 0
+            for partition in touched:
+                state = self._read_partition(partition)
+                state = state[state["batch_id"] != batch_id]
+                state = pd.concat([state, buckets[parts == partition][STATE_SCHEMA.names]], ignore_index=True)
+
+                # Ring buffer: keep the trailing window of buckets behind each device's newest one
+                horizon = state.groupby("device_id")["bucket_ts"].transform("max") - pd.Timedelta(hours=self.retention_hours)
+                expired = state["bucket_ts"] <= horizon
+                stale += int((expired & (state["batch_id"] == batch_id)).sum())
+                lookups.append(state[state["device_id"].isin(devices)])
+                state = state[~expired].reset_index(drop=True)
+                self._write_partition(partition, state)
+                remaining[partition] = set(state["batch_id"])
+
+            # Forget partitions that no longer hold a batch's buckets
+            for batch in list(manifest):
+                kept = [p for p in manifest[batch] if p not in remaining or batch in remaining[p]]
+                if kept:
+                    manifest[batch] = kept
+                else:
+                    del manifest[batch]
+            self._write_manifest(manifest)
+
+        if stale:
+            logging.warning(
+                f"{stale} buckets of batch {batch_id} are older than the "
+                f"{self.retention_hours}h state horizon; their 7-day stats use partial history"
+            )
+        if not lookups:
+            return STATE_SCHEMA.empty_table().to_pandas()
+        return pd.concat(lookups, ignore_index=True)
+
+
+AVERAGE_COLUMNS = [f"{kind}_{suffix}" for kind in ("hour_avg", "day_avg", "rolling_7d") for suffix in AGGREGATE_COLUMNS.values()]
+
+
+def state_averages(state, window_hours=7 * 24):
+    """
+    Hour, day and trailing-window averages per (device_id, bucket_ts) of the persisted buckets.
+
+    Hour averages cover every batch's rows of the hour bucket (several micro-batches can land
+    in one hour); day averages cover every known bucket of the bucket's date; rolling averages
+    cover the `window_hours` hourly buckets ending at the bucket.
+    """
+    totals = state.groupby(["device_id", "bucket_ts"], as_index=False)[SUM_COLUMNS].sum()
+    totals = totals.sort_values(["device_id", "bucket_ts"], kind="mergesort").reset_index(drop=True)
+
+    # Day totals per (device, date)
+    totals["event_date"] = totals["bucket_ts"].dt.date
+    day_totals = totals.groupby(["device_id", "event_date"], as_index=False)[SUM_COLUMNS].sum()
+    by_day = totals[["device_id", "event_date"]].merge(day_totals, on=["device_id", "event_date"], how="left")
+
+    # Trailing window totals per (device, hour) from prefix sums over each device's buckets
+    codes, _ = pd.factorize(totals["device_id"])
+    hours = (totals["bucket_ts"].to_numpy(dtype="datetime64[h]").astype(np.int64))
+    stride = int(hours.max() - hours.min()) + window_hours + 1 if len(hours) else 1
+    keys = codes.astype(np.int64) * stride + (hours - (hours.min() if len(hours) else 0))
+    left = np.searchsorted(keys, keys - window_hours, side="right")
+    right = np.arange(1, len(keys) + 1)
+    window_totals = {}
+    for col in SUM_COLUMNS:
+        prefix = np.concatenate(([0.0], np.cumsum(totals[col].to_numpy())))
+        window_totals[col] = prefix[right] - prefix[left]
+
+    averages = totals[["device_id", "bucket_ts"]].copy()
+    averages["bucket_ts"] = averages["bucket_ts"].astype("datetime64[us]")
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for suffix in AGGREGATE_COLUMNS.values():
+            averages[f"hour_avg_{suffix}"] = totals[f"{suffix}_sum"].to_numpy() / totals[f"{suffix}_count"].to_numpy()
+            averages[f"day_avg_{suffix}"] = by_day[f"{suffix}_sum"].to_numpy() / by_day[f"{suffix}_count"].to_numpy()
+            averages[f"rolling_7d_{suffix}"] = window_totals[f"{suffix}_sum"] / window_totals[f"{suffix}_count"]
+    return averages
+
+
+def apply_state(df, state, window_hours=7 * 24):
+    """Overwrite hour_avg_*, day_avg_* and rolling_7d_* with the state averages of each row's hour bucket."""
+    out = df.copy()
+    row_keys = pd.DataFrame({
+        "device_id": out["device_id"],
+        "bucket_ts": pd.to_datetime(out["event_ts"]).dt.floor("h").astype("datetime64[us]"),
+    })
+    by_bucket = row_keys.merge(state_averages(state, window_hours), on=["device_id", "bucket_ts"], how="left")
+    for col in AVERAGE_COLUMNS:
+        out[col] = by_bucket[col].to_numpy()
+    return out
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+from modules.utils.constants import ROLLING_WINDOW, ROLLING_TIME_WINDOW
+
+# Calibrated column -> suffix used by the derived aggregate columns
+AGGREGATE_COLUMNS = {
+    "calibrated_temperature": "temp",
+    "calibrated_humidity": "humid",
+}
+
+NS_PER_DAY = 86_400 * 10**9
+
+
+def _group_mean(keys, values, size):
+    # NaN-skipping mean per dense integer key, broadcast back to the rows
+    valid = ~np.isnan(values)
+    sums = np.bincount(keys, weights=np.where(valid, values, 0.0), minlength=size)
+    counts = np.bincount(keys, weights=valid.astype(np.float64), minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return means[keys]
+
+
+def _window_mean(values, left):
+    # Mean of values[left[i]:i+1] for every row, from prefix sums of values and valid counts
+    valid = ~np.isnan(values)
+    value_sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    valid_counts = np.concatenate(([0], np.cumsum(valid)))
+    right = np.arange(1, len(values) + 1)
+    counts = valid_counts[right] - valid_counts[left]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, (value_sums[right] - value_sums[left]) / counts, np.nan)
+
+
+def sorted_codes(values):
+    # Dense integer codes in sorted value order; categoricals rank their categories instead
+    # of re-hashing every row (their own codes follow dictionary order, not value order)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        rank = np.empty(len(categories) + 1, dtype=np.int64)
+        rank[categories.argsort()] = np.arange(len(categories))
+        rank[-1] = -1
+        return rank[values.cat.codes.to_numpy()]
+    return pd.factorize(values, sort=True)[0]
+
+
+def row_window_starts(segment_starts, window):
+    # Left edge of a trailing `window`-row frame, clipped to the device's first row
+    rows = np.arange(len(segment_starts))
+    return np.maximum(segment_starts, rows - window + 1)
+
+
+def time_window_starts(codes, ts_ns, segment_starts, window_ns):
+    # Left edge of the (ts - window, ts] frame. Rows are sorted by (code, ts), so offsetting
+    # each device by more than the whole time span turns it into one global searchsorted.
+    if len(ts_ns) == 0:
+        return np.zeros(0, dtype=np.int64)
+    rel = ts_ns - ts_ns.min()
+    stride = int(rel.max()) + window_ns + 1
+    if stride * (int(codes.max()) + 1) < np.iinfo(np.int64).max:
+        keys = codes.astype(np.int64) * stride + rel
+        return np.searchsorted(keys, keys - window_ns, side="right")
+
+    # Spans too wide to offset without overflow: search each device segment separately
+    starts = np.empty(len(ts_ns), dtype=np.int64)
+    bounds = np.append(np.unique(segment_starts), len(ts_ns))
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        seg = ts_ns[lo:hi]
+        starts[lo:hi] = lo + np.searchsorted(seg, seg - window_ns, side="right")
+    return starts
+
+
+def compute_device_aggregates(df, window=ROLLING_WINDOW, time_window=ROLLING_TIME_WINDOW):
+    """
+    Per-device hour/day averages and trailing rolling means in one sort.
+
+    Rows are sorted once by (device_id, event_ts); group means are bincount reductions over
+    dense integer keys and rolling means are prefix-sum differences, so the cost is one
+    O(n log n) sort plus a handful of vectorized O(n) passes regardless of device count.
+    `time_window` (e.g. "7D") switches the rolling frame from `window` rows to a time range
+    on event_ts. Returns a new DataFrame sorted by device_id, event_ts.
+    """
+    codes = sorted_codes(df["device_id"])
+    ts_ns = df["event_ts"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    has_ts = ts_ns != np.iinfo(np.int64).min
+
+    # NaT sorts last within a device, as sort_values does
+    order = np.lexsort((np.where(has_ts, ts_ns, np.iinfo(np.int64).max), codes))
+    out = df.iloc[order].reset_index(drop=True)
+    codes, ts_ns, has_ts = codes[order], ts_ns[order], has_ts[order]
+
+    # Rows without a device_id (or event_ts for time-keyed groups) are left out of
+    # those groups, as groupby does
+    has_device = codes >= 0
+    has_key = has_device & has_ts
+    n_devices = int(codes.max()) + 1 if has_device.any() else 0
+    safe_codes = np.where(has_device, codes, n_devices)
+
+    # Device segments, and (device, day) segments within them, are contiguous after the sort
+    rows = np.arange(len(out))
+    is_start = np.ones(len(out), dtype=bool)
+    is_start[1:] = codes[1:] != codes[:-1]
+    segment_starts = np.maximum.accumulate(np.where(is_start, rows, 0))
+
+    days = np.where(has_ts, ts_ns // NS_PER_DAY, 0)
+    day_change = is_start.copy()
+    day_change[1:] |= days[1:] != days[:-1]
+    day_keys = np.cumsum(day_change) - 1
+
+    hours = out["event_hour"].fillna(0).to_numpy(dtype=np.int64)
+    hour_keys = safe_codes * 24 + hours
+
+    if time_window is not None:
+        window_ns = int(pd.Timedelta(time_window).value)
+        # NaT rows sit at the end of their device segment; pin them to the latest
+        # timestamp so the keys stay sorted (their values are masked out anyway)
+        fill_ts = ts_ns[has_ts].max() if has_ts.any() else 0
+        left = time_window_starts(safe_codes, np.where(has_ts, ts_ns, fill_ts), segment_starts, window_ns)
+        rolling_mask = has_key
+    else:
+        left = row_window_starts(segment_starts, window)
+        rolling_mask = has_device
+
+    results = {}
+    for column, suffix in AGGREGATE_COLUMNS.items():
+        values = out[column].to_numpy(dtype=np.float64)
+        key_values = np.where(has_key, values, np.nan)
+        hour_avg = _group_mean(hour_keys, key_values, (n_devices + 1) * 24)
+        day_avg = _group_mean(day_keys, key_values, len(out))
+        rolling = _window_mean(np.where(rolling_mask, values, np.nan), left)
+
+        results[f"hour_avg_{suffix}"] = np.where(has_key, hour_avg, np.nan)
+        results[f"day_avg_{suffix}"] = np.where(has_key, day_avg, np.nan)
+        results[f"rolling_7d_{suffix}"] = np.where(rolling_mask, rolling, np.nan)
+
+    # Same column order the groupby implementation produced
+    for kind in ["hour_avg", "day_avg", "rolling_7d"]:
+        for suffix in AGGREGATE_COLUMNS.values():
+            out[f"{kind}_{suffix}"] = results[f"{kind}_{suffix}"]
+    return out
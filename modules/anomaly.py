@@ -0,0 +1,205 @@
+import os
+import json
+import fcntl
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime
+from contextlib import contextmanager
+from modules.aggregation import AGGREGATE_COLUMNS
+from modules.utils.constants import (
+    ANOMALY_KEY,
+    ANOMALY_Z_THRESHOLD,
+    ANOMALY_MIN_COUNT,
+    ANOMALY_STATE_PATH,
+    ANOMALY_STATE_BATCHES,
+    TEMPERATURE_HOT_THRESHOLD,
+    TEMPERATURE_COLD_THRESHOLD,
+    HUMIDITY_THRESHOLD
+)
+
+# Folded history of batches beyond the newest ANOMALY_STATE_BATCHES
+BASE_BATCH = "__base__"
+# Parquet metadata of the state file: ids of the batches folded into the base rows
+FOLDED_KEY = b"folded_batches"
+MOMENT_COLUMNS = [f"{suffix}_{stat}" for suffix in AGGREGATE_COLUMNS.values() for stat in ("count", "mean", "m2")]
+
+MOMENT_SCHEMA = pa.schema(
+    [("key", pa.string()), ("batch_id", pa.string()), ("updated_at", pa.timestamp("us"))]
+    + [(col, pa.float64()) for col in MOMENT_COLUMNS]
+)
+
+# Static thresholds (low, high) per calibrated column: the fallback rule
+STATIC_BOUNDS = {
+    "calibrated_temperature": (TEMPERATURE_COLD_THRESHOLD, TEMPERATURE_HOT_THRESHOLD),
+    "calibrated_humidity": (HUMIDITY_THRESHOLD, None),
+}
+
+
+def static_flags(values, column):
+    """The global threshold rule for one calibrated column (NaN is never flagged)."""
+    low, high = STATIC_BOUNDS[column]
+    flags = np.zeros(len(values), dtype=bool)
+    with np.errstate(invalid="ignore"):
+        if low is not None:
+            flags |= values < low
+        if high is not None:
+            flags |= values > high
+    return flags
+
+
+def batch_moments(df, key=ANOMALY_KEY):
+    """Per-key count, mean and M2 (sum of squared deviations) of each calibrated column."""
+    frame = df[[key] + list(AGGREGATE_COLUMNS)].astype({col: "float64" for col in AGGREGATE_COLUMNS})
+    grouped = frame.groupby(key, sort=False, observed=True)
+    moments = pd.DataFrame({"key": grouped.size().index.astype(str)})
+    for column, suffix in AGGREGATE_COLUMNS.items():
+        count = grouped[column].count().to_numpy(dtype=np.float64)
+        moments[f"{suffix}_count"] = count
+        moments[f"{suffix}_mean"] = grouped[column].mean().to_numpy()
+        moments[f"{suffix}_m2"] = np.nan_to_num(grouped[column].var(ddof=0).to_numpy()) * count
+    return moments
+
+
+def combine_moments(moments, by="key"):
+    """
+    Merge Welford moments of several batches per key (Chan et al. parallel update).
+
+    count = sum(n), mean = sum(n * mean) / count, M2 = sum(M2) + sum(n * (mean_i - mean)^2).
+    """
+    frame = moments[[by]].copy()
+    combined = {}
+    for suffix in AGGREGATE_COLUMNS.values():
+        n, mean, m2 = (moments[f"{suffix}_{stat}"].to_numpy(dtype=np.float64) for stat in ("count", "mean", "m2"))
+        mean = np.where(n > 0, mean, 0.0)
+        frame["__n"] = n
+        frame["__weighted"] = n * mean
+        totals = frame.groupby(by)[["__n", "__weighted"]].transform("sum")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            total_mean = totals["__weighted"].to_numpy() / totals["__n"].to_numpy()
+        frame["__spread"] = np.nan_to_num(m2) + n * np.nan_to_num(mean - total_mean) ** 2
+
+        sums = frame.groupby(by)[["__n", "__weighted", "__spread"]].sum()
+        combined[f"{suffix}_count"] = sums["__n"]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            combined[f"{suffix}_mean"] = sums["__weighted"] / sums["__n"]
+        combined[f"{suffix}_m2"] = sums["__spread"]
+    return pd.DataFrame(combined).rename_axis(by).reset_index()
+
+
+class DeviceStatsStore:
+    """
+    Persisted per-key (device or device type) Welford moments of the calibrated readings.
+
+    Each run stores the moments of its own rows under its batch id, so a retried or cleared
+    run replaces them instead of counting its rows twice. Only the newest `keep_batches`
+    batches stay separate; older ones are folded into one base row per key, which keeps
+    the state O(keys) regardless of how many runs have been seen. Folded batch ids are kept
+    in the file's metadata, and a later update of one of them (a late retry or backfill)
+    is ignored, since its moments can no longer be told apart from the base.
+    """
+
+    def __init__(self, path=ANOMALY_STATE_PATH, keep_batches=ANOMALY_STATE_BATCHES):
+        self.path = path
+        self.keep_batches = keep_batches
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        # (moments, folded batch ids)
+        if not os.path.exists(self.path):
+            return MOMENT_SCHEMA.empty_table().to_pandas(), set()
+        table = pq.read_table(self.path)
+        folded = json.loads((table.schema.metadata or {}).get(FOLDED_KEY, b"[]"))
+        return table.to_pandas(), set(folded)
+
+    def read(self):
+        return self._read()[0]
+
+    def folded_batches(self):
+        return self._read()[1]
+
+    def update(self, moments, batch_id):
+        """Replace this batch's moments, persist, and return the baseline of every other batch per key."""
+        moments = moments.assign(batch_id=batch_id, updated_at=pd.Timestamp(datetime.utcnow()))
+        with self._locked():
+            state, folded = self._read()
+            if batch_id in folded:
+                # Already in the base rows: adding it again would count its rows twice
+                logging.warning(f"Anomaly state: batch {batch_id} was folded into the base, its update is ignored")
+                return combine_moments(state) if len(state) else pd.DataFrame(columns=["key"] + MOMENT_COLUMNS)
+
+            state = state[state["batch_id"] != batch_id]
+            baseline = combine_moments(state) if len(state) else None
+            state = pd.concat([state, moments[MOMENT_SCHEMA.names]], ignore_index=True)
+
+            # Fold everything but the newest keep_batches batches into each key's base row
+            # (ties in time keep the later-appended batch as newer)
+            batches = state[state["batch_id"] != BASE_BATCH].iloc[::-1].groupby("batch_id", sort=False)["updated_at"].max()
+            newest = batches.sort_values(ascending=False, kind="mergesort").index[:self.keep_batches]
+            fold = ~state["batch_id"].isin(newest).to_numpy()
+            if fold.any():
+                folded |= set(state.loc[fold, "batch_id"]) - {BASE_BATCH}
+                base = combine_moments(state[fold]).assign(batch_id=BASE_BATCH, updated_at=state.loc[fold, "updated_at"].min())
+                state = pd.concat([state[~fold], base[MOMENT_SCHEMA.names]], ignore_index=True)
+
+            table = pa.Table.from_pandas(state, schema=MOMENT_SCHEMA, preserve_index=False)
+            table = table.replace_schema_metadata({FOLDED_KEY: json.dumps(sorted(folded)).encode()})
+            tmp_path = f"{self.path}.tmp"
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, self.path)
+
+        if baseline is None:
+            baseline = pd.DataFrame(columns=["key"] + MOMENT_COLUMNS)
+        return baseline
+
+
+def score_frame(df, baseline, key=ANOMALY_KEY, z_threshold=ANOMALY_Z_THRESHOLD, min_count=ANOMALY_MIN_COUNT):
+    """
+    (anomaly_flag, anomaly_score) per row against the baseline moments of the row's key.
+
+    The score is the largest |z| over the calibrated columns. A column is judged by z-score
+    where its key has at least `min_count` earlier readings with non-zero spread, and by the
+    static thresholds otherwise (new devices, unknown keys).
+    """
+    # Null and unknown keys resolve to -1: no baseline
+    codes = pd.Index(baseline["key"]).get_indexer(df[key].astype(object))
+
+    flags = np.zeros(len(df), dtype=bool)
+    score = np.full(len(df), np.nan)
+    for column, suffix in AGGREGATE_COLUMNS.items():
+        # Trailing slot: rows without a baseline gather count 0
+        count, mean, m2 = (
+            np.append(baseline[f"{suffix}_{stat}"].to_numpy(dtype=np.float64), fill)[codes]
+            for stat, fill in (("count", 0.0), ("mean", np.nan), ("m2", np.nan))
+        )
+        values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.sqrt(m2 / count)
+            scored = (count >= min_count) & (std > 0)
+            z = np.where(scored, np.abs(values - mean) / std, np.nan)
+            score = np.fmax(score, z)
+            flags |= scored & (z > z_threshold)
+        flags |= ~scored & static_flags(values, column)
+    return flags, score
+
+
+def apply_anomaly_model(df, batch_id, store=None, key=ANOMALY_KEY):
+    """Update the persisted moments with this batch and flag its rows against the earlier batches."""
+    baseline = (store or DeviceStatsStore()).update(batch_moments(df, key), batch_id)
+    flags, score = score_frame(df, baseline, key)
+    out = df.copy(deep=False)
+    out["anomaly_flag"] = flags
+    out["anomaly_score"] = score
+    logging.info(f"Anomaly model ({key}): {int(flags.sum())} of {len(df)} rows flagged against {len(baseline)} baselines")
+    return out
@@ -0,0 +1,98 @@
+import os
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from collections import OrderedDict
+from modules.utils.constants import CONFIG_CACHE_DIR
+from modules.config_cache import DeviceConfigCache, table_version
+
+SENSORS = ["temperature", "humidity"]
+LOOKUP_CACHE_SIZE = 4
+
+
+class CalibrationLookup:
+    """
+    Device config as contiguous per-device arrays, indexed by integer device code.
+
+    Telemetry device ids are factorized once, each distinct id is resolved against the
+    config index, and every config column is attached with a single gather; calibration is
+    then `value * scale + offset` over float64 buffers. Devices missing from config get
+    NaN/None attributes, as the left merge did. Duplicate config rows keep the last one.
+    """
+
+    def __init__(self, config, version=None):
+        config = config if isinstance(config, pd.DataFrame) else config.to_pandas()
+        config = config.drop_duplicates("device_id", keep="last").reset_index(drop=True)
+        self.version = version
+        self.index = pd.Index(config["device_id"])
+        # String attributes (device_type) are attached as categoricals, one code per reading
+        self.columns = {
+            col: (config[col].astype("category") if pd.api.types.is_string_dtype(config[col]) else config[col]).array
+            for col in config.columns if col != "device_id"
+        }
+        # Trailing NaN slot: code -1 (missing device) gathers NaN
+        self.scale = np.append(config["scale"].to_numpy(dtype=np.float64, na_value=np.nan), np.nan)
+        self.offset = np.append(config["offset"].to_numpy(dtype=np.float64, na_value=np.nan), np.nan)
+
+    def __len__(self):
+        return len(self.index)
+
+    def device_codes(self, device_ids):
+        # Hash each distinct telemetry id once, then broadcast its config row to all readings
+        codes, uniques = pd.factorize(device_ids)
+        # Trailing -1: null device ids (code -1) resolve to "missing"
+        positions = np.append(self.index.get_indexer(uniques), -1)
+        return positions[codes], uniques[positions[:-1] < 0]
+
+    def apply(self, telemetry_df):
+        rows, missing = self.device_codes(telemetry_df["device_id"])
+        if len(missing):
+            logging.warning(
+                f"{len(missing)} devices missing from config {self.version}: "
+                f"{', '.join(map(str, missing[:10]))}{' ...' if len(missing) > 10 else ''}"
+            )
+
+        # Shallow copy: telemetry buffers are shared, only new columns are allocated
+        out = telemetry_df.copy(deep=False)
+        for col, values in self.columns.items():
+            out[col] = pd.api.extensions.take(values, rows, allow_fill=True)
+
+        scale, offset = self.scale[rows], self.offset[rows]
+        for sensor in SENSORS:
+            values = telemetry_df[sensor].to_numpy(dtype=np.float64, na_value=np.nan)
+            out[f"calibrated_{sensor}"] = values * scale + offset
+        return out, list(missing)
+
+
+_lookups = OrderedDict()
+_lookups_lock = threading.Lock()
+
+
+def load_calibration_lookup(cache_dir=CONFIG_CACHE_DIR):
+    """Lookup for the cached config, built once per config version (path + etag)."""
+    table_path = os.path.join(cache_dir, "devices.parquet")
+    if not os.path.exists(table_path):
+        raise FileNotFoundError(f"Device config cache is empty: {table_path}")
+    # Version and rows come from one open file, so a refresh swapping it meanwhile can't
+    # mix them; tables cached before the version was embedded fall back to the manifest
+    with pq.ParquetFile(table_path) as config_file:
+        version = table_version(config_file.schema_arrow)
+        if version is None:
+            manifest = DeviceConfigCache(None, cache_dir=cache_dir).read_manifest()
+            version = manifest["version"] if manifest else None
+
+        with _lookups_lock:
+            key = (cache_dir, version)
+            if version is not None and key in _lookups:
+                _lookups.move_to_end(key)
+                return _lookups[key]
+
+            lookup = CalibrationLookup(config_file.read(), version)
+            logging.info(f"Built calibration lookup for {len(lookup)} devices (config {version})")
+            if version is not None:
+                _lookups[key] = lookup
+                while len(_lookups) > LOOKUP_CACHE_SIZE:
+                    _lookups.popitem(last=False)
+            return lookup
@@ -0,0 +1,176 @@
+import os
+import fcntl
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from modules.utils.constants import CHECKPOINT_BACKEND, CHECKPOINT_DB, CHECKPOINT_FILE
+
+
+def object_version(file_info):
+    # pyarrow's S3 listing exposes size + last-modified rather than the raw ETag;
+    # together they change whenever an object is re-uploaded
+    mtime_ns = file_info.mtime_ns if file_info.mtime_ns is not None else 0
+    return f"{file_info.size}-{mtime_ns}"
+
+
+class TextCheckpointStore:
+    """Legacy append-only processed_files.txt checkpoint (one path per line)."""
+
+    def __init__(self, path=CHECKPOINT_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def is_processed(self, file_path, etag=None, size=None):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as f:
+            return file_path in f.read().splitlines()
+
+    def mark(self, file_path, etag=None, size=None, row_count=None):
+        self.mark_many([{"path": file_path}])
+
+    def mark_many(self, records):
+        # Exclusive lock so concurrent writers can't interleave partial lines
+        with open(self.path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.writelines(f"{record['path']}\n" for record in records)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SQLiteCheckpointStore:
+    """
+    Indexed checkpoint store keyed by object path.
+
+    Records etag, size and row count per file so a lookup is a single primary-key
+    probe and a re-uploaded object (different etag/size) is treated as unprocessed.
+    """
+
+    def __init__(self, db_path=CHECKPOINT_DB, legacy_file=CHECKPOINT_FILE):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+        # isolation_level=None: transactions are managed explicitly in mark_many
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS processed_files (
+                path TEXT PRIMARY KEY,
+                etag TEXT,
+                size INTEGER,
+                row_count INTEGER,
+                processed_at TEXT NOT NULL
+            );
+        """)
+
+        if legacy_file and os.path.exists(legacy_file):
+            self.migrate_from_text(legacy_file)
+
+    def get(self, file_path):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path, etag, size, row_count, processed_at FROM processed_files WHERE path = ?",
+                (file_path,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(["path", "etag", "size", "row_count", "processed_at"], row))
+
+    def is_processed(self, file_path, etag=None, size=None):
+        record = self.get(file_path)
+        if record is None:
+            return False
+
+        # Same path but different content means the object was re-uploaded
+        if etag is not None and record["etag"] is not None and etag != record["etag"]:
+            logging.info(f"Checkpoint etag changed for {file_path}: {record['etag']} -> {etag}")
+            return False
+        if size is not None and record["size"] is not None and size != record["size"]:
+            logging.info(f"Checkpoint size changed for {file_path}: {record['size']} -> {size}")
+            return False
+        return True
+
+    def mark(self, file_path, etag=None, size=None, row_count=None):
+        self.mark_many([{"path": file_path, "etag": etag, "size": size, "row_count": row_count}])
+
+    def _upsert(self, records):
+        processed_at = datetime.utcnow().isoformat()
+        self._conn.executemany("""
+            INSERT INTO processed_files (path, etag, size, row_count, processed_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                etag = excluded.etag,
+                size = excluded.size,
+                row_count = excluded.row_count,
+                processed_at = excluded.processed_at;
+        """, [(r["path"], r.get("etag"), r.get("size"), r.get("row_count"), processed_at) for r in records])
+
+    def mark_many(self, records):
+        if not records:
+            return
+
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so concurrent workers queue
+            # on the busy timeout instead of failing halfway through the batch
+            self._conn.execute("BEGIN IMMEDIATE;")
+            try:
+                self._upsert(records)
+                self._conn.execute("COMMIT;")
+            except Exception:
+                self._conn.execute("ROLLBACK;")
+                raise
+
+    def migrate_from_text(self, legacy_file):
+        # Check, import and rename under the write lock: of several workers opening the
+        # store at once, the first migrates and the others find the file gone
+        migrated = f"{legacy_file}.migrated"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE;")
+            try:
+                try:
+                    with open(legacy_file, 'r') as f:
+                        paths = [line for line in f.read().splitlines() if line]
+                except FileNotFoundError:
+                    self._conn.execute("ROLLBACK;")
+                    return
+
+                # Keep any metadata already recorded for paths that exist in both stores
+                existing = {row[0] for row in self._conn.execute("SELECT path FROM processed_files").fetchall()}
+                self._upsert([{"path": path} for path in dict.fromkeys(paths) if path not in existing])
+                os.replace(legacy_file, migrated)
+                try:
+                    self._conn.execute("COMMIT;")
+                except Exception:
+                    os.replace(migrated, legacy_file)
+                    raise
+            except Exception:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK;")
+                raise
+        logging.info(f"Migrated {len(paths)} checkpoint entries from {legacy_file} to {self.db_path}")
+
+    def close(self):
+        self._conn.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_checkpoint_store(backend=CHECKPOINT_BACKEND):
+    # One store per backend per process (keyed by pid so forked workers never share
+    # the parent's sqlite connection); the connection is reused across tasks
+    key = (backend, os.getpid())
+    with _stores_lock:
+        if key not in _stores:
+            if backend == "sqlite":
+                _stores[key] = SQLiteCheckpointStore()
+            elif backend == "text":
+                _stores[key] = TextCheckpointStore()
+            else:
+                raise ValueError(f"Unknown checkpoint backend: {backend}")
+        return _stores[key]
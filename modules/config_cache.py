@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from modules.checkpoint import object_version
+from modules.utils.constants import BUCKET_NAME, CONFIG_PREFIX, CONFIG_CACHE_DIR, CONFIG_CACHE_MAX_AGE_SEC
+
+# Typed device config; parsed once per config version instead of on every run
+CONFIG_SCHEMA = pa.schema([
+    ("device_id", pa.string()),
+    ("device_type", pa.string()),
+    ("scale", pa.float64()),
+    ("offset", pa.float64()),
+    ("calibration_date", pa.date32()),
+])
+# Config version (path@etag) in the cached table's Parquet metadata, so a reader of the
+# table never pairs its rows with another version's manifest
+VERSION_KEY = b"config_version"
+
+
+def table_version(schema):
+    version = (schema.metadata or {}).get(VERSION_KEY)
+    return version.decode() if version is not None else None
+
+
+class DeviceConfigCache:
+    """
+    Local Parquet copy of the latest device config CSV, keyed on the object's path + etag.
+
+    Config lands weekly under raw/config/{date}/, so a run only lists the date folders
+    (non-recursive) and the newest one; the CSV is downloaded and parsed only when that
+    object changes. Within max_age seconds of the last check no S3 call is made at all.
+    Refreshes are serialized across processes by a file lock; the table is swapped in
+    before its manifest, and carries its own version.
+    """
+
+    def __init__(self, filesystem, cache_dir=CONFIG_CACHE_DIR, config_root=f"{BUCKET_NAME}/{CONFIG_PREFIX}",
+                 max_age=CONFIG_CACHE_MAX_AGE_SEC):
+        self.filesystem = filesystem
+        self.cache_dir = cache_dir
+        self.config_root = config_root
+        self.max_age = max_age
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.table_path = os.path.join(cache_dir, "devices.parquet")
+        self._lock = threading.Lock()
+
+    def latest_object(self):
+        entries = self.filesystem.get_file_info(pafs.FileSelector(self.config_root, allow_not_found=True))
+        candidates = [info for info in entries if info.is_file and info.path.endswith(".csv")]
+
+        # Newest non-empty date folder holds the lexically latest path
+        folders = sorted((info for info in entries if info.type == pafs.FileType.Directory),
+                         key=lambda info: info.path, reverse=True)
+        for folder in folders:
+            files = self.filesystem.get_file_info(pafs.FileSelector(folder.path, recursive=True))
+            csv_files = [info for info in files if info.is_file and info.path.endswith(".csv")]
+            if csv_files:
+                candidates.extend(csv_files)
+                break
+
+        if not candidates:
+            raise FileNotFoundError(f"No config CSV files found in: {self.config_root}")
+        return max(candidates, key=lambda info: info.path)
+
+    @contextmanager
+    def _locked(self):
+        # Threads of this process, then other processes (concurrent DAG runs)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock, open(os.path.join(self.cache_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _replace(self, path, write):
+        # Unique tmp name in the target directory, renamed over `path` once complete
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path) or not os.path.exists(self.table_path):
+            return None
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def resolve(self, force=False):
+        """Refresh the cache if the latest config object changed; return its manifest."""
+        with self._locked():
+            manifest = self.read_manifest()
+            if manifest and not force and time.time() - manifest["checked_at"] < self.max_age:
+                return manifest
+
+            latest = self.latest_object()
+            etag = object_version(latest)
+            if manifest and not force and manifest["path"] == latest.path and manifest["etag"] == etag:
+                manifest["checked_at"] = time.time()
+                self._write_manifest(manifest)
+                return manifest
+
+            logging.info(f"Device config changed, downloading s3://{latest.path}")
+            with self.filesystem.open_input_stream(latest.path) as stream:
+                table = pacsv.read_csv(
+                    stream,
+                    convert_options=pacsv.ConvertOptions(
+                        column_types={field.name: field.type for field in CONFIG_SCHEMA}
+                    )
+                )
+
+            version = f"{latest.path}@{etag}"
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), VERSION_KEY: version.encode()})
+            self._replace(self.table_path, lambda tmp_path: pq.write_table(table, tmp_path))
+
+            # Only after the table it describes is in place
+            manifest = {
+                "path": latest.path,
+                "etag": etag,
+                "version": version,
+                "num_rows": table.num_rows,
+                "checked_at": time.time(),
+            }
+            self._write_manifest(manifest)
+            return manifest
+
+    def _write_manifest(self, manifest):
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(manifest, f)
+        self._replace(self.manifest_path, write)
+
+
+def load_device_config(cache_dir=CONFIG_CACHE_DIR):
+    # Local read only; ingest_raw_data is responsible for refreshing the cache
+    table_path = os.path.join(cache_dir, "devices.parquet")
+    if not os.path.exists(table_path):
+        raise FileNotFoundError(f"Device config cache is empty: {table_path}")
+    return pq.read_table(table_path)
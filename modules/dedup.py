@@ -0,0 +1,229 @@
+import os
+import glob
+import shutil
+import fcntl
+import logging
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from contextlib import contextmanager
+from modules.utils.constants import DEDUP_INDEX_DIR, DEDUP_INDEX_COMPACT_FILES
+
+INDEX_SCHEMA = pa.schema([("key_hash", pa.uint64()), ("device_id", pa.string()), ("event_ts", pa.timestamp("us"))])
+PENDING_SUFFIX = ".pending.parquet"
+# Last load snapshot whose keys are indexed; the index covers the whole table up to it
+MARKER = "_indexed_through"
+
+
+def key_columns(table):
+    # (event_date, device_id, event_ts in microseconds) of rows with a complete key
+    device_ids = table.column("device_id")
+    if pa.types.is_dictionary(device_ids.type):
+        device_ids = device_ids.cast(device_ids.type.value_type)
+    event_ts = pc.cast(table.column("event_ts"), pa.timestamp("us"))
+    valid = pc.and_(pc.is_valid(device_ids), pc.is_valid(event_ts))
+    device_ids, event_ts = device_ids.filter(valid), event_ts.filter(valid)
+    dates = pc.strftime(event_ts, format="%Y-%m-%d").to_numpy(zero_copy_only=False)
+    return dates, device_ids.to_numpy(zero_copy_only=False), event_ts.cast(pa.int64()).to_numpy(), valid
+
+
+def key_hashes(device_ids, event_ts):
+    # 64-bit hash of the (device_id, event_ts) key; hits are confirmed against the exact keys
+    return pd.util.hash_pandas_object(pd.DataFrame({"device_id": device_ids, "event_ts": event_ts}), index=False).to_numpy()
+
+
+def sorted_keys(keys):
+    # Distinct exact keys sorted by hash, as an index file table
+    keys = keys[INDEX_SCHEMA.names].drop_duplicates().sort_values("key_hash", kind="mergesort")
+    return pa.Table.from_pandas(keys.astype({"event_ts": "datetime64[us]"}), schema=INDEX_SCHEMA, preserve_index=False)
+
+
+class DedupIndex:
+    """
+    Keys (device_id, event_ts) already stored in the telemetry table, one directory per event_date.
+
+    Each committed load adds one file per date, named after its snapshot id and sorted by key
+    hash; a probe is a vectorized searchsorted over a date's hashes, with hits confirmed
+    against the exact keys, so there are no false positives. Files are written as pending
+    inside the load transaction and promoted after COMMIT; `recover` settles pending files
+    left by a crash against the snapshot log, so retries and backfills never see keys of a
+    load that did not commit.
+    """
+
+    def __init__(self, root=DEDUP_INDEX_DIR, compact_files=DEDUP_INDEX_COMPACT_FILES):
+        self.root = root
+        self.compact_files = compact_files
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _date_dir(self, date):
+        return os.path.join(self.root, f"event_date={date}")
+
+    def _files(self, date, include_pending):
+        files = glob.glob(os.path.join(self._date_dir(date), "*.parquet"))
+        return sorted(path for path in files if include_pending or not path.endswith(PENDING_SUFFIX))
+
+    def indexed_through(self):
+        # None until bootstrapped: the index may be missing keys of the table
+        try:
+            with open(os.path.join(self.root, MARKER)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _mark(self, snapshot_id):
+        path = os.path.join(self.root, MARKER)
+        with open(f"{path}.tmp", "w") as f:
+            f.write(str(snapshot_id))
+        os.replace(f"{path}.tmp", path)
+
+    def _keys(self, date, include_pending):
+        # Sorted hashes (plus exact keys) of a date, cached until its file set changes
+        files = self._files(date, include_pending)
+        signature = tuple((path, os.path.getmtime(path)) for path in files)
+        with self._cache_lock:
+            cached = self._cache.get((date, include_pending))
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+
+        if files:
+            table = pa.concat_tables([pq.read_table(path, schema=INDEX_SCHEMA) for path in files])
+            order = np.argsort(table.column("key_hash").to_numpy(), kind="stable")
+            keys = (
+                table.column("key_hash").to_numpy()[order],
+                table.column("device_id").to_numpy(zero_copy_only=False)[order],
+                table.column("event_ts").cast(pa.int64()).to_numpy()[order],
+            )
+        else:
+            keys = (np.zeros(0, np.uint64), np.zeros(0, object), np.zeros(0, np.int64))
+        with self._cache_lock:
+            self._cache[(date, include_pending)] = (signature, keys)
+        return keys
+
+    def contains(self, table, include_pending=False):
+        """Boolean mask: which rows of `table` have a key already in the index."""
+        dates, device_ids, event_ts, valid = key_columns(table)
+        hashes = key_hashes(device_ids, event_ts)
+        found = np.zeros(len(hashes), dtype=bool)
+        for date in np.unique(dates):
+            rows = np.flatnonzero(dates == date)
+            index_hashes, index_devices, index_ts = self._keys(date, include_pending)
+            if not len(index_hashes):
+                continue
+            left = np.searchsorted(index_hashes, hashes[rows], side="left")
+            right = np.searchsorted(index_hashes, hashes[rows], side="right")
+            hit = np.flatnonzero(right > left)
+            # Confirm against the first key with the same hash; only hash collisions inside
+            # the index (several distinct keys per hash) need a look at the whole range
+            first = left[hit]
+            exact = (index_devices[first] == device_ids[rows[hit]]) & (index_ts[first] == event_ts[rows[hit]])
+            found[rows[hit[exact]]] = True
+            for i in hit[~exact & (right[hit] - left[hit] > 1)]:
+                row, span = rows[i], slice(left[i], right[i])
+                found[row] = bool(np.any((index_devices[span] == device_ids[row]) & (index_ts[span] == event_ts[row])))
+
+        mask = np.zeros(len(valid), dtype=bool)
+        mask[valid.to_numpy(zero_copy_only=False)] = found
+        return mask
+
+    def stage(self, table, snapshot_id):
+        """Write the keys of `table` as pending files of `snapshot_id`; returns the paths."""
+        dates, device_ids, event_ts, _ = key_columns(table)
+        keys = pd.DataFrame({
+            "key_hash": key_hashes(device_ids, event_ts),
+            "device_id": device_ids,
+            "event_ts": event_ts,
+            "event_date": dates,
+        })
+        paths = []
+        with self._locked():
+            for date, date_keys in keys.groupby("event_date", sort=True):
+                os.makedirs(self._date_dir(date), exist_ok=True)
+                path = os.path.join(self._date_dir(date), f"{snapshot_id:012d}{PENDING_SUFFIX}")
+                pq.write_table(sorted_keys(date_keys), path)
+                paths.append(path)
+        return paths
+
+    def _settle(self, snapshot_id, committed):
+        # Promote (committed) or drop (rolled back) the pending files of a snapshot
+        paths = glob.glob(os.path.join(self.root, "event_date=*", f"{snapshot_id:012d}{PENDING_SUFFIX}"))
+        for path in paths:
+            if committed:
+                os.replace(path, path[:-len(PENDING_SUFFIX)] + ".parquet")
+            else:
+                os.remove(path)
+        return [os.path.dirname(path) for path in paths]
+
+    def commit(self, snapshot_id):
+        with self._locked():
+            date_dirs = self._settle(snapshot_id, committed=True)
+            self._mark(snapshot_id)
+        for date in (os.path.basename(date_dir).split("=", 1)[1] for date_dir in date_dirs):
+            if len(self._files(date, include_pending=False)) > self.compact_files:
+                self.compact(date)
+
+    def abort(self, snapshot_id):
+        with self._locked():
+            self._settle(snapshot_id, committed=False)
+
+    def recover(self, last_snapshot_id):
+        """Settle pending files of an interrupted load: committed if the snapshot log has it."""
+        pending = glob.glob(os.path.join(self.root, "event_date=*", f"*{PENDING_SUFFIX}"))
+        snapshot_ids = {int(os.path.basename(path)[:-len(PENDING_SUFFIX)]) for path in pending}
+        with self._locked():
+            for snapshot_id in snapshot_ids:
+                committed = last_snapshot_id is not None and snapshot_id <= last_snapshot_id
+                logging.warning(f"Dedup index: {'promoting' if committed else 'dropping'} pending keys of snapshot {snapshot_id}")
+                self._settle(snapshot_id, committed)
+
+    def compact(self, date):
+        # Merge a date's committed files into one, keeping the newest snapshot id as its name
+        with self._locked():
+            files = self._files(date, include_pending=False)
+            if len(files) < 2:
+                return
+            keys = sorted_keys(pa.concat_tables([pq.read_table(path, schema=INDEX_SCHEMA) for path in files]).to_pandas())
+            path = files[-1]
+            pq.write_table(keys, f"{path}.tmp")
+            os.replace(f"{path}.tmp", path)
+            for old in files[:-1]:
+                os.remove(old)
+        logging.info(f"Dedup index: compacted {len(files)} files of {date} ({keys.num_rows} keys)")
+
+    def bootstrap(self, con, table_name, snapshot_id):
+        """Rebuild the index from every key in `table_name` (first use, or loads it missed)."""
+        with self._locked():
+            for date_dir in glob.glob(os.path.join(self.root, "event_date=*")):
+                shutil.rmtree(date_dir)
+        # Older DuckDB returns a Table here, newer a RecordBatchReader
+        rows = pa.table(con.execute(
+            f"SELECT device_id, event_ts FROM {table_name} WHERE device_id IS NOT NULL AND event_ts IS NOT NULL"
+        ).arrow())
+        self.stage(rows, snapshot_id)
+        self.commit(snapshot_id)
+        logging.info(f"Dedup index: indexed {rows.num_rows} keys of {table_name} through snapshot {snapshot_id}")
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_dedup_index(root=DEDUP_INDEX_DIR):
+    # One index per directory per process, so probes reuse the cached key arrays
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = DedupIndex(root)
+        return _indexes[root]
@@ -0,0 +1,291 @@
+import os
+import logging
+from datetime import datetime
+import duckdb
+import pandas as pd
+import pyarrow as pa
+from modules.utils.constants import (
+    CONFIG_CACHE_DIR,
+    INCREMENTAL_AGGREGATES,
+    ROLLING_WINDOW,
+    ROLLING_TIME_WINDOW,
+    TEMPERATURE_HOT_THRESHOLD,
+    TEMPERATURE_COLD_THRESHOLD,
+    HUMIDITY_THRESHOLD,
+    ANOMALY_DETECTOR,
+    ANOMALY_KEY,
+    ANOMALY_Z_THRESHOLD,
+    ANOMALY_MIN_COUNT,
+    TRANSFORM_MEMORY_LIMIT,
+    TRANSFORM_THREADS,
+    TRANSFORM_SPILL_DIR
+)
+from modules.aggregation import AGGREGATE_COLUMNS
+from modules.aggregate_state import AggregateStateStore, SUM_COLUMNS, AVERAGE_COLUMNS, state_averages
+from modules.anomaly import DeviceStatsStore, MOMENT_COLUMNS, STATIC_BOUNDS
+from modules.calibration import SENSORS
+from modules.utils.schema import TRANSFORMED_SCHEMA
+from modules.utils.parquet_profiles import get_profile, sort_columns, copy_options
+
+# Tie-break for rows sharing (device_id, event_ts): input order, as the pandas sort keeps it
+ROW_ORDER = ["__file", "__row"]
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _literal(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _finite(expr):
+    # pandas treats NaN as missing and writes it as null; DuckDB would propagate it
+    return f"CASE WHEN isnan({expr}) THEN NULL ELSE {expr} END"
+
+
+def _sql_type(data_type):
+    if pa.types.is_dictionary(data_type):
+        return "VARCHAR"
+    if pa.types.is_float32(data_type):
+        return "FLOAT"
+    if pa.types.is_int16(data_type):
+        return "SMALLINT"
+    if pa.types.is_date32(data_type):
+        return "DATE"
+    if pa.types.is_timestamp(data_type):
+        return "TIMESTAMP"
+    if pa.types.is_boolean(data_type):
+        return "BOOLEAN"
+    return None
+
+
+def connect(memory_limit=TRANSFORM_MEMORY_LIMIT, threads=TRANSFORM_THREADS, spill_dir=TRANSFORM_SPILL_DIR):
+    # Private in-memory database: operators spill to spill_dir instead of failing at the limit
+    os.makedirs(spill_dir, exist_ok=True)
+    config = {"temp_directory": spill_dir, "preserve_insertion_order": True}
+    if memory_limit:
+        config["memory_limit"] = memory_limit
+    if threads:
+        config["threads"] = threads
+    return duckdb.connect(database=":memory:", config=config)
+
+
+def _columns(con, relation):
+    return [(row[0], row[1]) for row in con.execute(f"DESCRIBE {relation}").fetchall()]
+
+
+def _aggregate_expressions(window, time_window):
+    # Same definitions as compute_device_aggregates: rows without device_id (or event_ts for
+    # the hour/day groups) get no aggregates; NaT rows sort last within their device
+    has_key = "device_id IS NOT NULL AND event_ts IS NOT NULL"
+    order = ", ".join(["event_ts NULLS LAST"] + ROW_ORDER)
+    expressions = {}
+    for column, suffix in AGGREGATE_COLUMNS.items():
+        value = _finite(column)
+        expressions[f"hour_avg_{suffix}"] = (
+            f"CASE WHEN {has_key} THEN AVG({value}) OVER (PARTITION BY device_id, event_hour) END"
+        )
+        expressions[f"day_avg_{suffix}"] = (
+            f"CASE WHEN {has_key} THEN AVG({value}) OVER (PARTITION BY device_id, event_date) END"
+        )
+        if time_window is None:
+            expressions[f"rolling_7d_{suffix}"] = (
+                f"CASE WHEN device_id IS NOT NULL THEN AVG({value}) OVER ("
+                f"PARTITION BY device_id ORDER BY {order} ROWS BETWEEN {window - 1} PRECEDING AND CURRENT ROW) END"
+            )
+            continue
+
+        # (ts - window, ts] up to the current row: running totals in row order minus the
+        # totals of rows at or before ts - window (a RANGE frame would also take in later ties)
+        micros = int(pd.Timedelta(time_window).value // 1000)
+        running = f"OVER (PARTITION BY device_id ORDER BY {order} ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW)"
+        expired = (
+            f"OVER (PARTITION BY device_id ORDER BY event_ts "
+            f"RANGE BETWEEN UNBOUNDED PRECEDING AND INTERVAL '{micros} microseconds' PRECEDING)"
+        )
+        window_sum = f"COALESCE(SUM({value}) {running}, 0) - COALESCE(SUM({value}) {expired}, 0)"
+        window_count = f"COUNT({value}) {running} - COALESCE(COUNT({value}) {expired}, 0)"
+        expressions[f"rolling_7d_{suffix}"] = (
+            f"CASE WHEN {has_key} AND {window_count} > 0 THEN ({window_sum}) / ({window_count}) END"
+        )
+    return expressions
+
+
+def _state_averages(con, batch_id):
+    # Hourly buckets are aggregated in DuckDB; only (device, hour) rows reach pandas
+    sums = ", ".join(
+        f"COALESCE(fsum({column}), 0) AS {suffix}_sum, COUNT({column}) AS {suffix}_count"
+        for column, suffix in AGGREGATE_COLUMNS.items()
+    )
+    buckets = con.execute(f"""
+        SELECT device_id, date_trunc('hour', event_ts) AS bucket_ts, {sums}
+        FROM calibrated
+        WHERE device_id IS NOT NULL AND event_ts IS NOT NULL
+        GROUP BY ALL
+    """).fetchdf()
+    buckets = buckets.astype({col: "float64" for col in SUM_COLUMNS})
+    state = AggregateStateStore().update(buckets, batch_id)
+    return state_averages(state)
+
+
+def _anomaly_baseline(con, batch_id, key):
+    # Batch moments per key in DuckDB; only one row per key reaches the pandas state store
+    moments = ", ".join(
+        f"COUNT({_finite(column)})::DOUBLE AS {suffix}_count, AVG({_finite(column)}) AS {suffix}_mean, "
+        f"COALESCE(VAR_POP({_finite(column)}), 0) * COUNT({_finite(column)}) AS {suffix}_m2"
+        for column, suffix in AGGREGATE_COLUMNS.items()
+    )
+    batch = con.execute(
+        f"SELECT CAST({_quote(key)} AS VARCHAR) AS key, {moments} FROM calibrated WHERE {_quote(key)} IS NOT NULL GROUP BY 1"
+    ).fetchdf()
+    return DeviceStatsStore().update(batch, batch_id)
+
+
+def _anomaly_expressions():
+    # score_frame in SQL over the joined baseline columns (b_<suffix>_<stat>)
+    flags, scores = [], []
+    for column, suffix in AGGREGATE_COLUMNS.items():
+        value = _finite(column)
+        std = f"sqrt(b_{suffix}_m2 / b_{suffix}_count)"
+        scored = f"COALESCE(b_{suffix}_count >= {ANOMALY_MIN_COUNT} AND {std} > 0, FALSE)"
+        z = f"CASE WHEN {scored} THEN abs({value} - b_{suffix}_mean) / {std} END"
+        low, high = STATIC_BOUNDS[column]
+        static = " OR ".join(
+            [f"COALESCE({value} < {low}, FALSE)"] * (low is not None) + [f"COALESCE({value} > {high}, FALSE)"] * (high is not None)
+        )
+        flags.append(f"CASE WHEN {scored} THEN COALESCE({z} > {ANOMALY_Z_THRESHOLD}, FALSE) ELSE {static} END")
+        scores.append(z)
+    return " OR ".join(f"({flag})" for flag in flags), f"greatest({', '.join(scores)})"
+
+
+def transform_dataset(telemetry_dir, output_path, batch_id="adhoc", config_path=None, incremental=INCREMENTAL_AGGREGATES,
+                      window=ROLLING_WINDOW, time_window=ROLLING_TIME_WINDOW, con=None,
+                      detector=ANOMALY_DETECTOR, anomaly_key=ANOMALY_KEY, profile=None):
+    """
+    The pandas transform (transform_frame) as one DuckDB query plan, streamed to Parquet.
+
+    Calibration join, derived fields, aggregates, anomaly flags and the final sort run in
+    DuckDB, which spills to disk past TRANSFORM_MEMORY_LIMIT and uses TRANSFORM_THREADS
+    cores. With `incremental` aggregates only the hourly buckets (one row per device-hour) go
+    through the pandas state store. Output columns, types and row order match the pandas
+    path, and the Parquet write profile's sort, row groups and codec apply as in
+    write_parquet. Returns (records, anomalies).
+    """
+    config_path = config_path or os.path.join(CONFIG_CACHE_DIR, "devices.parquet")
+    own_connection = con is None
+    con = con or connect()
+    try:
+        con.execute(f"""
+            CREATE OR REPLACE TEMP VIEW telemetry AS
+            SELECT * EXCLUDE (filename, file_row_number), filename AS __file, file_row_number AS __row
+            FROM read_parquet({_literal(os.path.join(telemetry_dir, "**", "*.parquet"))},
+                              filename = true, file_row_number = true, hive_partitioning = false, union_by_name = true)
+        """)
+        # Last row wins for duplicated device ids, as in CalibrationLookup
+        con.execute(f"""
+            CREATE OR REPLACE TEMP VIEW config AS
+            SELECT * EXCLUDE (file_row_number)
+            FROM read_parquet({_literal(config_path)}, file_row_number = true)
+            QUALIFY row_number() OVER (PARTITION BY device_id ORDER BY file_row_number DESC) = 1
+        """)
+
+        telemetry_cols = [(name, dtype) for name, dtype in _columns(con, "telemetry") if name not in ROW_ORDER]
+        config_cols = [(name, dtype) for name, dtype in _columns(con, "config") if name != "device_id"]
+
+        def passthrough(alias, name, dtype):
+            if name == "event_ts":
+                return f"CAST({alias}.event_ts AS TIMESTAMP) AS event_ts"
+            if dtype in ("FLOAT", "DOUBLE"):
+                return f"{_finite(f'{alias}.{_quote(name)}')} AS {_quote(name)}"
+            return f"{alias}.{_quote(name)}"
+
+        calibrated = [
+            f"{_finite(f't.{sensor}')}::DOUBLE * c.scale::DOUBLE + c.{_quote('offset')}::DOUBLE AS calibrated_{sensor}"
+            for sensor in SENSORS
+        ]
+        ingestion_ts = datetime.utcnow().isoformat(sep=" ")
+        con.execute(f"""
+            CREATE OR REPLACE TEMP VIEW calibrated AS
+            SELECT *, CAST(event_ts AS DATE) AS event_date, hour(event_ts) AS event_hour
+            FROM (
+                SELECT {", ".join([passthrough("t", n, d) for n, d in telemetry_cols] + [passthrough("c", n, d) for n, d in config_cols] + calibrated)},
+                       TIMESTAMP {_literal(ingestion_ts)} AS ingestion_ts, t.__file, t.__row
+                FROM telemetry AS t
+                LEFT JOIN config AS c ON c.device_id = t.device_id
+            )
+        """)
+
+        missing = con.execute(
+            "SELECT DISTINCT device_id FROM telemetry ANTI JOIN config USING (device_id) WHERE device_id IS NOT NULL ORDER BY 1"
+        ).fetchall()
+        if missing:
+            logging.warning(
+                f"{len(missing)} devices missing from config: "
+                f"{', '.join(row[0] for row in missing[:10])}{' ...' if len(missing) > 10 else ''}"
+            )
+
+        if incremental:
+            con.register("bucket_averages", _state_averages(con, batch_id))
+            aggregates = {col: f"a.{col}" for col in AVERAGE_COLUMNS}
+            source = (
+                "calibrated AS r LEFT JOIN bucket_averages AS a "
+                "ON a.device_id = r.device_id AND a.bucket_ts = date_trunc('hour', r.event_ts)"
+            )
+        else:
+            aggregates = _aggregate_expressions(window, time_window)
+            source = "calibrated AS r"
+
+        # Column order of the pandas output
+        base_cols = [name for name, _ in telemetry_cols + config_cols] + [
+            f"calibrated_{sensor}" for sensor in SENSORS
+        ] + ["ingestion_ts", "event_date", "event_hour"]
+        aggregate_cols = [f"{kind}_{suffix}" for kind in ["hour_avg", "day_avg", "rolling_7d"] for suffix in AGGREGATE_COLUMNS.values()]
+        anomaly = (
+            f"COALESCE(calibrated_temperature > {TEMPERATURE_HOT_THRESHOLD}, FALSE) "
+            f"OR COALESCE(calibrated_temperature < {TEMPERATURE_COLD_THRESHOLD}, FALSE) "
+            f"OR COALESCE(calibrated_humidity < {HUMIDITY_THRESHOLD}, FALSE)"
+        )
+
+        def output(name, expr):
+            sql_type = _sql_type(TRANSFORMED_SCHEMA.field(name).type) if name in TRANSFORMED_SCHEMA.names else None
+            if sql_type == "FLOAT":
+                expr = _finite(expr)
+            return f"CAST({expr} AS {sql_type}) AS {_quote(name)}" if sql_type else f"{expr} AS {_quote(name)}"
+
+        anomaly_cols = [output("anomaly_flag", anomaly)]
+        baseline_cols = []
+        if detector == "zscore":
+            # Per-key baselines of the earlier batches, as apply_anomaly_model
+            con.register("anomaly_baseline", _anomaly_baseline(con, batch_id, anomaly_key))
+            source += f" LEFT JOIN anomaly_baseline AS b ON b.key = CAST(r.{_quote(anomaly_key)} AS VARCHAR)"
+            baseline_cols = [f"b.{col} AS b_{col}" for col in MOMENT_COLUMNS]
+            flag, score = _anomaly_expressions()
+            anomaly_cols = [output("anomaly_flag", flag), output("anomaly_score", score)]
+
+        select = ", ".join([output(name, _quote(name)) for name in base_cols + aggregate_cols] + anomaly_cols)
+        inner = ", ".join([f"r.{_quote(name)}" for name in base_cols] + [
+            f"{expr} AS {col}" for col, expr in aggregates.items()
+        ] + baseline_cols + [f"r.{col}" for col in ROW_ORDER])
+
+        # The profile's sort (nulls last, as sort_table) ahead of the pandas row order
+        profile = get_profile(profile)
+        order = [f"{_quote(col)} NULLS LAST" for col in sort_columns(profile, TRANSFORMED_SCHEMA.names)]
+        order += ["device_id NULLS FIRST", "event_ts NULLS LAST"] + ROW_ORDER
+        tmp_path = f"{output_path}.tmp"
+        con.execute(f"""
+            COPY (
+                SELECT {select} FROM (SELECT {inner} FROM {source})
+                ORDER BY {", ".join(order)}
+            ) TO {_literal(tmp_path)} ({copy_options(profile)})
+        """)
+        os.replace(tmp_path, output_path)
+
+        records, anomalies = con.execute(
+            f"SELECT COUNT(*), COUNT(*) FILTER (WHERE anomaly_flag) FROM read_parquet({_literal(output_path)})"
+        ).fetchone()
+        logging.info(f"Transformed {records} rows with the DuckDB engine, added calibration, anomaly flags.")
+        return records, anomalies
+    finally:
+        if own_connection:
+            con.close()
@@ -1,98 +1,275 @@
 import os
+import time
+import shutil
+import itertools
+from functools import lru_cache
 import pandas as pd
 import logging
+import pyarrow as pa
+import pyarrow.dataset as ds
 import pyarrow.fs as pafs
 import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from modules.utils.constants import *
 from modules.utils.decorators import record_task_timing
+from modules.checkpoint import get_checkpoint_store, object_version
+from modules.config_cache import DeviceConfigCache
+from modules.dedup import get_dedup_index
+from modules.utils.profiling import hwm_rss_mb, peak_rss_mb, span, record
+from modules.utils.interim import HOUR_PARTITIONING, run_paths, publish_path
+from modules.utils.schema import TELEMETRY_SCHEMA, conform_table
 
 
-# Fork-safe pyarrow S3 client
-s3_fs = pafs.S3FileSystem(
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    endpoint_override="minio:9000",
-    scheme="http"
-)
+@lru_cache(maxsize=None)
+def get_s3_filesystem():
+    # Fork-safe pyarrow S3 client, or a local directory standing in for the bucket store.
+    # Created on first use rather than at import, so DAG parsing never builds a client
+    if RAW_DATA_ROOT:
+        return pafs.SubTreeFileSystem(RAW_DATA_ROOT, pafs.LocalFileSystem())
+    return pafs.S3FileSystem(
+        access_key=MINIO_ACCESS_KEY,
+        secret_key=MINIO_SECRET_KEY,
+        endpoint_override="minio:9000",
+        scheme="http"
+    )
 
+def is_already_processed(file_path, etag=None, size=None):
+    return get_checkpoint_store().is_processed(file_path, etag=etag, size=size)
 
-# Ensure checkpoint directory exists
-os.makedirs(os.path.dirname(CHECKPOINT_FILE), exist_ok=True)
+def mark_as_processed(file_path, etag=None, size=None, row_count=None):
+    get_checkpoint_store().mark(file_path, etag=etag, size=size, row_count=row_count)
 
-def is_already_processed(file_path):
-    print(f"already processed fn {os.path.exists(CHECKPOINT_FILE)}, {CHECKPOINT_FILE}")
-    if not os.path.exists(CHECKPOINT_FILE):
-        return False
-    with open(CHECKPOINT_FILE, 'r') as f:
-        return file_path in f.read().splitlines()
-
-def mark_as_processed(file_path):
-    with open(CHECKPOINT_FILE, 'a') as f:
-        f.write(f"{file_path}\n")
+@lru_cache(maxsize=None)
+def get_config_cache():
+    return DeviceConfigCache(get_s3_filesystem())
 
 def get_latest_config_file():
-    # List all files in the config prefix
-    config_path = f"{BUCKET_NAME}/{CONFIG_PREFIX}"
-    file_infos = s3_fs.get_file_info(pafs.FileSelector(config_path, recursive=True))
+    return f"s3://{get_config_cache().latest_object().path}"
 
-    # Filter for .csv files only
-    csv_files = [info.path for info in file_infos if info.is_file and info.path.endswith(".csv")]
+def probe_stored(batch, path):
+    # Events whose (device_id, event_ts) is already stored: re-sent by the source or a
+    # backfill of loaded hours. Logged, and removed in DEDUP_INGEST_MODE "drop"
+    mode = DEDUP_INGEST_MODE
+    if not mode:
+        return batch
+    stored = get_dedup_index().contains(batch)
+    if stored.any():
+        logging.info(f"{int(stored.sum())} of {batch.num_rows} events in s3://{path} are already stored"
+                     f"{', dropped' if mode == 'drop' else ''}")
+        if mode == "drop":
+            batch = batch.filter(pa.array(~stored))
+    return batch
 
-    if not csv_files:
-        raise FileNotFoundError(f"No config CSV files found in: {config_path}")
+def iter_telemetry_batches(parquet_file, columns=TELEMETRY_COLUMNS, batch_size=INGEST_BATCH_SIZE):
+    # Project only the columns the pipeline uses; tolerate older files missing some of them
+    schema = parquet_file.schema_arrow
+    columns = [col for col in columns if col in schema.names]
+    projected = pa.schema([schema.field(col) for col in columns])
+    return projected, parquet_file.iter_batches(batch_size=batch_size, columns=columns)
 
-    # Return the latest one (based on filename sort)
-    latest_file = sorted(csv_files)[-1]
-    return f"s3://{latest_file}"
+def resolve_hour_range(context):
+    # Explicit kwargs win, then DAG params / trigger conf, then the run's own hour
+    dag_run = context.get("dag_run")
+    params = {**(context.get("params") or {}), **(getattr(dag_run, "conf", None) or {})}
+    start = context.get("start_hour") or params.get("start_hour") or context["execution_date"]
+    end = context.get("end_hour") or params.get("end_hour") or start
 
-@record_task_timing
-def ingest_raw_data(**context):
-    # Compute run time
-    execution_time = context['execution_date']
-    date_str = execution_time.strftime('%Y-%m-%d')
-    hour_str = execution_time.strftime('%H')
+    start = pd.Timestamp(start).floor("h")
+    end = pd.Timestamp(end).floor("h")
+    if end < start:
+        raise ValueError(f"end_hour {end} is before start_hour {start}")
+    return [ts.to_pydatetime() for ts in pd.date_range(start, end, freq="h")]
 
-    # S3 path to hourly parquet file
-    telemetry_path = f"{BUCKET_NAME}/{RAW_PREFIX}/{date_str}/{hour_str}/telemetry.parquet"
-    telemetry_uri = f"s3://{telemetry_path}"
+def discover_telemetry_files(hours):
+    wanted = {(h.strftime('%Y-%m-%d'), h.strftime('%H')) for h in hours}
+    dates = {date_str for date_str, _ in wanted}
 
-    if is_already_processed(telemetry_path):
-        logging.info(f"Already processed: {telemetry_path}")
-        return
+    # One listing for the whole range: the date prefix when it is a single day, the
+    # telemetry root otherwise
+    raw_root = f"{BUCKET_NAME}/{RAW_PREFIX}"
+    list_root = f"{raw_root}/{next(iter(dates))}" if len(dates) == 1 else raw_root
+    file_infos = get_s3_filesystem().get_file_info(pafs.FileSelector(list_root, recursive=True, allow_not_found=True))
 
-    # Read telemetry parquet
-    try:
-        logging.info(f"Reading from telemetry file: {telemetry_uri}")
-        parquet_file = pq.ParquetFile(telemetry_path, filesystem=s3_fs)
-        table = parquet_file.read()
-        telemetry_df = table.to_pandas()
+    files = []
+    for info in file_infos:
+        if not info.is_file or not info.path.endswith(".parquet"):
+            continue
+        parts = info.path[len(raw_root) + 1:].split("/")
+        if len(parts) == 3 and (parts[0], parts[1]) in wanted:
+            files.append((parts[0], parts[1], info))
+    return sorted(files, key=lambda item: item[2].path)
 
-    except Exception as e:
-        logging.exception(f"Failed to read telemetry file: {telemetry_uri} — {e}")
-        raise
+def ingest_file(file_info, date_str, hour_str, output_dir, streaming=True, batch_size=INGEST_BATCH_SIZE):
+    parquet_file = pq.ParquetFile(file_info.path, filesystem=get_s3_filesystem())
+    schema, batches = iter_telemetry_batches(parquet_file, batch_size=batch_size)
+    if not streaming:
+        batches = parquet_file.read(columns=schema.names).to_batches()
+
+    # Canonical types (dictionary ids, timestamp[us], float32) from the first batch on
+    batches = (probe_stored(conform_table(batch, TELEMETRY_SCHEMA), file_info.path) for batch in batches)
+    first = next(batches, None)
+    if first is not None:
+        schema = first.schema
+        batches = itertools.chain([first], batches)
+
+    # Tag each batch with its partition keys; write_dataset moves them into the directory layout
+    out_schema = schema.append(pa.field("date", pa.string())).append(pa.field("hour", pa.string()))
+    row_count = 0
+
+    def tagged_batches():
+        nonlocal row_count
+        for batch in batches:
+            row_count += batch.num_rows
+            yield pa.RecordBatch.from_arrays(
+                batch.columns + [
+                    pa.repeat(pa.scalar(date_str), batch.num_rows),
+                    pa.repeat(pa.scalar(hour_str), batch.num_rows),
+                ],
+                schema=out_schema
+            )
+
+    # Part files share an hour directory, so name outputs after the source object
+    stem = os.path.splitext(os.path.basename(file_info.path))[0]
+    ds.write_dataset(
+        pa.RecordBatchReader.from_batches(out_schema, tagged_batches()),
+        base_dir=output_dir,
+        format="parquet",
+        partitioning=HOUR_PARTITIONING,
+        basename_template=f"{stem}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=batch_size,
+    )
+    return row_count
+
+def read_file_table(file_info, batch_size=INGEST_BATCH_SIZE):
+    # Fused mode: the projected file stays in memory as Arrow instead of landing on disk
+    parquet_file = pq.ParquetFile(file_info.path, filesystem=get_s3_filesystem())
+    schema, batches = iter_telemetry_batches(parquet_file, batch_size=batch_size)
+    return probe_stored(conform_table(pa.Table.from_batches(list(batches), schema=schema), TELEMETRY_SCHEMA), file_info.path)
+
+def find_pending_files(context):
+    hours = resolve_hour_range(context)
+
+    # Discover every part file in the hour range with a single listing
+    discovered = discover_telemetry_files(hours)
+    pending = [
+        (date_str, hour_str, info) for date_str, hour_str, info in discovered
+        if not is_already_processed(info.path, etag=object_version(info), size=info.size)
+    ]
+    logging.info(
+        f"Found {len(discovered)} telemetry files for {hours[0]:%Y-%m-%d %H}:00 - {hours[-1]:%Y-%m-%d %H}:00, "
+        f"{len(pending)} not yet processed"
+    )
+    return pending
+
+def read_pending_files(pending, read_one, max_workers=INGEST_MAX_WORKERS):
+    """Run read_one(date_str, hour_str, info) for every file on a bounded thread pool."""
+    started = time.perf_counter()
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(read_one, date_str, hour_str, info): info
+            for date_str, hour_str, info in pending
+        }
+        for future in as_completed(futures):
+            info = futures[future]
+            try:
+                results[info.path] = future.result()
+            except Exception as e:
+                logging.exception(f"Failed to read telemetry file: s3://{info.path} — {e}")
+                raise
 
-    # Read latest config
+    elapsed = time.perf_counter() - started
+    return results, elapsed
+
+def log_read_throughput(rows, files, elapsed):
+    logging.info(
+        f"Telemetry read: {rows} rows from {files} files in {elapsed:.2f}s "
+        f"({rows / max(elapsed, 1e-9):,.0f} rows/sec), peak RSS {hwm_rss_mb() or peak_rss_mb():.1f} MB"
+    )
+
+def refresh_config():
+    # Refresh the local config cache (re-downloaded only when the latest object changed)
     try:
-        config_uri = get_latest_config_file()
-        config_df = pd.read_csv(config_uri, storage_options={
-            'client_kwargs': {
-                'endpoint_url': MINIO_ENDPOINT,
-                'aws_access_key_id': MINIO_ACCESS_KEY,
-                'aws_secret_access_key': MINIO_SECRET_KEY
-            }
-        })
+        config_manifest = get_config_cache().resolve()
     except Exception as e:
         logging.exception(f"Failed to read config file: {str(e)}")
         raise
+    logging.info(f"Using {config_manifest['num_rows']} config records from s3://{config_manifest['path']}")
+    return config_manifest
 
-    # Log ingestion metadata
-    logging.info(f"Ingested {len(telemetry_df)} telemetry records from {telemetry_path}")
-    logging.info(f"Ingested {len(config_df)} config records from {config_uri}")
+def checkpoint_files(pending, row_counts):
+    # Checkpoint the whole batch in one transaction
+    get_checkpoint_store().mark_many([
+        {"path": info.path, "etag": object_version(info), "size": info.size, "row_count": row_counts[info.path]}
+        for _, _, info in pending
+    ])
+
+def ingest_to_table(**context):
+    """
+    Read the run's pending telemetry files into a single Arrow table (fused mode).
 
-    # Save raw data to /opt/airflow/data/interim/ for next steps
-    
-    os.makedirs(INTERIM_PATH, exist_ok=True)
-    telemetry_df.to_parquet(f"{INTERIM_PATH}/telemetry.parquet", index=False)
-    config_df.to_csv(f"{INTERIM_PATH}/config.csv", index=False)
+    Returns (table, pending, row_counts); table is None when everything was processed.
+    Files are not checkpointed here, the caller does that once the data is stored.
+    """
+    batch_size = context.get("batch_size", INGEST_BATCH_SIZE)
+    pending = find_pending_files(context)
+    if not pending:
+        return None, [], {}
+
+    tables, elapsed = read_pending_files(
+        pending,
+        lambda date_str, hour_str, info: read_file_table(info, batch_size),
+        context.get("max_workers", INGEST_MAX_WORKERS)
+    )
+    table = pa.concat_tables([tables[info.path] for _, _, info in pending])
+    log_read_throughput(table.num_rows, len(pending), elapsed)
+    refresh_config()
+    return table, pending, {path: t.num_rows for path, t in tables.items()}
+
+@record_task_timing
+def ingest_raw_data(**context):
+    streaming = context.get("streaming", INGEST_STREAMING)
+    batch_size = context.get("batch_size", INGEST_BATCH_SIZE)
+
+    pending = find_pending_files(context)
+    if not pending:
+        logging.info("All telemetry files already processed")
+        return
+
+    # Run-scoped interim dataset; a retry replaces its own previous attempt
+    telemetry_dir = run_paths(context)["telemetry_dir"]
+    shutil.rmtree(telemetry_dir, ignore_errors=True)
+    os.makedirs(telemetry_dir, exist_ok=True)
+
+    # Read telemetry parquet files concurrently
+    with span("read"):
+        row_counts, elapsed = read_pending_files(
+            pending,
+            lambda date_str, hour_str, info: ingest_file(
+                info, date_str, hour_str, telemetry_dir, streaming, batch_size
+            ),
+            context.get("max_workers", INGEST_MAX_WORKERS)
+        )
+    telemetry_rows = sum(row_counts.values())
+    log_read_throughput(telemetry_rows, len(pending), elapsed)
+    record(
+        rows_in=telemetry_rows,
+        rows_out=telemetry_rows,
+        bytes_read=sum(info.size for _, _, info in pending),
+        bytes_written=sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(telemetry_dir) for name in names
+        ),
+    )
+
+    with span("config"):
+        refresh_config()
+
+    # Log ingestion metadata
+    logging.info(f"Ingested {telemetry_rows} telemetry records into {telemetry_dir}")
+    publish_path(context, "telemetry_dir", telemetry_dir)
 
-    mark_as_processed(telemetry_path)
+    # Only after every file landed
+    with span("checkpoint"):
+        checkpoint_files(pending, row_counts)
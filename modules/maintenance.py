@@ -0,0 +1,118 @@
+import os
+import time
+import glob
+import logging
+from modules.utils.constants import (
+    ICEBERG_TABLE,
+    ICEBERG_WAREHOUSE,
+    DUCKDB_DATABASE,
+    LOAD_STAGING_DIR,
+    LOAD_CLUSTER_COLUMNS,
+    MAINTENANCE_HOUR,
+    MAINTENANCE_SORT_COLUMNS,
+    SNAPSHOT_RETENTION_DAYS,
+    STAGING_TMP_RETENTION_HOURS
+)
+from modules.utils.decorators import record_task_timing, releases_duckdb_session
+from modules.utils.duckdb_session import get_session, publish_replica
+from modules.storage import SNAPSHOT_TABLE, ensure_table, quote, record_snapshot, flush_staged
+
+
+def table_layout(con, table=ICEBERG_TABLE):
+    # Row groups and storage blocks currently referenced by the table (after a checkpoint)
+    rows = con.execute(f"SELECT COUNT(*) FROM iceberg.{table}").fetchone()[0]
+    row_groups, blocks = con.execute(
+        f"SELECT COUNT(DISTINCT row_group_id), COUNT(DISTINCT block_id) "
+        f"FROM pragma_storage_info('iceberg.{table}') WHERE persistent"
+    ).fetchone()
+    block_size = con.execute("SELECT block_size FROM pragma_database_size()").fetchone()[0]
+    return {"rows": rows, "row_groups": row_groups, "bytes": blocks * block_size}
+
+
+def compact_table(con, table=ICEBERG_TABLE, sort_columns=MAINTENANCE_SORT_COLUMNS):
+    """
+    Rewrite the table into densely packed row groups, sorted within each partition.
+
+    Hourly merges leave partially filled row groups and deleted rows behind; the rewrite
+    drops both and orders rows by LOAD_CLUSTER_COLUMNS, then `sort_columns`, so zone maps
+    prune on event_date and device_id. Returns the layout before and after.
+    """
+    con.execute("CHECKPOINT;")
+    before = table_layout(con, table)
+
+    existing_cols = [row[0] for row in con.execute(f"DESCRIBE iceberg.{table}").fetchall()]
+    order = [col for col in LOAD_CLUSTER_COLUMNS + list(sort_columns) if col in existing_cols]
+    order_by = f"ORDER BY {', '.join(quote(col) for col in order)}" if order else ""
+
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        con.execute(f"CREATE TABLE iceberg.{table}__compacted AS SELECT * FROM iceberg.{table} {order_by};")
+        con.execute(f"DROP TABLE iceberg.{table};")
+        con.execute(f"ALTER TABLE iceberg.{table}__compacted RENAME TO {table};")
+        if table == ICEBERG_TABLE:
+            record_snapshot(con, "compact", before["rows"])
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+
+    # Frees the blocks of the old version
+    con.execute("CHECKPOINT;")
+    after = table_layout(con, table)
+
+    logging.info(
+        f"Compacted iceberg.{table}: row groups {before['row_groups']} -> {after['row_groups']}, "
+        f"bytes {before['bytes']} -> {after['bytes']} ({before['bytes']} rewritten)"
+    )
+    return {"before": before, "after": after, "bytes_rewritten": before["bytes"]}
+
+
+def expire_snapshots(con, retention_days=SNAPSHOT_RETENTION_DAYS):
+    # Old table versions are already freed at checkpoint; this trims the snapshot log
+    expired = con.execute(f"""
+        DELETE FROM iceberg.{SNAPSHOT_TABLE}
+        WHERE committed_at < now()::TIMESTAMP - INTERVAL {int(retention_days)} DAY
+        AND snapshot_id < (SELECT MAX(snapshot_id) FROM iceberg.{SNAPSHOT_TABLE})
+        RETURNING snapshot_id;
+    """).fetchall()
+    logging.info(f"Expired {len(expired)} snapshots older than {retention_days} days")
+    return len(expired)
+
+
+def remove_orphan_files(staging_dir, retention_hours=STAGING_TMP_RETENTION_HOURS):
+    # Half-written staging files from crashed loads; complete *.parquet files are still pending
+    cutoff = time.time() - retention_hours * 3600
+    removed = [path for path in glob.glob(os.path.join(staging_dir, "*.tmp")) if os.path.getmtime(path) < cutoff]
+    for path in removed:
+        os.remove(path)
+    return len(removed)
+
+
+def run_maintenance(warehouse=ICEBERG_WAREHOUSE, con=None):
+    """Compact the telemetry table, expire snapshots and clean staging under `warehouse`."""
+    if con is None:
+        con = get_session(os.path.join(warehouse, os.path.basename(DUCKDB_DATABASE))).cursor()
+    ensure_table(con)
+
+    result = compact_table(con)
+    result["snapshots_expired"] = expire_snapshots(con)
+    publish_replica(con)
+    result["orphan_files_removed"] = remove_orphan_files(os.path.join(warehouse, os.path.basename(LOAD_STAGING_DIR)))
+    return result
+
+
+@record_task_timing
+@releases_duckdb_session
+def maintain_table(**context):
+    try:
+        logical_date = context.get("logical_date") or context.get("execution_date")
+        if logical_date is not None and logical_date.hour != MAINTENANCE_HOUR:
+            logging.info(f"Table maintenance only runs for hour {MAINTENANCE_HOUR}, skipping")
+            return
+        # Staged runs left by a backfill or an idle DAG become visible at least daily
+        flush_staged(force=True)
+        return run_maintenance()
+
+    except Exception as e:
+        logging.exception(f"Table maintenance failed: {e}")
+        raise
@@ -0,0 +1,129 @@
+"""
+Sub-hourly micro-batch mode: a long-lived worker instead of an hourly Airflow run.
+
+    python -m modules.microbatch --interval-min 5
+    python -m modules.microbatch --once
+
+Every poll lists the raw prefix for the last MICROBATCH_LOOKBACK_HOURS hours, skips files
+already in the checkpoint store and runs ingest -> transform -> validate -> load -> report
+in-process (run_fused_pipeline) on the new files only. Imports, the S3 client, the
+checkpoint connection and the calibration lookup live as long as the worker; the DuckDB
+session is closed after every batch, so the worker only holds the database's write lock
+while it loads. Run either this worker or the hourly DAG against a bucket, not both.
+"""
+import time
+import signal
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from modules.utils.constants import MICROBATCH_INTERVAL_MIN, MICROBATCH_LOOKBACK_HOURS, MICROBATCH_COMMIT_SEC
+from modules.checkpoint import get_checkpoint_store
+from modules.ingestion import get_s3_filesystem
+from modules.pipeline import run_fused_pipeline
+from modules.storage import flush_staged
+from modules.utils.duckdb_session import get_session
+from modules.utils.interim import cleanup_run_intermediates
+
+
+def batch_context(batch_ts, lookback_hours=MICROBATCH_LOOKBACK_HOURS, run_id=None):
+    # Each poll is its own run: a run key for its outputs, a batch id for the aggregate state
+    batch_ts = batch_ts.replace(microsecond=0)
+    return {
+        "logical_date": batch_ts,
+        "execution_date": batch_ts,
+        "run_id": run_id or f"microbatch__{batch_ts:%Y%m%dT%H%M%S}",
+        "start_hour": batch_ts - timedelta(hours=lookback_hours),
+        "end_hour": batch_ts,
+        # load_table only stages; run_once commits once the staged loads are commit_sec old
+        "stage_only": True,
+    }
+
+
+class MicroBatchWorker:
+    """
+    Poll for new telemetry every `interval_min` minutes and process it in-process.
+
+    A failed batch is retried on the next poll under the same run id, so the aggregate
+    state replaces that batch's buckets instead of counting its rows twice; its files are
+    only checkpointed once loaded. Staged loads are committed once `commit_sec` old.
+    """
+
+    def __init__(self, interval_min=MICROBATCH_INTERVAL_MIN, lookback_hours=MICROBATCH_LOOKBACK_HOURS,
+                 commit_sec=MICROBATCH_COMMIT_SEC):
+        self.interval_sec = interval_min * 60
+        self.lookback_hours = lookback_hours
+        self.commit_sec = commit_sec
+        self.stopped = threading.Event()
+        self.retry_run_id = None
+
+    def warm_up(self):
+        # Paid once per worker, not per batch. Not the DuckDB session: it would hold the
+        # write lock between batches
+        get_s3_filesystem()
+        get_checkpoint_store()
+
+    def release_session(self):
+        # Lets DAG loads, maintenance and other writers take the lock until the next batch
+        get_session().close()
+
+    def run_once(self, now=None):
+        context = batch_context(now or datetime.utcnow(), self.lookback_hours, self.retry_run_id)
+        started = time.perf_counter()
+        try:
+            rows = run_fused_pipeline(**context)
+            flush_staged(force=self.commit_sec <= 0, max_age=self.commit_sec)
+        except Exception:
+            self.retry_run_id = context["run_id"]
+            logging.exception(f"Micro-batch {context['run_id']} failed, retrying on the next poll")
+            return None
+        finally:
+            self.release_session()
+        self.retry_run_id = None
+        logging.info(f"Micro-batch {context['run_id']}: {rows} rows in {time.perf_counter() - started:.2f}s")
+        return rows
+
+    def run(self, iterations=None):
+        self.warm_up()
+        completed = 0
+        while not self.stopped.is_set():
+            started = time.monotonic()
+            self.run_once()
+            cleanup_run_intermediates()
+            completed += 1
+            if iterations is not None and completed >= iterations:
+                break
+            # Fixed cadence: a slow batch shortens the wait instead of drifting the schedule
+            self.stopped.wait(max(0.0, self.interval_sec - (time.monotonic() - started)))
+        # Nothing staged is left behind on shutdown
+        try:
+            flush_staged(force=True)
+        finally:
+            self.release_session()
+
+    def stop(self, *_):
+        logging.info("Stopping micro-batch worker after the current batch")
+        self.stopped.set()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interval-min", type=float, default=MICROBATCH_INTERVAL_MIN)
+    parser.add_argument("--lookback-hours", type=int, default=MICROBATCH_LOOKBACK_HOURS)
+    parser.add_argument("--commit-sec", type=float, default=MICROBATCH_COMMIT_SEC)
+    parser.add_argument("--iterations", type=int, default=None, help="stop after this many polls")
+    parser.add_argument("--once", action="store_true", help="run a single poll and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    worker = MicroBatchWorker(args.interval_min, args.lookback_hours, args.commit_sec)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(1 if args.once else args.iterations)
+
+
+if __name__ == "__main__":
+    main()
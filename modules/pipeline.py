@@ -0,0 +1,75 @@
+import time
+import logging
+from contextlib import contextmanager
+from modules.utils.constants import QUALITY_RULES, SHARD_COUNT
+from modules.utils.decorators import record_task_timing, releases_duckdb_session
+from modules.utils.profiling import span
+from modules.ingestion import ingest_to_table, checkpoint_files
+from modules.calibration import load_calibration_lookup
+from modules.aggregate_state import batch_id_from_context
+from modules.transformation import transform_frame, transform_sharded
+from modules.quality_rules import run_quality_checks, run_quality_checks_sharded
+from modules.validation import write_quality_report
+from modules.storage import load_table
+from modules.reporting import write_report, stored_table_stats
+from modules.utils.interim import run_paths
+from modules.utils.schema import conform_frame
+
+
+@contextmanager
+def stage(name, durations):
+    # Also a sub-span of the fused task's metrics
+    started = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        durations[name] = time.perf_counter() - started
+        logging.info(f"Fused stage {name} took {durations[name]:.2f}s")
+
+
+@record_task_timing
+@releases_duckdb_session
+def run_fused_pipeline(**context):
+    """
+    ingest -> transform -> validate -> load -> report as one callable.
+
+    Stages hand Arrow tables to each other in memory (DuckDB scans the transformed table
+    zero-copy for validation and storage) instead of round-tripping through interim/processed
+    files. Source files are checkpointed only after the load has committed or been staged.
+    """
+    durations = {}
+
+    with stage("ingest_raw_data", durations):
+        telemetry, pending, row_counts = ingest_to_table(**context)
+    if telemetry is None:
+        logging.info("All telemetry files already processed")
+        return 0
+
+    shards = context.get("shards", SHARD_COUNT)
+    with stage("transform_data", durations):
+        if shards > 1:
+            transformed_df = transform_sharded(telemetry, batch_id_from_context(context), shards)
+        else:
+            transformed_df = transform_frame(
+                telemetry.to_pandas(), load_calibration_lookup(), batch_id_from_context(context)
+            )
+        transformed = conform_frame(transformed_df)
+        del transformed_df
+
+    with stage("validate_data", durations):
+        if shards > 1:
+            issues = run_quality_checks_sharded(transformed, QUALITY_RULES, shards)
+        else:
+            issues = run_quality_checks(transformed, QUALITY_RULES)
+        write_quality_report(issues, run_paths(context)["quality_report_path"])
+
+    with stage("load_to_iceberg", durations):
+        load_table(transformed, context)
+        checkpoint_files(pending, row_counts)
+
+    with stage("generate_report", durations):
+        anomaly_count = transformed.column("anomaly_flag").to_numpy(zero_copy_only=False).sum()
+        write_report(transformed.num_rows, anomaly_count, len(issues), durations, stored_table_stats())
+
+    return transformed.num_rows
@@ -0,0 +1,155 @@
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from modules.utils.constants import QUALITY_RULES, SHARD_COUNT
+from modules.sharding import map_shards, from_ipc
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _is_float(schema, column):
+    return pa.types.is_floating(schema.field(column).type)
+
+
+def _is_numeric(data_type):
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type) or pa.types.is_decimal(data_type)
+
+
+def _rule_columns(rule, schema):
+    columns = rule.get("columns", rule.get("column"))
+    if columns == "*":
+        return list(schema.names)
+    if isinstance(columns, str):
+        return [columns]
+    return list(columns)
+
+
+def compile_rules(rules, schema):
+    """
+    Turn declarative rules into aggregate expressions over a single scan.
+
+    Returns (expressions, checks): `expressions` are (alias, SQL) pairs for one SELECT;
+    `checks` are (rule, column, alias-or-callable) entries, in rule order, that turn the
+    query result into issue counts. Columns missing from the schema are skipped.
+    """
+    expressions = []
+    checks = []
+
+    for index, rule in enumerate(rules):
+        rule_type = rule["type"]
+        columns = _rule_columns(rule, schema)
+
+        if rule_type == "not_null":
+            for column in (c for c in columns if c in schema.names):
+                alias = f"r{index}_{len(expressions)}"
+                condition = f"{_quote(column)} IS NULL"
+                if _is_float(schema, column):
+                    # NaN counts as missing, as pandas isnull does
+                    condition += f" OR isnan({_quote(column)})"
+                expressions.append((alias, f"COUNT(*) FILTER (WHERE {condition})"))
+                checks.append((rule, column, alias))
+
+        elif rule_type == "unique":
+            if all(c in schema.names for c in columns):
+                alias = f"r{index}_{len(expressions)}"
+                key = ", ".join(_quote(c) for c in columns)
+                expressions.append((alias, f"COUNT(*) - COUNT(DISTINCT ({key}))"))
+                checks.append((rule, rule.get("label", " + ".join(columns)), alias))
+
+        elif rule_type == "range":
+            # Non-numeric columns are reported by the "numeric" rule instead
+            for column in (c for c in columns if c in schema.names and _is_numeric(schema.field(c).type)):
+                bounds = []
+                if rule.get("min") is not None:
+                    bounds.append(f"{_quote(column)} < {rule['min']}")
+                if rule.get("max") is not None:
+                    bounds.append(f"{_quote(column)} > {rule['max']}")
+                condition = " OR ".join(bounds) or "FALSE"
+                if _is_float(schema, column):
+                    # DuckDB orders NaN above every number; treat it as not an outlier
+                    condition = f"NOT isnan({_quote(column)}) AND ({condition})"
+                alias = f"r{index}_{len(expressions)}"
+                expressions.append((alias, f"COUNT(*) FILTER (WHERE {condition})"))
+                checks.append((rule, column, alias))
+
+        elif rule_type == "required":
+            # Schema-only: no scan needed
+            if any(c not in schema.names for c in columns):
+                checks.append((rule, rule.get("label", "/".join(columns)), lambda result: 0))
+
+        elif rule_type == "numeric":
+            # Parquet/Arrow schemas are typed, so the type check reads metadata, not values
+            for column in (c for c in columns if c in schema.names):
+                if not _is_numeric(schema.field(column).type):
+                    checks.append((rule, column, lambda result: result["__rows"]))
+
+        else:
+            raise ValueError(f"Unknown quality rule type: {rule_type}")
+
+    return expressions, checks
+
+
+def count_quality_checks(source, rules=QUALITY_RULES):
+    """Per-check (rule, column, count) in rule order, from one aggregate query over a Parquet path or Arrow table."""
+    if isinstance(source, pa.Table):
+        schema = source.schema
+    else:
+        schema = pq.read_schema(source)
+
+    expressions, checks = compile_rules(rules, schema)
+    select = ", ".join(["COUNT(*) AS __rows"] + [f"{sql} AS {alias}" for alias, sql in expressions])
+
+    con = duckdb.connect(database=":memory:")
+    try:
+        if isinstance(source, pa.Table):
+            con.register("quality_source", source)
+            relation = "quality_source"
+        else:
+            relation = "read_parquet('" + str(source).replace("'", "''") + "')"
+        row = con.execute(f"SELECT {select} FROM {relation}").fetchone()
+    finally:
+        con.close()
+
+    result = dict(zip(["__rows"] + [alias for alias, _ in expressions], row))
+    return [
+        (rule, column, int(source_count(result) if callable(source_count) else result[source_count]))
+        for rule, column, source_count in checks
+    ]
+
+
+def quality_issues(counts):
+    issues = []
+    for rule, column, count in counts:
+        if rule["type"] == "required" or count > 0:
+            issues.append({
+                "issue_type": rule["issue_type"],
+                "column": column,
+                "count": count,
+                "description": rule["description"].format(column=column, count=count),
+            })
+    return issues
+
+
+def run_quality_checks(source, rules=QUALITY_RULES):
+    """Evaluate all rules against a Parquet path or Arrow table in one aggregate query."""
+    return quality_issues(count_quality_checks(source, rules))
+
+
+def _count_shard(buffer, rules):
+    return [count for _, _, count in count_quality_checks(from_ipc(buffer), rules)]
+
+
+def run_quality_checks_sharded(table, rules=QUALITY_RULES, shards=SHARD_COUNT):
+    """
+    run_quality_checks over device_id hash shards of an Arrow table, on the shard pool.
+
+    Every check is additive across shards: the duplicate key includes device_id, so a
+    duplicate pair never spans two shards. Shards share the table schema, hence the checks.
+    """
+    template = count_quality_checks(table.slice(0, 0), rules)
+    totals = [0] * len(template)
+    for shard_counts in map_shards(_count_shard, table, "device_id", shards, rules):
+        totals = [total + count for total, count in zip(totals, shard_counts)]
+    return quality_issues([(rule, column, total) for (rule, column, _), total in zip(template, totals)])
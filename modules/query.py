@@ -0,0 +1,244 @@
+"""
+Read API over the telemetry table, with an optional local HTTP endpoint.
+
+    python -m modules.query --port 8085
+    curl 'localhost:8085/series?device_id=D0001&start=2025-08-01T00:00&end=2025-08-02T00:00'
+    curl 'localhost:8085/latest?device_id=D0001&device_id=D0002'
+    curl 'localhost:8085/anomalies?window=1h'
+"""
+import os
+import json
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import duckdb
+import pandas as pd
+from modules.utils.constants import ICEBERG_TABLE, DUCKDB_DATABASE, QUERY_CACHE_SIZE, QUERY_HTTP_HOST, QUERY_HTTP_PORT
+from modules.utils.duckdb_session import DuckDBSession, get_session, replica_path
+from modules.storage import SNAPSHOT_TABLE, LATEST_TABLE, LATEST_COLUMNS, quote
+
+SERIES_COLUMNS = [
+    "device_id", "event_ts", "device_type", "calibrated_temperature", "calibrated_humidity",
+    "anomaly_flag", "hour_avg_temp", "hour_avg_humid", "rolling_7d_temp", "rolling_7d_humid",
+]
+
+
+class TelemetryQueries:
+    """
+    Device series, latest readings and recent anomalies, served from an LRU result cache.
+
+    Every lookup filters on event_date as well as event_ts, so DuckDB prunes row groups by
+    the zone maps of the date-clustered table; latest readings come from the per-device
+    index maintained by each load. Cached results are valid for one table snapshot: the
+    whole cache is dropped when a new snapshot is committed. With `release=True` every read
+    opens its own connection (meant for the read replica, which the writer replaces after
+    each commit), and the snapshot is only re-read when the database file changed. Results
+    are shared between callers and must not be modified.
+    """
+
+    def __init__(self, session=None, cache_size=QUERY_CACHE_SIZE, release=False):
+        self.session = session
+        self.cache_size = cache_size
+        self.release = release
+        self._cache = OrderedDict()
+        self._snapshot = None
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def _execute(self, sql, params=None):
+        session = self.session or get_session()
+        if not self.release:
+            return session.cursor().execute(sql, params or []).fetchdf()
+        # Concurrent requests never share it, and the next read sees a newly swapped-in file
+        con = session.open()
+        try:
+            return con.execute(sql, params or []).fetchdf()
+        finally:
+            con.close()
+
+    def _files_stamp(self):
+        database = (self.session or get_session()).database
+        stamp = []
+        for path in (database, f"{database}.wal"):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def snapshot_id(self):
+        stamp = self._files_stamp() if self.release else None
+        if stamp is not None and stamp == self._stamp:
+            return self._snapshot
+        snapshot = self._execute(f"SELECT MAX(snapshot_id) AS snapshot_id FROM iceberg.{SNAPSHOT_TABLE}")
+        snapshot = snapshot["snapshot_id"].iloc[0]
+        snapshot = None if pd.isna(snapshot) else int(snapshot)
+        with self._lock:
+            if snapshot != self._snapshot:
+                self._cache.clear()
+                self._snapshot = snapshot
+            self._stamp = stamp
+        return snapshot
+
+    def cached(self, key, compute):
+        snapshot = self.snapshot_id()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        result = compute()
+        with self._lock:
+            # A commit while computing: the result may predate it, don't keep it
+            if snapshot == self._snapshot:
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return result
+
+    def get_device_series(self, device_id, start, end, columns=SERIES_COLUMNS):
+        """Readings of one device with start <= event_ts < end, oldest first."""
+        start, end = pd.Timestamp(start).to_pydatetime(), pd.Timestamp(end).to_pydatetime()
+        select = ", ".join(quote(col) for col in columns)
+        return self.cached(("series", device_id, start, end, tuple(columns)), lambda: self._execute(
+            f"SELECT {select} FROM iceberg.{ICEBERG_TABLE} "
+            f"WHERE event_date BETWEEN ?::DATE AND ?::DATE AND device_id = ? AND event_ts >= ? AND event_ts < ? "
+            f"ORDER BY event_ts",
+            [start.date(), end.date(), device_id, start, end]
+        ))
+
+    def latest_reading(self, device_ids=None):
+        """Latest reading per device from the precomputed index (all devices when None)."""
+        select = ", ".join(quote(col) for col in LATEST_COLUMNS)
+        if device_ids is None:
+            return self.cached(("latest", None), lambda: self._execute(
+                f"SELECT {select} FROM iceberg.{LATEST_TABLE} ORDER BY device_id"
+            ))
+        device_ids = sorted(set(device_ids))
+        if not device_ids:
+            return pd.DataFrame(columns=LATEST_COLUMNS)
+        placeholders = ", ".join("?" for _ in device_ids)
+        return self.cached(("latest", tuple(device_ids)), lambda: self._execute(
+            f"SELECT {select} FROM iceberg.{LATEST_TABLE} WHERE device_id IN ({placeholders}) ORDER BY device_id",
+            device_ids
+        ))
+
+    def anomalies(self, window="1h", end=None):
+        """
+        Anomalous readings in the `window` up to `end`, newest first.
+
+        `end` defaults to the newest indexed event_ts, so the result only changes with the data.
+        """
+        window = pd.Timedelta(window).to_pytimedelta()
+
+        def compute():
+            window_end = end
+            if window_end is None:
+                window_end = self._execute(f"SELECT MAX(event_ts) AS event_ts FROM iceberg.{LATEST_TABLE}")["event_ts"].iloc[0]
+                if pd.isna(window_end):
+                    return pd.DataFrame(columns=SERIES_COLUMNS)
+            window_end = pd.Timestamp(window_end).to_pydatetime()
+            window_start = window_end - window
+            select = ", ".join(quote(col) for col in SERIES_COLUMNS)
+            return self._execute(
+                f"SELECT {select} FROM iceberg.{ICEBERG_TABLE} "
+                f"WHERE event_date BETWEEN ?::DATE AND ?::DATE AND event_ts > ? AND event_ts <= ? AND anomaly_flag "
+                f"ORDER BY event_ts DESC, device_id",
+                [window_start.date(), window_end.date(), window_start, window_end]
+            )
+
+        return self.cached(("anomalies", window, end and pd.Timestamp(end)), compute)
+
+
+_default_queries = None
+_default_lock = threading.Lock()
+
+
+def default_queries():
+    # In-process queries go through the worker's shared DuckDB session
+    global _default_queries
+    with _default_lock:
+        if _default_queries is None:
+            _default_queries = TelemetryQueries()
+        return _default_queries
+
+
+def get_device_series(device_id, start, end):
+    return default_queries().get_device_series(device_id, start, end)
+
+
+def latest_reading(device_ids=None):
+    return default_queries().latest_reading(device_ids)
+
+
+def anomalies(window="1h", end=None):
+    return default_queries().anomalies(window, end)
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    queries = None
+
+    def _send(self, status, body):
+        payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        try:
+            if url.path == "/series":
+                result = self.queries.get_device_series(params["device_id"][0], params["start"][0], params["end"][0])
+            elif url.path == "/latest":
+                result = self.queries.latest_reading(params.get("device_id"))
+            elif url.path == "/anomalies":
+                result = self.queries.anomalies(params.get("window", ["1h"])[0], params.get("end", [None])[0])
+            else:
+                return self._send(404, {"error": f"unknown path {url.path}"})
+        except (KeyError, ValueError) as e:
+            return self._send(400, {"error": f"bad request: {e}"})
+        except duckdb.Error as e:
+            # No replica published yet, or one published before the table existed
+            return self._send(503, {"error": str(e)})
+        self._send(200, result.to_json(orient="records", date_format="iso"))
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def make_server(queries, host=QUERY_HTTP_HOST, port=QUERY_HTTP_PORT):
+    handler = type("BoundQueryHandler", (QueryHandler,), {"queries": queries})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(host=QUERY_HTTP_HOST, port=QUERY_HTTP_PORT, database=DUCKDB_DATABASE):
+    # A separate process reading the replica the pipeline publishes after each commit,
+    # never the database file the pipeline holds the write lock on
+    replica = DuckDBSession(replica_path(database), extensions=[], s3=False, read_only=True)
+    queries = TelemetryQueries(replica, release=True)
+    server = make_server(queries, host, port)
+    logging.info(f"Serving telemetry queries on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=QUERY_HTTP_HOST)
+    parser.add_argument("--port", type=int, default=QUERY_HTTP_PORT)
+    parser.add_argument("--database", default=DUCKDB_DATABASE)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    serve(args.host, args.port, args.database)
+
+
+if __name__ == "__main__":
+    main()
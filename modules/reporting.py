@@ -1,92 +1,170 @@
 import pandas as pd
 import os
+import glob
+import uuid
+import time
+import fcntl
 import logging
 from datetime import datetime
 import duckdb
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from modules.utils.constants import *
+from modules.utils.decorators import record_task_timing, releases_duckdb_session
+from modules.utils.duckdb_session import get_session
+from modules.storage import flush_staged, is_latest_run
+from modules.utils.parquet_profiles import write_parquet, copy_options
+from modules.utils.interim import resolve_path, cleanup_run_intermediates, read_metrics_sidecar
 
+# Upstream tasks whose timings are pulled from XCom; generate_report times itself
+REPORT_TASK_IDS = ["ingest_raw_data", "transform_data", "validate_data", "load_to_iceberg"]
+# Fixed report columns; per-task *_duration_sec columns are added alongside
+REPORT_SCHEMA = pa.schema([
+    ("run_ts", pa.timestamp("us")),
+    ("records_processed", pa.int64()),
+    ("anomalies_detected", pa.int64()),
+    ("validation_issues", pa.int64()),
+    ("iceberg_table_rows", pa.int64()),
+    ("iceberg_snapshot_id", pa.int64()),
+])
 
 
+def history_files(history_dir=REPORT_HISTORY_DIR):
+    return os.path.join(history_dir, "*", "*.parquet")
+
+def read_report_history(history_dir=REPORT_HISTORY_DIR):
+    # Monthly partitions, columns unioned by name as task durations come and go
+    if not glob.glob(history_files(history_dir)):
+        return pd.DataFrame(columns=REPORT_SCHEMA.names)
+    con = duckdb.connect(database=":memory:")
+    try:
+        return con.execute(
+            f"SELECT * FROM read_parquet('{history_files(history_dir)}', hive_partitioning = true, union_by_name = true) "
+            f"ORDER BY run_ts"
+        ).fetchdf()
+    finally:
+        con.close()
+
+def compact_report_history(history_dir=REPORT_HISTORY_DIR, current_partition=None):
+    # Closed months are merged into one file each, so history reads stay a handful of files
+    os.makedirs(history_dir, exist_ok=True)
+    with open(os.path.join(history_dir, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        for partition in sorted(glob.glob(os.path.join(history_dir, "run_month=*"))):
+            files = sorted(glob.glob(os.path.join(partition, "*.parquet")))
+            if os.path.basename(partition) == current_partition or len(files) <= 1:
+                continue
+            tmp_path = os.path.join(partition, "compacted.parquet.tmp")
+            con = duckdb.connect(database=":memory:")
+            try:
+                con.execute(
+                    f"COPY (SELECT * FROM read_parquet({files}, union_by_name = true) ORDER BY run_ts) "
+                    f"TO '{tmp_path}' ({copy_options()})"
+                )
+            finally:
+                con.close()
+            os.replace(tmp_path, os.path.join(partition, "compacted.parquet"))
+            for path in files:
+                if os.path.basename(path) != "compacted.parquet":
+                    os.remove(path)
+            logging.info(f"Compacted {len(files)} report files in {partition}")
+
+def write_report(total_records, anomaly_count, total_quality_issues, task_durations, table_stats=None):
+    # Compile report
+    run_ts = datetime.utcnow()
+    report = {
+        "run_ts": run_ts,
+        "records_processed": int(total_records),
+        "anomalies_detected": int(anomaly_count),
+        "validation_issues": int(total_quality_issues),
+        "iceberg_table_rows": None,
+        "iceberg_snapshot_id": None,
+    }
+    report.update(table_stats or {})
+
+    logging.info(f"Task duration details are: {task_durations}")
+    # Add task durations
+    fields = list(REPORT_SCHEMA)
+    for task_id, duration in task_durations.items():
+        report[f"{task_id}_duration_sec"] = duration
+        fields.append(pa.field(f"{task_id}_duration_sec", pa.float64()))
+
+    # Append one file to the month's partition (log history)
+    partition = f"run_month={run_ts:%Y-%m}"
+    partition_dir = os.path.join(REPORT_HISTORY_DIR, partition)
+    os.makedirs(partition_dir, exist_ok=True)
+    report_file = os.path.join(partition_dir, f"{run_ts:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.parquet")
+    write_parquet(pa.Table.from_pylist([report], schema=pa.schema(fields)), report_file)
+
+    logging.info(f"Generated DAG run report: {report_file}")
+    compact_report_history(current_partition=partition)
+    return report
+
+def stored_table_stats():
+    # Read through the worker's shared DuckDB session; the table is optional for the report
+    try:
+        rows, snapshot_id = get_session().cursor().execute(
+            f"SELECT (SELECT COUNT(*) FROM iceberg.{ICEBERG_TABLE}), "
+            f"(SELECT MAX(snapshot_id) FROM iceberg.{ICEBERG_TABLE}_snapshots)"
+        ).fetchone()
+        return {"iceberg_table_rows": rows, "iceberg_snapshot_id": snapshot_id}
+    except Exception as e:
+        logging.warning(f"Could not read iceberg.{ICEBERG_TABLE} stats: {e}")
+        return {}
+
+def transformed_counts(transformed_path):
+    # Sidecar written by the transform; otherwise footer row count + one column
+    metrics = read_metrics_sidecar(transformed_path)
+    if metrics:
+        return metrics["records"], metrics["anomalies"]
+    if not os.path.exists(transformed_path):
+        return 0, 0
+    total_records = pq.ParquetFile(transformed_path).metadata.num_rows
+    anomaly_flag = pq.read_table(transformed_path, columns=["anomaly_flag"]).column("anomaly_flag")
+    return total_records, int(pc.sum(anomaly_flag).as_py() or 0)
+
+def quality_issue_count(quality_report_path):
+    metrics = read_metrics_sidecar(quality_report_path)
+    if metrics:
+        return metrics["quality_issues"]
+    if os.path.exists(quality_report_path):
+        return len(pd.read_csv(quality_report_path))
+    return 0
+
+def task_durations_from_xcom(ti, task_ids=REPORT_TASK_IDS):
+    # One XCom query for every task; the payload carries its task id
+    if ti is None:
+        return {}
+    timings = ti.xcom_pull(task_ids=task_ids, key="task_timing") or []
+    if isinstance(timings, dict):
+        timings = [timings]
+    return {
+        timing["task_id"]: timing["duration_sec"]
+        for timing in timings if timing and timing.get("task_id") in task_ids
+    }
+
+@record_task_timing
+@releases_duckdb_session
 def generate_report(**context):
+    started = time.perf_counter()
     try:
-        os.makedirs(REPORTS_DIR, exist_ok=True)
-
-        # Load transformed data
-        transformed_path = os.path.join(PROCESSED_PATH, "transformed.parquet")
-        df = pd.read_parquet(transformed_path)
-        total_records = len(df)
-        anomaly_count = df["anomaly_flag"].sum()
-
-        # Load validation report (optional)
-        quality_report_path = os.path.join(PROCESSED_PATH, "../quality/data_quality_issues.csv")
-        if os.path.exists(quality_report_path):
-            quality_df = pd.read_csv(quality_report_path)
-            total_quality_issues = len(quality_df)
-        else:
-            total_quality_issues = 0
-
-        # Iceberg snapshot info
-        # con = duckdb.connect(database=":memory:")
-        # con.execute("INSTALL iceberg; LOAD iceberg;")
-        # con.execute(f"""
-        #     SET s3_endpoint='{MINIO_ENDPOINT}';
-        #     SET s3_region='{MINIO_REGION}';
-        #     SET s3_access_key_id='{MINIO_ACCESS_KEY}';
-        #     SET s3_secret_access_key='{MINIO_SECRET_KEY}';
-        # """)
-        # # snapshot_df = con.execute(f"""
-        # #     SELECT * FROM iceberg.table_snapshots('iceberg.{ICEBERG_TABLE}')
-        # # """).fetchdf()
-        
-        # snapshot_df = con.execute(f"""
-        #                 SELECT * FROM "iceberg.{ICEBERG_TABLE}.snapshots"
-        #             """).fetchdf()
-        # latest_snapshot = snapshot_df.sort_values(by='committed_at', ascending=False).head(1)
-        # snapshot_id = latest_snapshot['snapshot_id'].values[0]
-        # committed_at = latest_snapshot['committed_at'].values[0]
-        # operation = latest_snapshot['operation'].values[0]
+        # Counts come from the stages' metrics sidecars, not a re-read of the data
+        total_records, anomaly_count = transformed_counts(resolve_path(context, "transformed_path"))
+        total_quality_issues = quality_issue_count(resolve_path(context, "quality_report_path"))
 
         # Task durations via Airflow context (if available)
-        ti = context.get("ti")
-        task_ids = ["ingest_raw_data", "transform_data", "validate_data", "load_to_iceberg", "generate_report"]
-        task_durations = {}
+        task_durations = task_durations_from_xcom(context.get("ti"))
 
-        for task_id in task_ids:
-            try:
-                start = ti.xcom_pull(task_ids=task_id, key="start_time")
-                end = ti.xcom_pull(task_ids=task_id, key="end_time")
-                if start and end:
-                    duration = (pd.to_datetime(end) - pd.to_datetime(start)).total_seconds()
-                    task_durations[task_id] = duration
-            except Exception:
-                task_durations[task_id] = None
-
-        # Compile report
-        report = {
-            "run_ts": datetime.utcnow().isoformat(),
-            "records_processed": total_records,
-            "anomalies_detected": int(anomaly_count),
-            "validation_issues": total_quality_issues,
-            # "iceberg_snapshot_id": snapshot_id,
-            # "iceberg_operation": operation,
-            # "iceberg_committed_at": committed_at,
-        }
-        
-        logging.info(f"Task duration details are: {task_durations}")
-        # Add task durations
-        for task_id, duration in task_durations.items():
-            report[f"{task_id}_duration_sec"] = duration
-
-        report_df = pd.DataFrame([report])
-        report_file = os.path.join(REPORTS_DIR, "dag_run_report.csv")
-
-        # Append to report file (log history)
-        if os.path.exists(report_file):
-            report_df.to_csv(report_file, mode='a', header=False, index=False)
-        else:
-            report_df.to_csv(report_file, index=False)
-
-        logging.info(f"Generated DAG run report: {report_file}")
+        # The latest run reports the table with everything staged committed
+        flush_staged(force=is_latest_run(context))
+        # Its own task_timing is only pushed once it returns; the time up to the write stands in
+        task_durations["generate_report"] = time.perf_counter() - started
+
+        write_report(total_records, anomaly_count, total_quality_issues, task_durations, stored_table_stats())
+
+        # Retention for run-scoped intermediates of earlier runs
+        cleanup_run_intermediates()
 
     except Exception as e:
         logging.exception(f"Report generation failed: {str(e)}")
@@ -0,0 +1,72 @@
+import os
+import atexit
+import logging
+import multiprocessing
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from concurrent.futures import ProcessPoolExecutor
+
+
+def shard_ids(keys, shards):
+    # Stable across processes and runs (fixed hash key, unlike Python's hash()); a
+    # dictionary column hashes each distinct value once. Null keys all land in one shard
+    values = keys.to_pandas() if isinstance(keys, (pa.Array, pa.ChunkedArray)) else pd.Series(keys)
+    return (pd.util.hash_pandas_object(values, index=False).to_numpy() % shards).astype(np.int64)
+
+
+def shard_table(table, key, shards):
+    """Hash-partition an Arrow table on `key` into `shards` tables; row order is kept within a shard."""
+    ids = shard_ids(table.column(key), shards)
+    order = np.argsort(ids, kind="stable")
+    bounds = np.searchsorted(ids[order], np.arange(shards + 1))
+    return [table.take(order[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+def to_ipc(table):
+    # Arrow IPC stream: one buffer copy across the process boundary instead of pickling frames
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def from_ipc(buffer):
+    return pa.ipc.open_stream(buffer).read_all()
+
+
+# Worker count -> pool of this process
+_pools = {}
+
+
+def get_shard_pool(workers):
+    # Long-lived per worker count: each process imports the stage modules (and builds the
+    # calibration lookup) once. Spawned, not forked, so no DuckDB/Arrow thread state is inherited
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return _pools[workers]
+
+
+@atexit.register
+def shutdown_shard_pools():
+    # Joins the workers and releases their semaphores; the next map_shards starts a fresh pool
+    while _pools:
+        _pools.popitem()[1].shutdown(wait=True)
+
+
+# A forked child (Airflow's task runner) starts without the parent's pools instead of sharing their handles
+os.register_at_fork(after_in_child=_pools.clear)
+
+
+def map_shards(func, table, key, shards, *args):
+    """
+    Run `func(ipc_buffer, *args)` on every non-empty `key` shard of `table` in the process pool.
+
+    `func` must be a module-level function; it receives its shard as an Arrow IPC buffer.
+    Results come back in shard order.
+    """
+    parts = [part for part in shard_table(table, key, shards) if part.num_rows]
+    pool = get_shard_pool(shards)
+    futures = [pool.submit(func, to_ipc(part), *args) for part in parts]
+    logging.info(f"Running {func.__name__} on {len(parts)} {key} shards ({table.num_rows} rows)")
+    return [future.result() for future in futures]
@@ -1,21 +1,39 @@
 import os
+import glob
+import time
+import fcntl
 import logging
 import duckdb
+from datetime import timedelta
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
+from contextlib import contextmanager
 from modules.utils.constants import (
-    PROCESSED_PATH,
     ICEBERG_TABLE,
-    BUCKET_NAME,
-    MINIO_ENDPOINT,
-    MINIO_ACCESS_KEY,
-    MINIO_SECRET_KEY,
-    MINIO_REGION
+    LOAD_STAGING_DIR,
+    LOAD_BUFFER_HOURS,
+    LOAD_BUFFER_MAX_AGE_SEC,
+    LOAD_CLUSTER_COLUMNS,
+    DEDUP_INDEX,
+    PARQUET_PROFILE
 )
 import pandas as pd
-from modules.utils.decorators import record_task_timing
+from modules.utils.decorators import record_task_timing, releases_duckdb_session
+from modules.utils.profiling import span, record
+from modules.utils.interim import resolve_path, run_key
+from modules.utils.duckdb_session import get_session, publish_replica
+from modules.dedup import get_dedup_index
+from modules.utils.parquet_profiles import get_profile, sort_columns, write_parquet
 
-con = duckdb.connect(database=':memory:')
+# Upsert key of the telemetry table
+LOAD_KEY = ["device_id", "event_ts"]
+LOAD_SEQUENCE = "__load_seq"
+# One row per committed change to the table, like Iceberg's snapshot metadata
+SNAPSHOT_TABLE = f"{ICEBERG_TABLE}_snapshots"
+# Latest reading per device, maintained with every load for point lookups (modules/query.py)
+LATEST_TABLE = f"{ICEBERG_TABLE}_latest"
+LATEST_COLUMNS = ["device_id", "event_ts", "device_type", "calibrated_temperature", "calibrated_humidity", "anomaly_flag"]
 
 def map_dtype(dtype):
     if pd.api.types.is_integer_dtype(dtype):
@@ -30,108 +48,353 @@ def map_dtype(dtype):
         duckdb_type = "VARCHAR"
     return duckdb_type
 
+def map_arrow_type(data_type):
+    if pa.types.is_dictionary(data_type):
+        data_type = data_type.value_type
+    if pa.types.is_integer(data_type):
+        duckdb_type = "SMALLINT" if data_type.bit_width <= 16 else "BIGINT"
+    elif pa.types.is_float32(data_type) or pa.types.is_float16(data_type):
+        duckdb_type = "FLOAT"
+    elif pa.types.is_floating(data_type) or pa.types.is_decimal(data_type):
+        duckdb_type = "DOUBLE"
+    elif pa.types.is_boolean(data_type):
+        duckdb_type = "BOOLEAN"
+    elif pa.types.is_timestamp(data_type):
+        duckdb_type = "TIMESTAMP"
+    elif pa.types.is_date(data_type):
+        duckdb_type = "DATE"
+    else:
+        duckdb_type = "VARCHAR"
+    return duckdb_type
+
+def quote(column):
+    return '"' + column.replace('"', '""') + '"'
+
+def supports_merge():
+    # MERGE INTO is available from DuckDB 1.4
+    version = tuple(int(part) for part in duckdb.__version__.split(".")[:2])
+    return version >= (1, 4)
+
+def ensure_table(con):
+    # Check if table exists
+    table_exists = con.execute(
+        f"SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'iceberg' AND table_name = '{ICEBERG_TABLE}'"
+    ).fetchone()[0]
+
+    if table_exists == 0:
+        logging.info("Creating Iceberg table...")
+
+        # DuckDB tables have no partition spec; rows are inserted clustered by
+        # LOAD_CLUSTER_COLUMNS instead so zone maps prune by event_date.
+        # Column types follow the canonical TRANSFORMED_SCHEMA (FLOAT, SMALLINT hour)
+        con.execute(f"""
+            CREATE TABLE iceberg.{ICEBERG_TABLE} (
+                device_id VARCHAR,
+                event_ts TIMESTAMP,
+                device_type VARCHAR,
+                calibrated_temperature FLOAT,
+                calibrated_humidity FLOAT,
+                anomaly_flag BOOLEAN,
+                ingestion_ts TIMESTAMP,
+                event_date DATE,
+                event_hour SMALLINT,
+                day_avg_temp FLOAT,
+                day_avg_humid FLOAT,
+                hour_avg_temp FLOAT,
+                hour_avg_humid FLOAT,
+                rolling_7d_temp FLOAT,
+                rolling_7d_humid FLOAT
+            );
+        """)
+
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS iceberg.{SNAPSHOT_TABLE} (
+            snapshot_id BIGINT,
+            committed_at TIMESTAMP,
+            operation VARCHAR,
+            rows_written BIGINT
+        );
+    """)
+
+    latest_exists = con.execute(
+        f"SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = 'iceberg' AND table_name = '{LATEST_TABLE}'"
+    ).fetchone()[0]
+    if latest_exists == 0:
+        con.execute(f"""
+            CREATE TABLE iceberg.{LATEST_TABLE} (
+                device_id VARCHAR PRIMARY KEY,
+                event_ts TIMESTAMP,
+                device_type VARCHAR,
+                calibrated_temperature FLOAT,
+                calibrated_humidity FLOAT,
+                anomaly_flag BOOLEAN
+            );
+        """)
+        # Tables loaded before the index existed are indexed once from a full scan
+        update_latest(con, f"iceberg.{ICEBERG_TABLE}")
+
+def update_latest(con, source):
+    # Newest row per device in `source`, kept only where it is not older than the indexed one
+    existing_cols = [row[0] for row in con.execute(f"DESCRIBE {source}").fetchall()]
+    select = ", ".join(quote(col) if col in existing_cols else f"NULL AS {quote(col)}" for col in LATEST_COLUMNS)
+    con.execute(f"""
+        INSERT OR REPLACE INTO iceberg.{LATEST_TABLE}
+        SELECT candidate.* FROM (
+            SELECT {select} FROM {source}
+            WHERE device_id IS NOT NULL AND event_ts IS NOT NULL
+            QUALIFY row_number() OVER (PARTITION BY device_id ORDER BY event_ts DESC) = 1
+        ) AS candidate
+        LEFT JOIN iceberg.{LATEST_TABLE} AS indexed ON indexed.device_id = candidate.device_id
+        WHERE indexed.event_ts IS NULL OR candidate.event_ts >= indexed.event_ts;
+    """)
+
+def record_snapshot(con, operation, rows_written):
+    # Called inside the writing transaction, so the log commits atomically with the data
+    snapshot_id = con.execute(
+        f"SELECT COALESCE(MAX(snapshot_id), 0) + 1 FROM iceberg.{SNAPSHOT_TABLE}"
+    ).fetchone()[0]
+    con.execute(
+        f"INSERT INTO iceberg.{SNAPSHOT_TABLE} VALUES (?, now()::TIMESTAMP, ?, ?)",
+        [snapshot_id, operation, rows_written]
+    )
+    return snapshot_id
+
+def evolve_schema(con, schema):
+    # Schema evolution: add missing columns
+    existing_cols = [row[0] for row in con.execute(f"DESCRIBE iceberg.{ICEBERG_TABLE}").fetchall()]
+    for field in schema:
+        if field.name not in existing_cols and field.name != LOAD_SEQUENCE:
+            dtype = map_arrow_type(field.type)
+            con.execute(f'ALTER TABLE iceberg.{ICEBERG_TABLE} ADD COLUMN {quote(field.name)} {dtype};')
+            logging.info(f"Added missing column: {field.name} ({dtype}) {field.type}")
+
+def partition_filter(table, column, alias):
+    # Literal IN-list of the partition values present in the batch, so the target scan
+    # only touches row groups of the affected partitions
+    if column not in table.column_names:
+        return ""
+    values = pc.unique(table.column(column).drop_null()).to_pylist()
+    if not values:
+        return ""
+    literals = ", ".join("'" + str(value).replace("'", "''") + "'" for value in values)
+    return f" AND {alias}.{quote(column)} IN ({literals})"
+
+def prepare_dedup_index(con):
+    # Settle pending keys of interrupted loads, and rebuild the index when the table has
+    # loads it has not seen (first use, or loads while DEDUP_INDEX was off)
+    index = get_dedup_index()
+    last_snapshot, last_load = con.execute(
+        f"SELECT MAX(snapshot_id), COALESCE(MAX(snapshot_id) FILTER (WHERE operation <> 'compact'), 0) "
+        f"FROM iceberg.{SNAPSHOT_TABLE}"
+    ).fetchone()
+    index.recover(last_snapshot)
+    if index.indexed_through() != last_load:
+        index.bootstrap(con, f"iceberg.{ICEBERG_TABLE}", last_load)
+    return index
+
+def upsert_table(table, profile=None):
+    """
+    Upsert an Arrow table into the telemetry table in a single transaction.
+
+    Rows are keyed on (device_id, event_ts); the last occurrence of a key in `table` wins.
+    Uses MERGE INTO when the DuckDB version supports it, DELETE + INSERT otherwise. With
+    DEDUP_INDEX, a batch none of whose keys are stored is appended without either.
+    """
+    # Extensions, secrets and the iceberg schema are set up once per worker by the session
+    con = get_session().cursor()
+    ensure_table(con)
+
+    index = prepare_dedup_index(con) if DEDUP_INDEX else None
+    # Keys of a load that may have committed count as stored
+    append_only = index is not None and not index.contains(table, include_pending=True).any()
+    snapshot_id = None
+
+    if LOAD_SEQUENCE not in table.column_names:
+        table = table.append_column(LOAD_SEQUENCE, pa.array(range(table.num_rows), pa.int64()))
+    columns = [name for name in table.column_names if name != LOAD_SEQUENCE]
+    # Partition clustering first, then the write profile's order within each file
+    cluster = [quote(col) for col in dict.fromkeys(LOAD_CLUSTER_COLUMNS + sort_columns(get_profile(profile), columns)) if col in columns]
+    key_cols = ", ".join(quote(col) for col in LOAD_KEY)
+    # event_date derives from event_ts, so it is safe to join on for pruning
+    prune = partition_filter(table, "event_date", "target")
+
+    # Arrow is scanned zero-copy; no pandas conversion
+    con.register("temp_data", table)
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        evolve_schema(con, table.schema)
+
+        con.execute(f"""
+            CREATE OR REPLACE TEMP VIEW load_source AS
+            SELECT * EXCLUDE ({LOAD_SEQUENCE}) FROM temp_data
+            QUALIFY row_number() OVER (PARTITION BY {key_cols} ORDER BY {LOAD_SEQUENCE} DESC) = 1
+            {"ORDER BY " + ", ".join(cluster) if cluster else ""};
+        """)
+
+        key_match = " AND ".join(f"target.{quote(col)} = source.{quote(col)}" for col in LOAD_KEY)
+        if append_only:
+            # Every key is new: no join against the stored table
+            quoted_cols = ", ".join(quote(col) for col in columns)
+            con.execute(f"INSERT INTO iceberg.{ICEBERG_TABLE} ({quoted_cols}) SELECT {quoted_cols} FROM load_source;")
+            operation = "append"
+        elif supports_merge():
+            updates = ", ".join(f"{quote(col)} = source.{quote(col)}" for col in columns if col not in LOAD_KEY)
+            con.execute(f"""
+                MERGE INTO iceberg.{ICEBERG_TABLE} AS target
+                USING load_source AS source
+                ON {key_match}{prune}
+                WHEN MATCHED THEN UPDATE SET {updates}
+                WHEN NOT MATCHED THEN INSERT BY NAME;
+            """)
+            operation = "merge"
+        else:
+            # Remove existing matching records, then insert
+            con.execute(f"""
+                DELETE FROM iceberg.{ICEBERG_TABLE} AS target
+                USING load_source AS source
+                WHERE {key_match}{prune};
+            """)
+            quoted_cols = ", ".join(quote(col) for col in columns)
+            con.execute(f"INSERT INTO iceberg.{ICEBERG_TABLE} ({quoted_cols}) SELECT {quoted_cols} FROM load_source;")
+            operation = "delete_insert"
+
+        update_latest(con, "load_source")
+        snapshot_id = record_snapshot(con, operation, table.num_rows)
+        if index is not None:
+            # Pending until the commit below; promoted right after it
+            index.stage(table, snapshot_id)
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        if index is not None and snapshot_id is not None:
+            index.abort(snapshot_id)
+        raise
+    finally:
+        con.execute("DROP VIEW IF EXISTS load_source;")
+        con.unregister("temp_data")
+
+    if index is not None:
+        index.commit(snapshot_id)
+    publish_replica(con)
+
+    logging.info(f"Upsert of {table.num_rows} rows completed successfully ({operation}).")
+
+@contextmanager
+def staging_lock(staging_dir):
+    os.makedirs(staging_dir, exist_ok=True)
+    with open(os.path.join(staging_dir, ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def stage_table(table, key, staging_dir=LOAD_STAGING_DIR, profile=None):
+    # One file per run; a retry overwrites its own staged rows. The profile's sort is
+    # stable, so repeated keys keep their order and the last one still wins the merge
+    os.makedirs(staging_dir, exist_ok=True)
+    path = os.path.join(staging_dir, f"{key}.parquet")
+    write_parquet(table, f"{path}.tmp", profile)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+def staged_files(staging_dir=LOAD_STAGING_DIR):
+    # Oldest write first, so a later write of the same key wins the merge
+    return sorted(glob.glob(os.path.join(staging_dir, "*.parquet")), key=os.path.getmtime)
+
+def should_flush(files, buffer_hours=LOAD_BUFFER_HOURS, max_age=LOAD_BUFFER_MAX_AGE_SEC):
+    if not files:
+        return False
+    return len(files) >= buffer_hours or time.time() - os.path.getmtime(files[0]) >= max_age
+
+def flush_staged(staging_dir=LOAD_STAGING_DIR, force=False, max_age=LOAD_BUFFER_MAX_AGE_SEC, profile=None):
+    """Merge every staged run into the table as one commit; returns the number of rows."""
+    with staging_lock(staging_dir):
+        files = staged_files(staging_dir)
+        if not files or not (force or should_flush(files, max_age=max_age)):
+            return 0
+
+        table = pa.concat_tables([pq.read_table(path) for path in files], promote_options="default")
+        logging.info(f"Flushing {len(files)} staged runs ({table.num_rows} rows) in one commit")
+        upsert_table(table, profile)
+
+        # Safe to retry if removal fails: the merge is idempotent
+        for path in files:
+            os.remove(path)
+        return table.num_rows
+
+def _utc(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_convert("UTC").tz_localize(None) if ts.tzinfo is not None else ts
+
+def newer_runs_pending(dag_run):
+    # Queued/running runs of the DAG after this one; None when the metadata DB is unavailable
+    try:
+        from airflow.models import DagRun
+        from airflow.utils.state import DagRunState
+        runs = DagRun.find(dag_id=dag_run.dag_id, state=[DagRunState.QUEUED, DagRunState.RUNNING])
+    except Exception as e:
+        logging.warning(f"Could not list pending DAG runs: {e}")
+        return None
+    return any(run.execution_date > dag_run.execution_date for run in runs)
+
+def is_latest_run(context, now=None):
+    """
+    True when no later run is due to flush what this run staged.
+
+    That is a manually triggered run, the latest interval of the schedule (the last run of a
+    catchup, or a DAG about to idle), or a run with no newer runs queued or running (the end
+    of a backfill).
+    """
+    dag_run = context.get("dag_run")
+    if dag_run is not None and getattr(dag_run, "external_trigger", False):
+        return True
+    logical_date = context.get("logical_date") or context.get("execution_date")
+    start = context.get("data_interval_start") or logical_date
+    end = context.get("data_interval_end")
+    if start is None:
+        return True
+    # Hourly schedule when the interval is not in the context
+    end = _utc(end) if end is not None else _utc(start) + timedelta(hours=1)
+    interval = end - _utc(start)
+    # The next run starts once its interval has ended
+    if end + interval > _utc(now or pd.Timestamp.now("UTC")):
+        return True
+    return dag_run is not None and newer_runs_pending(dag_run) is False
+
+def load_table(table, context, staging_dir=LOAD_STAGING_DIR):
+    # Ad-hoc loads without a run context commit immediately
+    key = run_key(context)
+    profile = context.get("parquet_profile", PARQUET_PROFILE)
+    if key is None:
+        upsert_table(table, profile)
+        return
+    stage_table(table, key, staging_dir, profile=profile)
+    # The micro-batch worker commits on its own schedule (commit_sec)
+    if context.get("stage_only"):
+        return
+    # Buffered while later runs will follow; the latest run commits everything staged
+    flush_staged(staging_dir, force=is_latest_run(context), profile=profile)
+
 @record_task_timing
+@releases_duckdb_session
 def load_to_iceberg(**kwargs):
     logging.info("Starting Iceberg storage process...")
 
     try:
         # Load transformed file from local processed path
-        processed_file = os.path.join(PROCESSED_PATH, "transformed.parquet")
+        processed_file = resolve_path(kwargs, "transformed_path")
         if not os.path.exists(processed_file):
             logging.warning("Processed file not found.")
             return
 
-        table = pq.read_table(processed_file)
-        df = table.to_pandas()
-
-        # Connect to DuckDB and configure Iceberg
-        con.execute("INSTALL iceberg; LOAD iceberg;")
-        con.execute("CREATE SCHEMA IF NOT EXISTS iceberg;")
-        con.execute(f"SET s3_endpoint='{MINIO_ENDPOINT}';")
-        con.execute(f"SET s3_region='{MINIO_REGION}';")
-        con.execute(f"SET s3_access_key_id='{MINIO_ACCESS_KEY}';")
-        con.execute(f"SET s3_secret_access_key='{MINIO_SECRET_KEY}';")
-        
-        # con.execute(f"SET iceberg_catalog_path='s3://{BUCKET_NAME}/iceberg';")
-        # con.execute("SET iceberg_catalog_type='hadoop';")
-
-        # Check if table exists
-        table_exists = con.execute(
-            f"SELECT COUNT(*) FROM information_schema.tables WHERE table_name = '{ICEBERG_TABLE}'"
-        ).fetchone()[0]
-
-        if table_exists == 0:
-            logging.info("Creating Iceberg table...")
-
-            # Create table without partitioned by (DuckDB doesn't support that)
-            con.execute(f"""
-                CREATE TABLE iceberg.{ICEBERG_TABLE} (
-                    device_id VARCHAR,
-                    event_ts TIMESTAMP,
-                    device_type VARCHAR,
-                    calibrated_temperature DOUBLE,
-                    calibrated_humidity DOUBLE,
-                    anomaly_flag BOOLEAN,
-                    ingestion_ts TIMESTAMP,
-                    event_date DATE,
-                    event_hour INTEGER,
-                    day_avg_temp DOUBLE,
-                    day_avg_humid DOUBLE,
-                    hour_avg_temp DOUBLE,
-                    hour_avg_humid DOUBLE,
-                    rolling_7d_temp DOUBLE,
-                    rolling_7d_humid DOUBLE
-                );
-            """)
+        with span("read"):
+            table = pq.read_table(processed_file)
+        record(rows_in=table.num_rows, bytes_read=os.path.getsize(processed_file))
 
-            # #Set Iceberg partition spec manually after creation
-            # con.execute(f"""
-            #     CALL set_iceberg_partition_spec('s3', '{BUCKET_NAME}', '{ICEBERG_TABLE}',
-            #         {{'event_date': 'identity', 'device_type': 'identity'}});
-            # """)
-
-        
-        # Schema evolution: add missing columns
-        existing_cols = [row[0] for row in con.execute(f"DESCRIBE iceberg.{ICEBERG_TABLE}").fetchall()]
-        for col in df.columns:
-            if col not in existing_cols:
-                dtype = map_dtype(df[col].dtype)
-                con.execute(f'ALTER TABLE iceberg.{ICEBERG_TABLE} ADD COLUMN "{col}" {dtype};')
-                logging.info(f"Added missing column: {col} ({dtype}) {df[col].dtype}")
-
-        # ✅ Perform upsert using MERGE INTO
-        con.register("temp_data", df)
-        
-        # Refresh schema after evolution
-        final_schema = con.execute(f"DESCRIBE iceberg.{ICEBERG_TABLE}").fetchdf()
-        final_cols = final_schema["column_name"].tolist()
-
-        insert_cols = ", ".join([f"{col}" for col in final_cols])
-        insert_vals = ", ".join([f"temp_data.{col}" for col in final_cols])
-        quoted_cols = ", ".join([f'"{col}"' for col in final_cols])
-        # merge_sql = f"""
-        #     MERGE INTO iceberg.{ICEBERG_TABLE} AS target
-        #     USING temp_data AS source
-        #     ON target.device_id = source.device_id AND target.event_ts = source.event_ts
-        #     WHEN MATCHED THEN UPDATE SET *
-        #     WHEN NOT MATCHED THEN INSERT *;
-        # """
-        # con.execute(merge_sql)
-        
-        # Remove existing matching records
-        con.execute(f"""
-            DELETE FROM iceberg.{ICEBERG_TABLE}
-            USING temp_data
-            WHERE iceberg.{ICEBERG_TABLE}.device_id = temp_data.device_id
-            AND iceberg.{ICEBERG_TABLE}.event_ts = temp_data.event_ts;
-        """)
-        logging.info(f"Dataframe data columns: {df.head()}")
-        # Now insert new data
-        con.execute(f"INSERT INTO iceberg.{ICEBERG_TABLE} ({quoted_cols}) SELECT {quoted_cols} FROM temp_data;")
-
-        logging.info("Upsert completed successfully.")
+        with span("write"):
+            load_table(table, kwargs)
 
     except Exception as e:
         logging.exception(f"Iceberg storage failed: {e}")
         raise
-
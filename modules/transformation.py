@@ -1,68 +1,149 @@
 import pandas as pd
+import pyarrow as pa
 import os
 import logging
 from datetime import datetime
 from modules.utils.constants import *
 from modules.utils.decorators import record_task_timing
+from modules.utils.profiling import span, record
+from modules.utils.interim import read_telemetry_table, resolve_path, run_paths, publish_path, write_metrics_sidecar
+from modules.calibration import CalibrationLookup, load_calibration_lookup
+from modules.utils.schema import conform_frame
+from modules.utils.parquet_profiles import write_parquet
+from modules.duckdb_transform import transform_dataset
+from modules.sharding import map_shards, to_ipc, from_ipc
+from modules.aggregation import compute_device_aggregates
+from modules.aggregate_state import AggregateStateStore, apply_state, batch_id_from_context, hourly_buckets
+from modules.anomaly import apply_anomaly_model
+
+def calibrate_and_aggregate(telemetry_df, calibration, ingestion_ts, window, time_window):
+    # Everything that only looks at one device's rows; safe to run per device shard
+    if not isinstance(calibration, CalibrationLookup):
+        calibration = CalibrationLookup(calibration)
+    merged_df, _ = calibration.apply(telemetry_df)
+
+    # Add timestamps
+    merged_df["ingestion_ts"] = ingestion_ts
+    merged_df["event_ts"] = pd.to_datetime(merged_df["event_ts"])
+
+    # Derived fields; datetime64 midnight rather than Python date objects (date32 on write)
+    merged_df["event_date"] = merged_df["event_ts"].dt.normalize()
+    merged_df["event_hour"] = merged_df["event_ts"].dt.hour
+
+    # Per-device hour/day averages and rolling 7 averages in one sort + vectorized pass
+    merged_df = compute_device_aggregates(merged_df, window=window, time_window=time_window)
+
+    # Add anomaly flag — dummy thresholds, tune later
+    merged_df["anomaly_flag"] = (
+        (merged_df["calibrated_temperature"] > TEMPERATURE_HOT_THRESHOLD)
+        | (merged_df["calibrated_temperature"] < TEMPERATURE_COLD_THRESHOLD)
+        | (merged_df["calibrated_humidity"] < HUMIDITY_THRESHOLD)
+    )
+    return merged_df
+
+def apply_run_state(merged_df, buckets, batch_id):
+    # State carried across runs, updated once per batch: hourly aggregate buckets (day and
+    # 7-day stats in O(new rows)) and the per-device anomaly baselines
+    if INCREMENTAL_AGGREGATES:
+        state = AggregateStateStore().update(buckets, batch_id)
+        merged_df = apply_state(merged_df, state)
+    if ANOMALY_DETECTOR == "zscore":
+        merged_df = apply_anomaly_model(merged_df, batch_id, key=ANOMALY_KEY)
+    return merged_df
+
+def transform_frame(telemetry_df, calibration, batch_id="adhoc"):
+    # Attach config attributes and apply calibration through the per-version device lookup
+    merged_df = calibrate_and_aggregate(telemetry_df, calibration, datetime.utcnow(), ROLLING_WINDOW, ROLLING_TIME_WINDOW)
+
+    merged_df = apply_run_state(merged_df, hourly_buckets(merged_df) if INCREMENTAL_AGGREGATES else None, batch_id)
+
+    # Log summary
+    logging.info(f"Transformed {len(merged_df)} rows, added calibration, anomaly flags.")
+    return merged_df
+
+def _transform_shard(buffer, cache_dir, ingestion_ts, window, time_window):
+    # Runs in a shard pool process: compact Arrow output plus the shard's hourly buckets
+    merged_df = calibrate_and_aggregate(
+        from_ipc(buffer).to_pandas(), load_calibration_lookup(cache_dir), ingestion_ts, window, time_window
+    )
+    buckets = pa.Table.from_pandas(hourly_buckets(merged_df), preserve_index=False)
+    return to_ipc(conform_frame(merged_df)), to_ipc(buckets)
+
+def transform_sharded(telemetry, batch_id="adhoc", shards=SHARD_COUNT, cache_dir=CONFIG_CACHE_DIR):
+    """
+    transform_frame over `shards` device_id hash partitions of an Arrow table, on a process pool.
+
+    Shards are disjoint sets of devices, so per-device aggregates and hourly buckets are exact;
+    the aggregate state is updated once, in this process, from all shards' buckets. Rows come
+    back grouped by shard (each device's rows still in event_ts order).
+    """
+    results = map_shards(
+        _transform_shard, telemetry, "device_id", shards,
+        cache_dir, datetime.utcnow(), ROLLING_WINDOW, ROLLING_TIME_WINDOW
+    )
+    if not results:
+        return transform_frame(telemetry.to_pandas(), load_calibration_lookup(cache_dir), batch_id)
+
+    merged_df = pa.concat_tables(
+        [from_ipc(output) for output, _ in results], promote_options="default"
+    ).to_pandas()
+    buckets = pd.concat([from_ipc(shard_buckets).to_pandas() for _, shard_buckets in results], ignore_index=True)
+    merged_df = apply_run_state(merged_df, buckets, batch_id)
+
+    logging.info(f"Transformed {len(merged_df)} rows in {len(results)} shards, added calibration, anomaly flags.")
+    return merged_df
 
 @record_task_timing
 def transform_data(**context):
     try:
-        telemetry_path = f"{INTERIM_PATH}/telemetry.parquet"
-        config_path = f"{INTERIM_PATH}/config.csv"
-
-        telemetry_df = pd.read_parquet(telemetry_path)
-        config_df = pd.read_csv(config_path)
-
-        # Merge telemetry with config on device_id
-        merged_df = pd.merge(telemetry_df, config_df, on="device_id", how="left")
-
-        # Apply calibration
-        for sensor in ["temperature", "humidity"]:
-            merged_df[f"calibrated_{sensor}"] = (
-                merged_df[sensor] * merged_df["scale"] + merged_df["offset"]
-            )
-
-        # Add timestamps
-        now = datetime.utcnow().isoformat()
-        merged_df["ingestion_ts"] = now
-        merged_df["event_ts"] = pd.to_datetime(merged_df["event_ts"])
-
-        # Derived fields
-        merged_df["event_date"] = merged_df["event_ts"].dt.date
-        merged_df["event_hour"] = merged_df["event_ts"].dt.hour
-
-        # Compute per-device hour avg (can be used later for reporting)
-        merged_df["hour_avg_temp"] = merged_df.groupby(["device_id", "event_hour"])["calibrated_temperature"].transform("mean")
-        merged_df["hour_avg_humid"] = merged_df.groupby(["device_id", "event_hour"])["calibrated_humidity"].transform("mean")
-        
-        # Compute per-device day average
-        merged_df["day_avg_temp"] = merged_df.groupby(["device_id", "event_date"])["calibrated_temperature"].transform("mean")
-        merged_df["day_avg_humid"] = merged_df.groupby(["device_id", "event_date"])["calibrated_humidity"].transform("mean")
-
-
-        # Compute rolling 7d average (assuming you have historical data in future)
-        merged_df.sort_values(by=["device_id", "event_ts"], inplace=True)
-        merged_df["rolling_7d_temp"] = merged_df.groupby("device_id")["calibrated_temperature"].transform(
-            lambda x: x.rolling(window=7, min_periods=1).mean()
-        )
-        merged_df["rolling_7d_humid"] = merged_df.groupby("device_id")["calibrated_humidity"].transform(
-            lambda x: x.rolling(window=7, min_periods=1).mean()
-        )
-
-        # Add anomaly flag — dummy thresholds, tune later
-        merged_df["anomaly_flag"] = (
-            (merged_df["calibrated_temperature"] > TEMPERATURE_HOT_THRESHOLD)
-            | (merged_df["calibrated_temperature"] < TEMPERATURE_COLD_THRESHOLD)
-            | (merged_df["calibrated_humidity"] < HUMIDITY_THRESHOLD)
-        )
-
-        # Log summary
-        logging.info(f"Transformed {len(merged_df)} rows, added calibration, anomaly flags.")
+        # All part files / hours ingested for this run, partition columns dropped
+        telemetry_dir = resolve_path(context, "telemetry_dir")
+        if not os.path.isdir(telemetry_dir):
+            logging.info(f"No interim telemetry for this run at {telemetry_dir}, nothing to transform")
+            return
+        transformed_path = run_paths(context)["transformed_path"]
+        os.makedirs(os.path.dirname(transformed_path), exist_ok=True)
+
+        if context.get("engine", TRANSFORM_ENGINE) == "duckdb":
+            # Out-of-core: read, compute and write are one streamed query plan
+            with span("compute"):
+                records, anomalies = transform_dataset(
+                    telemetry_dir, transformed_path, batch_id_from_context(context),
+                    incremental=INCREMENTAL_AGGREGATES, window=ROLLING_WINDOW, time_window=ROLLING_TIME_WINDOW,
+                    detector=ANOMALY_DETECTOR, anomaly_key=ANOMALY_KEY,
+                    profile=context.get("parquet_profile", PARQUET_PROFILE)
+                )
+            write_metrics_sidecar(transformed_path, {"records": records, "anomalies": anomalies})
+            record(rows_out=records, bytes_written=os.path.getsize(transformed_path))
+            publish_path(context, "transformed_path", transformed_path)
+            return
+
+        shards = context.get("shards", SHARD_COUNT)
+        if shards > 1:
+            # Per-device work fanned out to a process pool, one device_id hash shard each
+            with span("read"):
+                telemetry = read_telemetry_table(telemetry_dir)
+            with span("compute"):
+                merged_df = transform_sharded(telemetry, batch_id_from_context(context), shards)
+            rows_in = telemetry.num_rows
+        else:
+            with span("read"):
+                telemetry_df = read_telemetry_table(telemetry_dir).to_pandas()
+                calibration = load_calibration_lookup()
+
+            with span("compute"):
+                merged_df = transform_frame(telemetry_df, calibration, batch_id_from_context(context))
+            rows_in = len(telemetry_df)
 
         # Save transformed output
-        os.makedirs(PROCESSED_PATH, exist_ok=True)
-        merged_df.to_parquet(f"{PROCESSED_PATH}/transformed.parquet", index=False)
+        with span("write"):
+            write_parquet(conform_frame(merged_df), transformed_path, context.get("parquet_profile", PARQUET_PROFILE))
+        write_metrics_sidecar(transformed_path, {
+            "records": len(merged_df),
+            "anomalies": int(merged_df["anomaly_flag"].sum()),
+        })
+        record(rows_in=rows_in, rows_out=len(merged_df), bytes_written=os.path.getsize(transformed_path))
+        publish_path(context, "transformed_path", transformed_path)
 
     except Exception as e:
         logging.error(f"Transformation failed: {str(e)}")
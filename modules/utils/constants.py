@@ -1,20 +1,192 @@
+import os
+
+# Local data root (checkpoints, caches, intermediates, warehouse, reports); overridable so
+# benchmarks and local runs can point the pipeline at a scratch directory
+DATA_ROOT = os.environ.get("TELEMETRY_DATA_ROOT", "/opt/airflow/data")
+# When set, raw telemetry/config are read from this local directory (holding BUCKET_NAME/)
+# instead of MinIO
+RAW_DATA_ROOT = os.environ.get("TELEMETRY_RAW_ROOT")
+
 BUCKET_NAME = 'satsure-iot-data'
 RAW_PREFIX = 'raw/telemetry'
 CONFIG_PREFIX = 'raw/config'
-CHECKPOINT_FILE = '/opt/airflow/data/checkpoints/processed_files.txt'
+CONFIG_CACHE_DIR = f'{DATA_ROOT}/cache/config'
+CONFIG_CACHE_MAX_AGE_SEC = 900  # skip even the listing when the cache was checked this recently
+CHECKPOINT_FILE = f'{DATA_ROOT}/checkpoints/processed_files.txt'
+CHECKPOINT_DB = f'{DATA_ROOT}/checkpoints/processed_files.db'
+CHECKPOINT_BACKEND = 'sqlite'  # 'sqlite' (indexed) or 'text' (legacy processed_files.txt)
 MINIO_ENDPOINT= 'http://minio:9000'
 MINIO_ACCESS_KEY = 'admin'
 MINIO_SECRET_KEY='password123'
 MINIO_REGION='us-east-1'
-INTERIM_PATH = "/opt/airflow/data/interim"
-PROCESSED_PATH = "/opt/airflow/data/processed"
+INTERIM_PATH = f"{DATA_ROOT}/interim"
+PROCESSED_PATH = f"{DATA_ROOT}/processed"
+
+# Run ingest -> report as one task passing Arrow tables in memory, instead of five
+# Airflow tasks exchanging files through INTERIM_PATH / PROCESSED_PATH
+FUSED_EXECUTION = False
+
+# Streaming ingestion: record batches are copied straight into a ParquetWriter so
+# peak memory is bounded by INGEST_BATCH_SIZE rows rather than the hourly file size
+INGEST_STREAMING = True
+INGEST_BATCH_SIZE = 65536
+TELEMETRY_COLUMNS = ["device_id", "event_ts", "temperature", "humidity", "sensor_type"]
+INGEST_MAX_WORKERS = 8  # bounded thread pool for concurrent part-file reads
+INTERIM_TELEMETRY_DIR = f"{INTERIM_PATH}/telemetry"
+QUALITY_PATH = f"{PROCESSED_PATH}/../quality"
+
+# Intermediates are namespaced per run (runs/<logical date>/) so hourly runs can overlap;
+# run directories older than the retention are removed by generate_report
+INTERMEDIATE_RETENTION_HOURS = 48
+MAX_ACTIVE_RUNS = 8
 
 TEMPERATURE_HOT_THRESHOLD=45
 TEMPERATURE_COLD_THRESHOLD=-5
 HUMIDITY_THRESHOLD=10
 
+# Declarative data-quality rules, evaluated by modules.quality_rules in one pass.
+# Types: not_null, unique, required (schema only), range, numeric (schema only)
+QUALITY_RULES = [
+    {"type": "not_null", "columns": "*", "issue_type": "null_check",
+     "description": "Column '{column}' has {count} nulls"},
+    {"type": "unique", "columns": ["device_id", "event_ts"], "issue_type": "duplicate_check",
+     "label": "device_id + event_ts", "description": "{count} duplicate records found"},
+    {"type": "required", "columns": ["calibrated_temperature", "calibrated_humidity"], "issue_type": "calibration_check",
+     "label": "calibrated_temperature/humidity", "description": "Missing calibrated columns"},
+    {"type": "range", "column": "calibrated_temperature", "issue_type": "outlier_check",
+     "min": TEMPERATURE_COLD_THRESHOLD, "max": TEMPERATURE_HOT_THRESHOLD, "description": "{count} temperature outliers"},
+    {"type": "range", "column": "calibrated_humidity", "issue_type": "outlier_check",
+     "min": HUMIDITY_THRESHOLD, "description": "{count} humidity outliers"},
+    {"type": "numeric", "columns": ["temperature", "humidity", "calibrated_temperature", "calibrated_humidity"],
+     "issue_type": "type_mismatch", "description": "Non-numeric values found in '{column}'"},
+]
+
+# Rolling averages: trailing ROLLING_WINDOW rows per device, or a time window on
+# event_ts (e.g. '7D') when ROLLING_TIME_WINDOW is set
+ROLLING_WINDOW = 7
+ROLLING_TIME_WINDOW = None
+
+# Transform engine: "pandas" (in memory) or "duckdb" (out-of-core query plan on all cores that
+# spills to TRANSFORM_SPILL_DIR and streams its output to Parquet, for days beyond worker memory)
+TRANSFORM_ENGINE = "pandas"
+TRANSFORM_MEMORY_LIMIT = None  # e.g. "4GB"; None = DuckDB default (80% of RAM)
+TRANSFORM_THREADS = None  # None = all cores
+TRANSFORM_SPILL_DIR = f"{DATA_ROOT}/tmp/transform_spill"
+
+# Device-sharded execution: transform (pandas engine) and validation hash-partition rows by
+# device_id into SHARD_COUNT shards processed on as many worker processes; 0/1 = in-process
+SHARD_COUNT = 0
+
+# Task instrumentation (record_task_timing): optional profiler dump and metrics export
+TASK_PROFILER = None  # None | "cprofile" | "pyinstrument"
+PROFILE_DIR = f"{DATA_ROOT}/profiles"
+METRICS_SINK = None  # None | "prometheus" | "statsd"
+PROMETHEUS_TEXTFILE_DIR = f"{DATA_ROOT}/metrics"
+STATSD_HOST = "localhost"
+STATSD_PORT = 8125
+METRICS_PREFIX = "telemetry"
+
+# Persisted per-device hourly buckets so day / 7-day stats span earlier runs
+INCREMENTAL_AGGREGATES = True
+# Partitioned by device_id hash: a run rewrites only its devices' partitions. Changing the
+# partition count needs a fresh directory. A legacy {dir}.parquet file is split on first use
+AGGREGATE_STATE_DIR = f"{DATA_ROOT}/state/device_hourly_buckets"
+AGGREGATE_STATE_PARTITIONS = 64
+AGGREGATE_STATE_RETENTION_HOURS = 8 * 24  # per-device ring buffer, 7 days + 1 day of slack
+
+# anomaly_flag: "static" (the thresholds above for every device) or "zscore" (per-key
+# Welford mean/variance persisted across runs; rows more than ANOMALY_Z_THRESHOLD standard
+# deviations from their key's earlier readings are flagged, keys with fewer than
+# ANOMALY_MIN_COUNT readings fall back to the static thresholds). Keyed by device_id or device_type
+ANOMALY_DETECTOR = "static"
+ANOMALY_KEY = "device_id"
+ANOMALY_Z_THRESHOLD = 4.0
+ANOMALY_MIN_COUNT = 30
+ANOMALY_STATE_PATH = f"{DATA_ROOT}/state/anomaly_moments.parquet"
+ANOMALY_STATE_BATCHES = 24  # newest batches kept separate (retry-safe); older ones are folded, their retries ignored
+
 # Define local Iceberg-compatible warehouse path
-ICEBERG_WAREHOUSE = "/opt/airflow/data/warehouse"
+ICEBERG_WAREHOUSE = f"{DATA_ROOT}/warehouse"
 ICEBERG_TABLE = "iot_telemetry"
 
-REPORTS_DIR = "/opt/airflow/data/reports"
\ No newline at end of file
+# Persistent DuckDB database holding the "iceberg" schema; one session per worker process
+DUCKDB_DATABASE = f"{ICEBERG_WAREHOUSE}/telemetry.duckdb"
+DUCKDB_EXTENSIONS = [ext for ext in os.environ.get("TELEMETRY_DUCKDB_EXTENSIONS", "httpfs,iceberg").split(",") if ext]
+DUCKDB_LOCK_TIMEOUT_SEC = 120  # wait this long for another process's write lock
+
+# Table maintenance: rewrite sorted by LOAD_CLUSTER_COLUMNS + MAINTENANCE_SORT_COLUMNS and expire
+# snapshot-log entries older than the retention (the latest snapshot is always kept)
+MAINTENANCE_ENABLED = False
+MAINTENANCE_HOUR = 0  # hourly DAG runs maintenance only for this logical hour
+MAINTENANCE_SORT_COLUMNS = ["device_id", "event_ts"]
+SNAPSHOT_RETENTION_DAYS = 7
+STAGING_TMP_RETENTION_HOURS = 24
+
+# Loads are staged per run and merged in one commit once LOAD_BUFFER_HOURS runs are
+# buffered or the oldest staged run is LOAD_BUFFER_MAX_AGE_SEC old
+LOAD_STAGING_DIR = f"{ICEBERG_WAREHOUSE}/_staging"
+LOAD_BUFFER_HOURS = 6
+LOAD_BUFFER_MAX_AGE_SEC = 3 * 3600
+LOAD_CLUSTER_COLUMNS = ["event_date", "device_type"]
+
+# Cross-run dedup index of stored (device_id, event_ts) keys per event_date (modules/dedup.py).
+# Loads whose keys are all new are appended without the MERGE/DELETE join against the table.
+# DEDUP_INGEST_MODE probes it at ingest: "flag" logs re-sent events, "drop" removes them
+# (only for sources that re-send identical events; corrections are otherwise upserted)
+DEDUP_INDEX = False
+DEDUP_INDEX_DIR = f"{ICEBERG_WAREHOUSE}/_dedup_index"
+DEDUP_INDEX_COMPACT_FILES = 24  # per-date key files merged into one beyond this
+DEDUP_INGEST_MODE = None  # None | "flag" | "drop"
+
+# Parquet write profiles (modules/utils/parquet_profiles.py) for the transformed output,
+# staged loads and the report history. sort_by orders the rows (and the stored table's
+# inserts) so row-group statistics, page indexes and Bloom filters prune point and range
+# reads; compare profiles with benchmarks/bench_parquet_profiles.py
+PARQUET_PROFILES = {
+    # pyarrow defaults in input order: the layout before profiles existed
+    "default": {},
+    # Point / range reads by device and time: small sorted row groups, page index, Bloom filter
+    "read_optimized": {
+        "sort_by": ["device_id", "event_ts"],
+        "row_group_size": 128 * 1024,
+        "compression": "zstd",
+        "compression_level": 3,
+        "use_dictionary": True,
+        "write_statistics": True,
+        "write_page_index": True,
+        "bloom_filter_columns": ["device_id"],
+        "bloom_filter_fpp": 0.01,
+    },
+    # Smallest files: sorted, large row groups, high zstd level, no page index
+    "compact": {
+        "sort_by": ["device_id", "event_ts"],
+        "row_group_size": 1024 * 1024,
+        "compression": "zstd",
+        "compression_level": 9,
+        "use_dictionary": True,
+        "write_statistics": True,
+        "write_page_index": False,
+    },
+}
+PARQUET_PROFILE = "default"
+
+REPORTS_DIR = f"{DATA_ROOT}/reports"
+
+# Run report history: hive-partitioned Parquet, one partition per month
+REPORT_HISTORY_DIR = f"{REPORTS_DIR}/history"
+
+# Micro-batch worker (python -m modules.microbatch): polls the raw prefix every
+# MICROBATCH_INTERVAL_MIN minutes and runs the fused pipeline in-process on new files only.
+# Files landing for hours older than MICROBATCH_LOOKBACK_HOURS are left to backfills
+MICROBATCH_INTERVAL_MIN = 5
+MICROBATCH_LOOKBACK_HOURS = 2
+MICROBATCH_COMMIT_SEC = 0  # staged batches are committed once this old; 0 = every batch
+
+# Query serving (modules/query.py): LRU of results, invalidated by table snapshot id
+QUERY_CACHE_SIZE = 256
+QUERY_HTTP_HOST = "127.0.0.1"
+QUERY_HTTP_PORT = 8085
+# Each commit copies the whole database to a read replica (telemetry.replica.duckdb) that the
+# HTTP server reads, so queries never wait for the pipeline's write lock. Off unless the query
+# server is deployed: the copy is paid inside every load
+QUERY_REPLICA = os.environ.get("TELEMETRY_QUERY_REPLICA", "0") == "1"
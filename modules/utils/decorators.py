@@ -1,26 +1,43 @@
 from functools import wraps
-from datetime import datetime
 import logging
+from modules.utils.constants import TASK_PROFILER
+from modules.utils.profiling import TaskMetrics, activate, task_profiler
+from modules.utils.metrics_sinks import export_metrics
+from modules.utils.duckdb_session import release_sessions
 
 def record_task_timing(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        logging.info(f"Context arguments for: {func} are: {args} \n\n {kwargs}")
         ti = kwargs.get('ti', None)
-        
-        logging.info(f"Task instance data is: {ti}")
-
-        start_time = datetime.utcnow()
-        if ti:
-            ti.xcom_push(key="start_time", value=start_time.isoformat())
+        task_id = getattr(ti, "task_id", None) or func.__name__
+        logging.info(f"Starting task '{task_id}' (run_id={kwargs.get('run_id')})")
 
+        metrics = TaskMetrics(task_id)
+        status = "failed"
         try:
-            return func(*args, **kwargs)
+            with activate(metrics), task_profiler(task_id, kwargs.get("profiler", TASK_PROFILER)):
+                result = func(*args, **kwargs)
+            status = "success"
+            return result
         except Exception as e:
             logging.error(f"Task '{func.__name__}' failed: {str(e)}")
             raise
         finally:
-            end_time = datetime.utcnow()
+            metrics.finish(status)
+            logging.info(metrics.summary())
+            export_metrics(metrics)
+            # One XCom per task, so the report fetches every task's metrics in a single pull
             if ti:
-                ti.xcom_push(key="end_time", value=end_time.isoformat())
+                ti.xcom_push(key="task_timing", value=metrics.as_dict())
+    return wrapper
+
+def releases_duckdb_session(func):
+    # DuckDB-writing tasks hold the database's single write lock only while they run, not
+    # for the life of the worker process that ran them
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            release_sessions()
     return wrapper
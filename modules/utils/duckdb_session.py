@@ -0,0 +1,181 @@
+import os
+import time
+import atexit
+import shutil
+import tempfile
+import logging
+import threading
+from urllib.parse import urlparse
+import duckdb
+from modules.utils.constants import (
+    DUCKDB_DATABASE,
+    DUCKDB_EXTENSIONS,
+    DUCKDB_LOCK_TIMEOUT_SEC,
+    QUERY_REPLICA,
+    MINIO_ENDPOINT,
+    MINIO_ACCESS_KEY,
+    MINIO_SECRET_KEY,
+    MINIO_REGION
+)
+
+
+class DuckDBSession:
+    """
+    One persistent DuckDB connection per worker process, configured once.
+
+    Extensions are loaded (and only installed when missing) and the MinIO credentials are
+    registered as a DuckDB secret when the connection opens, so tasks no longer pay for
+    INSTALL/SET on every call. Threads get their own cursor on the shared database.
+    `read_only` sessions can share the file with other readers but never with the writing
+    pipeline, so query serving opens them on the read replica (publish_replica).
+    """
+
+    def __init__(self, database=DUCKDB_DATABASE, extensions=DUCKDB_EXTENSIONS, s3=None,
+                 lock_timeout=DUCKDB_LOCK_TIMEOUT_SEC, read_only=False):
+        self.database = database
+        self.extensions = extensions
+        self.read_only = read_only
+        # S3 credentials need httpfs
+        self.s3 = "httpfs" in extensions if s3 is None else s3
+        self.lock_timeout = lock_timeout
+        self._con = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        if self.database != ":memory:" and not self.read_only:
+            os.makedirs(os.path.dirname(self.database), exist_ok=True)
+
+        # A DuckDB file has a single writer process; wait for another task to release it
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.1
+        while True:
+            try:
+                return duckdb.connect(database=self.database, read_only=self.read_only)
+            except duckdb.IOException as e:
+                if "lock" not in str(e).lower() or time.monotonic() >= deadline:
+                    raise
+                logging.info(f"DuckDB database {self.database} is locked, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+
+    def _configure(self, con):
+        for extension in self.extensions:
+            try:
+                con.execute(f"LOAD {extension};")
+            except duckdb.Error:
+                con.execute(f"INSTALL {extension}; LOAD {extension};")
+
+        if self.s3:
+            endpoint = urlparse(MINIO_ENDPOINT)
+            try:
+                con.execute(f"""
+                    CREATE OR REPLACE SECRET minio (
+                        TYPE s3,
+                        KEY_ID '{MINIO_ACCESS_KEY}',
+                        SECRET '{MINIO_SECRET_KEY}',
+                        REGION '{MINIO_REGION}',
+                        ENDPOINT '{endpoint.netloc or MINIO_ENDPOINT}',
+                        USE_SSL {str(endpoint.scheme == "https").lower()},
+                        URL_STYLE 'path'
+                    );
+                """)
+            except duckdb.Error as e:
+                # Older DuckDB without secrets: fall back to session settings
+                logging.warning(f"CREATE SECRET failed ({e}), using s3_* settings")
+                con.execute(f"SET s3_endpoint='{MINIO_ENDPOINT}';")
+                con.execute(f"SET s3_region='{MINIO_REGION}';")
+                con.execute(f"SET s3_access_key_id='{MINIO_ACCESS_KEY}';")
+                con.execute(f"SET s3_secret_access_key='{MINIO_SECRET_KEY}';")
+
+        if not self.read_only:
+            con.execute("CREATE SCHEMA IF NOT EXISTS iceberg;")
+
+    def open(self):
+        # A new configured connection, owned (and closed) by the caller
+        con = self._connect()
+        try:
+            self._configure(con)
+        except Exception:
+            con.close()
+            raise
+        return con
+
+    def connection(self):
+        with self._lock:
+            if self._con is None:
+                self._con = self.open()
+                logging.info(f"Opened DuckDB session on {self.database}")
+            return self._con
+
+    def cursor(self):
+        # DuckDB connections are not thread-safe; each thread reuses its own cursor
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self.connection().cursor()
+            self._local.cursor = cursor
+        return cursor
+
+    def close(self):
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+            self._local = threading.local()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(database=DUCKDB_DATABASE):
+    # Keyed by pid so forked workers open their own connection
+    key = (database, os.getpid())
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = DuckDBSession(database)
+            atexit.register(_sessions[key].close)
+        return _sessions[key]
+
+
+def release_sessions():
+    # Close this process's sessions so other worker processes can take the write lock;
+    # the next get_session().cursor() reopens (extensions are already installed)
+    with _sessions_lock:
+        sessions = [session for (_, pid), session in _sessions.items() if pid == os.getpid()]
+    for session in sessions:
+        session.close()
+
+
+def replica_path(database=DUCKDB_DATABASE):
+    # telemetry.duckdb -> telemetry.replica.duckdb
+    root, ext = os.path.splitext(database)
+    return f"{root}.replica{ext}"
+
+
+def publish_replica(con):
+    """
+    Copy the committed database to its read replica, swapped in atomically.
+
+    Called by the writer after a commit. Readers open the replica read-only, so they never
+    wait for the writer's lock; one that still has the previous replica open keeps reading
+    that file until it reconnects. Returns the replica path (None for in-memory databases).
+    """
+    database = con.execute("SELECT path FROM duckdb_databases() WHERE database_name = current_database()").fetchone()[0]
+    if not QUERY_REPLICA or not database:
+        return None
+    replica = replica_path(database)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(replica), suffix=".tmp")
+    os.close(fd)
+    try:
+        # After a checkpoint every committed change is in the main file, none in the WAL
+        con.execute("CHECKPOINT;")
+        shutil.copyfile(database, tmp_path)
+        os.replace(tmp_path, replica)
+    except (OSError, duckdb.Error) as e:
+        # The commit stands; readers keep the previous replica until the next one
+        logging.warning(f"Could not publish the read replica of {database}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+    return replica
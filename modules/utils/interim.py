@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import shutil
+import logging
+import pyarrow as pa
+import pyarrow.dataset as ds
+from modules.utils.constants import (
+    INTERIM_PATH,
+    INTERIM_TELEMETRY_DIR,
+    PROCESSED_PATH,
+    QUALITY_PATH,
+    INTERMEDIATE_RETENTION_HOURS
+)
+
+# Interim telemetry is a hive-partitioned dataset: telemetry/date=YYYY-MM-DD/hour=HH/*.parquet
+PARTITION_COLUMNS = ["date", "hour"]
+HOUR_PARTITIONING = ds.partitioning(
+    pa.schema([("date", pa.string()), ("hour", pa.string())]),
+    flavor="hive"
+)
+
+# Intermediate reference -> task that produces it (and pushes it to XCom)
+PRODUCERS = {
+    "telemetry_dir": "ingest_raw_data",
+    "transformed_path": "transform_data",
+    "quality_report_path": "validate_data",
+}
+
+
+def telemetry_dataset(path):
+    return ds.dataset(path, format="parquet", partitioning=HOUR_PARTITIONING)
+
+
+def read_telemetry_table(path):
+    # Partition keys are layout only; event_ts already carries date and hour
+    dataset = telemetry_dataset(path)
+    columns = [name for name in dataset.schema.names if name not in PARTITION_COLUMNS]
+    return dataset.to_table(columns=columns)
+
+
+def run_key(context):
+    logical_date = context.get("logical_date") or context.get("execution_date")
+    if logical_date is None:
+        return None
+    return logical_date.strftime("%Y%m%dT%H%M%S")
+
+
+def run_paths(context):
+    key = run_key(context)
+    if key is None:
+        # Ad-hoc calls without a run context keep the legacy fixed locations
+        return {
+            "telemetry_dir": INTERIM_TELEMETRY_DIR,
+            "transformed_path": f"{PROCESSED_PATH}/transformed.parquet",
+            "quality_report_path": f"{QUALITY_PATH}/data_quality_issues.csv",
+        }
+    return {
+        "telemetry_dir": f"{INTERIM_PATH}/runs/{key}/telemetry",
+        "transformed_path": f"{PROCESSED_PATH}/runs/{key}/transformed.parquet",
+        "quality_report_path": f"{QUALITY_PATH}/runs/{key}/data_quality_issues.csv",
+    }
+
+
+def publish_path(context, name, path):
+    ti = context.get("ti")
+    if ti:
+        ti.xcom_push(key=name, value=path)
+
+
+def resolve_path(context, name):
+    # Prefer the reference the producing task pushed; fall back to this run's own location
+    ti = context.get("ti")
+    if ti:
+        ref = ti.xcom_pull(task_ids=PRODUCERS[name], key=name)
+        if ref:
+            return ref
+    return run_paths(context)[name]
+
+
+def write_metrics_sidecar(path, metrics):
+    # Tiny JSON next to an intermediate, stamped with the file's size/mtime so a stale
+    # sidecar (file rewritten without it) is never trusted
+    stat = os.stat(path)
+    payload = dict(metrics, source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns)
+    tmp_path = f"{path}.metrics.json.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, f"{path}.metrics.json")
+
+
+def read_metrics_sidecar(path):
+    sidecar_path = f"{path}.metrics.json"
+    if not os.path.exists(path) or not os.path.exists(sidecar_path):
+        return None
+    with open(sidecar_path, "r") as f:
+        metrics = json.load(f)
+    stat = os.stat(path)
+    if metrics.get("source_size") != stat.st_size or metrics.get("source_mtime_ns") != stat.st_mtime_ns:
+        return None
+    return metrics
+
+
+def cleanup_run_intermediates(retention_hours=INTERMEDIATE_RETENTION_HOURS,
+                              base_dirs=(INTERIM_PATH, PROCESSED_PATH, QUALITY_PATH)):
+    cutoff = time.time() - retention_hours * 3600
+    removed = []
+    for base_dir in base_dirs:
+        runs_dir = os.path.join(base_dir, "runs")
+        if not os.path.isdir(runs_dir):
+            continue
+        for entry in os.scandir(runs_dir):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed.append(entry.path)
+
+    if removed:
+        logging.info(f"Removed {len(removed)} run intermediate directories older than {retention_hours}h")
+    return removed
@@ -0,0 +1,102 @@
+import os
+import socket
+import logging
+from modules.utils.constants import (
+    METRICS_SINK,
+    METRICS_PREFIX,
+    PROMETHEUS_TEXTFILE_DIR,
+    STATSD_HOST,
+    STATSD_PORT
+)
+from modules.utils.profiling import COUNTERS
+
+
+def _metric_samples(metrics):
+    # (name, labels, value, kind) for every number in a TaskMetrics
+    labels = {"task": metrics.task_id, "status": metrics.status}
+    samples = [
+        ("task_duration_seconds", labels, metrics.wall_sec, "gauge"),
+        ("task_cpu_seconds", labels, metrics.cpu_sec, "gauge"),
+        ("task_peak_rss_megabytes", labels, metrics.task_peak_rss_mb, "gauge"),
+    ]
+    samples += [(f"task_{name}", labels, metrics.counters[name], "counter") for name in COUNTERS]
+    samples += [
+        ("task_span_seconds", dict(labels, span=name), seconds, "gauge")
+        for name, seconds in metrics.spans.items()
+    ]
+    # No task peak when the task stayed below an earlier task's and the high-water mark cannot be reset
+    return [sample for sample in samples if sample[2] is not None]
+
+
+class PrometheusTextfileSink:
+    """One .prom file per task for node_exporter's textfile collector (last run's values)."""
+
+    def __init__(self, directory=PROMETHEUS_TEXTFILE_DIR, prefix=METRICS_PREFIX):
+        self.directory = directory
+        self.prefix = prefix
+
+    def emit(self, metrics):
+        lines = []
+        typed = set()
+        for name, labels, value, kind in _metric_samples(metrics):
+            metric = f"{self.prefix}_{name}"
+            if metric not in typed:
+                # The last-run value of a counter is exposed as a gauge
+                lines.append(f"# TYPE {metric} gauge")
+                typed.add(metric)
+            label_str = ",".join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f"{metric}{{{label_str}}} {float(value or 0)}")
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.prefix}_{metrics.task_id}.prom")
+        with open(f"{path}.tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+
+class StatsDSink:
+    """Fire-and-forget UDP lines in the StatsD format (timers in ms, counters, gauges)."""
+
+    def __init__(self, host=STATSD_HOST, port=STATSD_PORT, prefix=METRICS_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+
+    def lines(self, metrics):
+        lines = []
+        for name, labels, value, kind in _metric_samples(metrics):
+            path = ".".join([self.prefix, metrics.task_id] + ([labels["span"]] if "span" in labels else []) + [name])
+            if name.endswith("_seconds"):
+                lines.append(f"{path[:-len('_seconds')]}:{float(value or 0) * 1000:.3f}|ms")
+            elif kind == "counter":
+                lines.append(f"{path}:{int(value or 0)}|c")
+            else:
+                lines.append(f"{path}:{float(value or 0)}|g")
+        return lines
+
+    def emit(self, metrics):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for line in self.lines(metrics):
+                sock.sendto(line.encode(), self.address)
+        finally:
+            sock.close()
+
+
+def get_sink(kind=METRICS_SINK):
+    if not kind:
+        return None
+    if kind == "prometheus":
+        return PrometheusTextfileSink()
+    if kind == "statsd":
+        return StatsDSink()
+    raise ValueError(f"Unknown metrics sink: {kind}")
+
+
+def export_metrics(metrics, kind=METRICS_SINK):
+    # Metrics must never fail the task
+    try:
+        sink = get_sink(kind)
+        if sink is not None:
+            sink.emit(metrics)
+    except Exception as e:
+        logging.warning(f"Could not export metrics for {metrics.task_id}: {e}")
@@ -0,0 +1,81 @@
+import inspect
+import logging
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from modules.utils.constants import PARQUET_PROFILES, PARQUET_PROFILE
+
+# Profile keys passed straight to the pyarrow writer
+WRITER_OPTIONS = ["compression", "compression_level", "use_dictionary", "write_statistics", "write_page_index", "data_page_size"]
+# Page indexes, sorting columns and Bloom filters arrived in different pyarrow releases
+SUPPORTED_OPTIONS = set(inspect.signature(pq.ParquetWriter.__init__).parameters) | {"row_group_size"}
+
+
+def get_profile(name=None):
+    name = name or PARQUET_PROFILE
+    if name not in PARQUET_PROFILES:
+        raise ValueError(f"Unknown Parquet profile: {name}")
+    return PARQUET_PROFILES[name]
+
+
+def sort_columns(profile, column_names):
+    return [col for col in profile.get("sort_by", []) if col in column_names]
+
+
+def _decoded(values):
+    # Dictionary (categorical) columns as their values: compute kernels skip dictionaries
+    return values.cast(values.type.value_type) if pa.types.is_dictionary(values.type) else values
+
+
+def sort_table(table, profile):
+    # Stable, nulls last
+    keys = sort_columns(profile, table.column_names)
+    if not keys:
+        return table
+    columns = pa.table({col: _decoded(table.column(col)) for col in keys})
+    return table.take(pc.sort_indices(columns, sort_keys=[(col, "ascending") for col in keys]))
+
+
+def writer_options(table, profile):
+    """pq.write_table keyword arguments of a profile for `table`."""
+    options = {key: profile[key] for key in WRITER_OPTIONS if key in profile}
+    if "row_group_size" in profile:
+        options["row_group_size"] = profile["row_group_size"]
+
+    keys = sort_columns(profile, table.column_names)
+    if keys:
+        options["sorting_columns"] = pq.SortingColumn.from_ordering(table.schema, [(col, "ascending") for col in keys])
+
+    blooms = [col for col in profile.get("bloom_filter_columns", []) if col in table.column_names]
+    if blooms:
+        # NDV per file: the distinct values of the column, not the row count
+        options["bloom_filter_options"] = {
+            col: {"ndv": max(1, pc.count_distinct(_decoded(table.column(col))).as_py()), "fpp": profile.get("bloom_filter_fpp", 0.05)}
+            for col in blooms
+        }
+
+    unsupported = [key for key in options if key not in SUPPORTED_OPTIONS]
+    if unsupported:
+        logging.warning(f"pyarrow {pa.__version__} cannot write {', '.join(unsupported)}; skipped")
+    return {key: value for key, value in options.items() if key not in unsupported}
+
+
+def write_parquet(table, where, profile=None):
+    """Write an Arrow table with a write profile: sort order, row groups, codec, statistics, indexes."""
+    profile = profile if isinstance(profile, dict) else get_profile(profile)
+    table = sort_table(table, profile)
+    pq.write_table(table, where, **writer_options(table, profile))
+    return table
+
+
+def copy_options(profile=None):
+    """The subset of a profile DuckDB's COPY ... (FORMAT parquet) understands, as an option list."""
+    profile = profile if isinstance(profile, dict) else get_profile(profile)
+    options = ["FORMAT parquet"]
+    if "row_group_size" in profile:
+        options.append(f"ROW_GROUP_SIZE {int(profile['row_group_size'])}")
+    if "compression" in profile:
+        options.append(f"COMPRESSION {profile['compression']}")
+        if profile["compression"] == "zstd" and "compression_level" in profile:
+            options.append(f"COMPRESSION_LEVEL {int(profile['compression_level'])}")
+    return ", ".join(options)
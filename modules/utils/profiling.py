@@ -0,0 +1,202 @@
+import os
+import sys
+import time
+import resource
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from modules.utils.constants import PROFILE_DIR
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def reset_peak_rss():
+    # Linux (>= 4.0): writing 5 to clear_refs resets the process's VmHWM to its current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def hwm_rss_mb():
+    # VmHWM, the RSS high-water mark since the last reset_peak_rss()
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+COUNTERS = ["rows_in", "rows_out", "bytes_read", "bytes_written"]
+
+
+class TaskMetrics:
+    """
+    Wall/CPU time, peak RSS, row and byte counters and named sub-spans of one task run.
+
+    The peak is the task's own: the RSS high-water mark is reset at task start where Linux allows
+    it, otherwise only a rise of the process-lifetime ru_maxrss is attributed to the task (None when
+    the task stayed below an earlier task's peak). peak_rss_growth_mb is that rise in both cases.
+
+    Spans nest by name ("read", "compute", "write", ...); time spent in the same span name
+    twice is summed. Counters accumulate across calls.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.spans = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started_at = datetime.utcnow()
+        self.ended_at = None
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self.wall_sec = None
+        self.cpu_sec = None
+        self.task_peak_rss_mb = None
+        self.peak_rss_growth_mb = None
+        self.status = "running"
+        # An enclosing task keeps the peak reached so far before the reset hides it
+        outer = current_metrics()
+        if outer is not None and outer._hwm_reset:
+            outer._nested_peak_mb = max(outer._nested_peak_mb or 0.0, hwm_rss_mb() or 0.0)
+        self._nested_peak_mb = None
+        self._maxrss_start = peak_rss_mb()
+        self._hwm_reset = reset_peak_rss()
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + time.perf_counter() - started
+
+    def add(self, **counters):
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def finish(self, status):
+        self.ended_at = datetime.utcnow()
+        self.wall_sec = time.perf_counter() - self._wall_start
+        self.cpu_sec = time.process_time() - self._cpu_start
+        maxrss = peak_rss_mb()
+        self.peak_rss_growth_mb = maxrss - self._maxrss_start
+        if self._hwm_reset:
+            self.task_peak_rss_mb = max(hwm_rss_mb() or 0.0, self._nested_peak_mb or 0.0) or None
+        elif self.peak_rss_growth_mb > 0:
+            self.task_peak_rss_mb = maxrss
+        self.status = status
+
+    def as_dict(self):
+        return {
+            "task_id": self.task_id,
+            "status": self.status,
+            "start_time": self.started_at.isoformat(),
+            "end_time": self.ended_at.isoformat() if self.ended_at else None,
+            "duration_sec": self.wall_sec,
+            "cpu_sec": self.cpu_sec,
+            "task_peak_rss_mb": self.task_peak_rss_mb,
+            "peak_rss_growth_mb": self.peak_rss_growth_mb,
+            "spans": dict(self.spans),
+            **self.counters,
+        }
+
+    def summary(self):
+        spans = ", ".join(f"{name}={sec:.2f}s" for name, sec in self.spans.items())
+        counters = ", ".join(f"{name}={value}" for name, value in self.counters.items() if value)
+        peak = f"{self.task_peak_rss_mb:.1f} MB" if self.task_peak_rss_mb else "below an earlier task's"
+        return (
+            f"Task '{self.task_id}' {self.status}: wall {self.wall_sec:.2f}s, cpu {self.cpu_sec:.2f}s, "
+            f"peak RSS {peak} (process peak +{self.peak_rss_growth_mb:.1f} MB)" + (f"; spans {spans}" if spans else "")
+            + (f"; {counters}" if counters else "")
+        )
+
+
+# Metrics of the task running in this thread; stage code reports through span()/record()
+_active = threading.local()
+
+
+def current_metrics():
+    return getattr(_active, "metrics", None)
+
+
+@contextmanager
+def activate(metrics):
+    previous = current_metrics()
+    _active.metrics = metrics
+    try:
+        yield metrics
+    finally:
+        _active.metrics = previous
+
+
+@contextmanager
+def span(name):
+    # No-op outside an instrumented task
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    with metrics.span(name):
+        yield
+
+
+def record(**counters):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add(**counters)
+
+
+@contextmanager
+def task_profiler(task_id, profiler, profile_dir=None):
+    """Optional per-task profile dump: cProfile (.prof) or pyinstrument (.html)."""
+    if not profiler:
+        yield None
+        return
+
+    profile_dir = profile_dir or PROFILE_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    stem = os.path.join(profile_dir, f"{task_id}-{datetime.utcnow():%Y%m%dT%H%M%S}")
+
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logging.warning("pyinstrument is not installed, falling back to cProfile")
+            profiler = "cprofile"
+        else:
+            session = Profiler()
+            session.start()
+            try:
+                yield f"{stem}.html"
+            finally:
+                session.stop()
+                with open(f"{stem}.html", "w") as f:
+                    f.write(session.output_html())
+                logging.info(f"Wrote pyinstrument profile to {stem}.html")
+            return
+
+    if profiler != "cprofile":
+        raise ValueError(f"Unknown task profiler: {profiler}")
+
+    import cProfile
+    session = cProfile.Profile()
+    session.enable()
+    try:
+        yield f"{stem}.prof"
+    finally:
+        session.disable()
+        session.dump_stats(f"{stem}.prof")
+        logging.info(f"Wrote cProfile stats to {stem}.prof")
@@ -0,0 +1,70 @@
+import logging
+import pyarrow as pa
+
+# Low-cardinality strings travel dictionary-encoded (pandas categoricals in the transform)
+DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
+
+# Canonical column types of the pipeline; columns outside a schema keep their own type
+TELEMETRY_SCHEMA = pa.schema([
+    ("device_id", DICTIONARY_STRING),
+    ("event_ts", pa.timestamp("us")),
+    ("temperature", pa.float32()),
+    ("humidity", pa.float32()),
+    ("sensor_type", DICTIONARY_STRING),
+])
+
+TRANSFORMED_SCHEMA = pa.schema(list(TELEMETRY_SCHEMA) + [
+    ("device_type", DICTIONARY_STRING),
+    ("scale", pa.float32()),
+    ("offset", pa.float32()),
+    ("calibrated_temperature", pa.float32()),
+    ("calibrated_humidity", pa.float32()),
+    ("ingestion_ts", pa.timestamp("us")),
+    ("event_date", pa.date32()),
+    ("event_hour", pa.int16()),
+    ("hour_avg_temp", pa.float32()),
+    ("hour_avg_humid", pa.float32()),
+    ("day_avg_temp", pa.float32()),
+    ("day_avg_humid", pa.float32()),
+    ("rolling_7d_temp", pa.float32()),
+    ("rolling_7d_humid", pa.float32()),
+    ("anomaly_flag", pa.bool_()),
+    ("anomaly_score", pa.float32()),
+])
+
+
+def conform_array(array, data_type):
+    if array.type == data_type:
+        return array
+    if pa.types.is_dictionary(array.type) and pa.types.is_dictionary(data_type):
+        # Re-encode e.g. dictionary<int8, large_string> from pandas categoricals
+        array = array.cast(array.type.value_type)
+    # Unsafe: float32 and microsecond truncation are the point of the schema
+    return array.cast(data_type, safe=False)
+
+
+def conform_table(table, canonical=TRANSFORMED_SCHEMA):
+    """
+    Cast the columns of an Arrow table or record batch to their canonical types.
+
+    A column that does not cast (e.g. non-numeric sensor values) keeps its type, so the
+    type_mismatch quality rule still reports it instead of the stage failing.
+    """
+    fields, columns = [], []
+    for field, column in zip(table.schema, table.columns):
+        if field.name in canonical.names:
+            try:
+                column = conform_array(column, canonical.field(field.name).type)
+                field = pa.field(field.name, column.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                logging.warning(f"Column '{field.name}' kept as {field.type}: {e}")
+        fields.append(field)
+        columns.append(column)
+    if isinstance(table, pa.RecordBatch):
+        return pa.RecordBatch.from_arrays(columns, schema=pa.schema(fields))
+    return pa.Table.from_arrays(columns, schema=pa.schema(fields))
+
+
+def conform_frame(df, canonical=TRANSFORMED_SCHEMA):
+    """Arrow table of a DataFrame in the canonical types."""
+    return conform_table(pa.Table.from_pandas(df, preserve_index=False), canonical)
@@ -1,99 +1,47 @@
 import pandas as pd
+import pyarrow.parquet as pq
 import os
 import logging
 from datetime import datetime
-from modules.utils.constants import (
-    PROCESSED_PATH,
-    TEMPERATURE_HOT_THRESHOLD,
-    TEMPERATURE_COLD_THRESHOLD,
-    HUMIDITY_THRESHOLD
-)
+from modules.utils.constants import QUALITY_RULES, SHARD_COUNT
 from modules.utils.decorators import record_task_timing
+from modules.utils.profiling import span, record
+from modules.quality_rules import run_quality_checks, run_quality_checks_sharded
+from modules.utils.interim import resolve_path, run_paths, publish_path, write_metrics_sidecar
 
+ISSUE_COLUMNS = ["issue_type", "column", "count", "description"]
 
-@record_task_timing
-def validate_data(**context):
-    try:
-        input_path = f"{PROCESSED_PATH}/transformed.parquet"
-        quality_dir = f"{PROCESSED_PATH}/../quality"
-        quality_report_path = os.path.join(quality_dir, "data_quality_issues.csv")
-        os.makedirs(quality_dir, exist_ok=True)
-
-        df = pd.read_parquet(input_path)
-
-        issues = []
-
-        # 1. Null checks
-        null_counts = df.isnull().sum()
-        for col, count in null_counts.items():
-            if count > 0:
-                issues.append({
-                    "issue_type": "null_check",
-                    "column": col,
-                    "count": int(count),
-                    "description": f"Column '{col}' has {count} nulls"
-                })
-
-        # 2. Duplicate checks
-        dup_count = df.duplicated(subset=["device_id", "event_ts"]).sum()
-        if dup_count > 0:
-            issues.append({
-                "issue_type": "duplicate_check",
-                "column": "device_id + event_ts",
-                "count": int(dup_count),
-                "description": f"{dup_count} duplicate records found"
-            })
 
-        # 3. Calibration validation
-        if "calibrated_temperature" not in df.columns or "calibrated_humidity" not in df.columns:
-            issues.append({
-                "issue_type": "calibration_check",
-                "column": "calibrated_temperature/humidity",
-                "count": 0,
-                "description": "Missing calibrated columns"
-            })
+def write_quality_report(issues, quality_report_path):
+    os.makedirs(os.path.dirname(quality_report_path), exist_ok=True)
+    issues_df = pd.DataFrame(issues, columns=ISSUE_COLUMNS)
+    issues_df["validation_ts"] = datetime.utcnow().isoformat()
+    issues_df.to_csv(quality_report_path, index=False)
+    write_metrics_sidecar(quality_report_path, {"quality_issues": len(issues)})
 
-        # 4. Outlier checks
-        outlier_temp = df[
-            (df["calibrated_temperature"] > TEMPERATURE_HOT_THRESHOLD) |
-            (df["calibrated_temperature"] < TEMPERATURE_COLD_THRESHOLD)
-        ]
-        if len(outlier_temp):
-            issues.append({
-                "issue_type": "outlier_check",
-                "column": "calibrated_temperature",
-                "count": len(outlier_temp),
-                "description": f"{len(outlier_temp)} temperature outliers"
-            })
+    logging.info(f"Validation completed. {len(issues)} issues found.")
+    logging.info(f"Saved validation report: {quality_report_path}")
 
-        outlier_humid = df[df["calibrated_humidity"] < HUMIDITY_THRESHOLD]
-        if len(outlier_humid):
-            issues.append({
-                "issue_type": "outlier_check",
-                "column": "calibrated_humidity",
-                "count": len(outlier_humid),
-                "description": f"{len(outlier_humid)} humidity outliers"
-            })
-
-        def is_numeric(series):
-            return pd.to_numeric(series, errors='coerce').notnull().all()
-
-        for col in ['temperature', 'humidity', 'calibrated_temperature', 'calibrated_humidity']:
-            if col in df.columns and not is_numeric(df[col]):
-                issues.append({
-                    "issue_type": "type_mismatch",
-                    "column": col,
-                    "count": df[col].shape[0],
-                    "description": f"Non-numeric values found in '{col}'"
-                })
-
-        # Save report
-        issues_df = pd.DataFrame(issues)
-        issues_df["validation_ts"] = datetime.utcnow().isoformat()
-        issues_df.to_csv(quality_report_path, index=False)
-
-        logging.info(f"Validation completed. {len(issues)} issues found.")
-        logging.info(f"Saved validation report: {quality_report_path}")
+@record_task_timing
+def validate_data(**context):
+    try:
+        input_path = resolve_path(context, "transformed_path")
+        if not os.path.exists(input_path):
+            logging.info(f"No transformed data for this run at {input_path}, nothing to validate")
+            return
+        quality_report_path = run_paths(context)["quality_report_path"]
+
+        # Null, duplicate, outlier and type checks compiled into one scan of the file
+        shards = context.get("shards", SHARD_COUNT)
+        with span("compute"):
+            if shards > 1:
+                issues = run_quality_checks_sharded(pq.read_table(input_path), QUALITY_RULES, shards)
+            else:
+                issues = run_quality_checks(input_path, QUALITY_RULES)
+        with span("write"):
+            write_quality_report(issues, quality_report_path)
+        record(bytes_read=os.path.getsize(input_path), rows_out=len(issues))
+        publish_path(context, "quality_report_path", quality_report_path)
 
     except Exception as e:
         logging.error(f"Validation failed: {str(e)}")
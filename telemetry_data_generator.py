@@ -1,33 +1,105 @@
 # generate_telemetry_data.py
-import pandas as pd
+"""
+Synthetic hourly telemetry in the raw landing layout: {root}/raw/telemetry/YYYY-MM-DD/HH/telemetry.parquet
+
+    python telemetry_data_generator.py --start 2025-08-01T00 --hours 48 --devices 10
+    python telemetry_data_generator.py --devices 100000 --rows-per-device 4 --null-rate 0.01 --seed 7
+"""
+import os
+import argparse
 import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
-import os
 from datetime import datetime, timedelta
-import random
-
-def generate_telemetry_data(date, hour, num_devices=10):
-    records = []
-    for device_id in range(1, num_devices + 1):
-        record = {
-            "device_id": f"D{device_id:04}",
-            "event_ts": f"{date} {hour:02}:00:00",
-            "temperature": round(random.uniform(10, 40), 2),
-            "humidity": round(random.uniform(30, 90), 2),
-            "sensor_type": random.choice(["temp", "humid", "multi"]),
-        }
-        records.append(record)
-    
-    df = pd.DataFrame(records)
-    
-    # Output path: /data/raw/telemetry/YYYY-MM-DD/HH/*.parquet
-    path = f"data/raw/telemetry/{date}/{hour:02}"
-    os.makedirs(path, exist_ok=True)
-    pq.write_table(pa.Table.from_pandas(df), f"{path}/telemetry.parquet")
-    print(f"Generated telemetry data: {path}/telemetry.parquet")
-
-# Example usage:
-for d in ["2025-08-01", "2025-08-02"]:
-    for h in range(24):  # 0–23 hours
-        generate_telemetry_data(d, h)
+
+SENSOR_TYPES = np.array(["temp", "humid", "multi"])
+
+
+def device_ids(num_devices):
+    return pa.array([f"D{device_id:04}" for device_id in range(1, num_devices + 1)])
+
+
+def generate_telemetry_table(hour_start, num_devices=10, rows_per_device=1, null_rate=0.0,
+                             duplicate_rate=0.0, outlier_rate=0.0, rng=None, ids=None):
+    """
+    One hour of readings: `rows_per_device` evenly spaced readings for each device.
+
+    null_rate / outlier_rate are per-value probabilities for temperature and humidity;
+    duplicate_rate re-emits that fraction of rows (same device_id + event_ts) at the end.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    ids = ids if ids is not None else device_ids(num_devices)
+    rows = num_devices * rows_per_device
+
+    device = np.repeat(np.arange(num_devices), rows_per_device)
+    reading = np.tile(np.arange(rows_per_device), num_devices)
+    offsets = (reading * 3600 // rows_per_device).astype("timedelta64[s]")
+    event_ts = pa.array(np.datetime64(hour_start, "s") + offsets)
+
+    temperature = np.round(rng.uniform(10, 40, rows), 2)
+    humidity = np.round(rng.uniform(30, 90, rows), 2)
+
+    # Outliers beyond the anomaly / quality thresholds
+    temp_outliers = rng.random(rows) < outlier_rate
+    temperature[temp_outliers] = rng.choice([-25.0, 75.0], temp_outliers.sum())
+    humid_outliers = rng.random(rows) < outlier_rate
+    humidity[humid_outliers] = np.round(rng.uniform(0, 5, humid_outliers.sum()), 2)
+
+    table = pa.table({
+        "device_id": ids.take(pa.array(device)),
+        "event_ts": pc.strftime(event_ts, format="%Y-%m-%d %H:%M:%S"),
+        "temperature": pa.array(temperature, mask=rng.random(rows) < null_rate),
+        "humidity": pa.array(humidity, mask=rng.random(rows) < null_rate),
+        "sensor_type": pa.array(SENSOR_TYPES[rng.integers(0, len(SENSOR_TYPES), rows)]),
+    })
+
+    duplicates = int(rows * duplicate_rate)
+    if duplicates:
+        table = pa.concat_tables([table, table.take(rng.choice(rows, duplicates, replace=False))])
+    return table
+
+
+def write_telemetry_data(root, start, hours, num_devices=10, rows_per_device=1, null_rate=0.0,
+                         duplicate_rate=0.0, outlier_rate=0.0, seed=None, verbose=True):
+    # Each hour gets its own child seed, so any hour can be regenerated independently
+    seeds = np.random.SeedSequence(seed).spawn(hours)
+    ids = device_ids(num_devices)
+    total_rows = 0
+    for hour, hour_seed in enumerate(seeds):
+        hour_start = start + timedelta(hours=hour)
+        table = generate_telemetry_table(
+            hour_start, num_devices, rows_per_device, null_rate, duplicate_rate, outlier_rate,
+            np.random.default_rng(hour_seed), ids
+        )
+
+        # Output path: /data/raw/telemetry/YYYY-MM-DD/HH/*.parquet
+        path = os.path.join(root, "raw", "telemetry", f"{hour_start:%Y-%m-%d}", f"{hour_start:%H}")
+        os.makedirs(path, exist_ok=True)
+        pq.write_table(table, f"{path}/telemetry.parquet")
+        total_rows += table.num_rows
+        if verbose:
+            print(f"Generated telemetry data: {path}/telemetry.parquet ({table.num_rows} rows)")
+    return total_rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", default="data", help="landing root holding raw/telemetry")
+    parser.add_argument("--start", default="2025-08-01T00", type=lambda s: datetime.strptime(s, "%Y-%m-%dT%H"))
+    parser.add_argument("--hours", type=int, default=48)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--rows-per-device", type=int, default=1, help="readings per device per hour")
+    parser.add_argument("--null-rate", type=float, default=0.0)
+    parser.add_argument("--duplicate-rate", type=float, default=0.0)
+    parser.add_argument("--outlier-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_telemetry_data(
+        args.root, args.start, args.hours, args.devices, args.rows_per_device,
+        args.null_rate, args.duplicate_rate, args.outlier_rate, args.seed
+    )
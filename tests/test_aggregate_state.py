@@ -0,0 +1,101 @@
+import os
+import glob
+import time
+import numpy as np
+import pandas as pd
+from modules.aggregate_state import AggregateStateStore, apply_state, hourly_buckets
+
+
+def hour_frame(hour, temps, humids, devices=("D0001", "D0002")):
+    ts = pd.Timestamp("2025-08-01") + pd.Timedelta(hours=hour)
+    return pd.DataFrame({
+        "device_id": list(devices),
+        "event_ts": [ts] * len(devices),
+        "calibrated_temperature": temps,
+        "calibrated_humidity": humids,
+    })
+
+def run_hour(store, hour, temps, humids, batch_id=None):
+    df = hour_frame(hour, temps, humids)
+    state = store.update(hourly_buckets(df), batch_id or f"run-{hour}")
+    return apply_state(df, state)
+
+def test_state_carries_history_across_runs(tmp_path):
+    store = AggregateStateStore(str(tmp_path / "state"))
+    run_hour(store, 0, [10.0, 20.0], [50.0, 60.0])
+    result = run_hour(store, 1, [20.0, np.nan], [70.0, 80.0])
+
+    assert result["day_avg_temp"].tolist() == [15.0, 20.0]
+    assert result["rolling_7d_humid"].tolist() == [60.0, 70.0]
+
+def test_retry_replaces_its_own_buckets(tmp_path):
+    store = AggregateStateStore(str(tmp_path / "state"))
+    run_hour(store, 0, [10.0, 20.0], [50.0, 60.0])
+    run_hour(store, 1, [20.0, 30.0], [50.0, 60.0])
+    result = run_hour(store, 1, [20.0, 30.0], [50.0, 60.0])
+
+    assert result["day_avg_temp"].tolist() == [15.0, 25.0]
+    assert len(store.read()) == 4
+
+def test_out_of_order_backfill_recomputes_only_its_bucket(tmp_path):
+    store = AggregateStateStore(str(tmp_path / "state"))
+    run_hour(store, 0, [10.0, 10.0], [50.0, 50.0])
+    run_hour(store, 2, [30.0, 30.0], [50.0, 50.0])
+
+    # Late hour 1 lands between the two existing buckets
+    result = run_hour(store, 1, [20.0, 20.0], [50.0, 50.0])
+    assert result["rolling_7d_temp"].tolist() == [15.0, 15.0]
+    assert result["day_avg_temp"].tolist() == [20.0, 20.0]
+
+def test_ring_buffer_prunes_old_buckets(tmp_path):
+    store = AggregateStateStore(str(tmp_path / "state"), retention_hours=24)
+    run_hour(store, 0, [10.0, 10.0], [50.0, 50.0])
+    result = run_hour(store, 30, [40.0, 40.0], [50.0, 50.0])
+
+    assert result["rolling_7d_temp"].tolist() == [25.0, 25.0]
+    assert store.read()["bucket_ts"].min() == pd.Timestamp("2025-08-02 06:00")
+
+def test_micro_batches_share_hour_buckets(tmp_path):
+    # Two polls inside one hour: hour averages cover both batches' rows
+    store = AggregateStateStore(str(tmp_path / "state"))
+    run_hour(store, 3, [10.0, 20.0], [50.0, 60.0], batch_id="poll-1")
+    result = run_hour(store, 3, [30.0, 40.0], [70.0, 80.0], batch_id="poll-2")
+
+    assert result["hour_avg_temp"].tolist() == [20.0, 30.0]
+    assert result["hour_avg_humid"].tolist() == [60.0, 70.0]
+
+def test_update_rewrites_only_its_devices_partitions(tmp_path):
+    store = AggregateStateStore(str(tmp_path / "state"), partitions=8)
+    devices = [f"D{i:04}" for i in range(40)]
+    everyone = hourly_buckets(pd.DataFrame({
+        "device_id": devices,
+        "event_ts": pd.Timestamp("2025-08-01"),
+        "calibrated_temperature": 10.0,
+        "calibrated_humidity": 50.0,
+    }))
+    store.update(everyone, "run-0")
+    written = {path: os.path.getmtime(path) for path in glob.glob(str(tmp_path / "state" / "part-*.parquet"))}
+    time.sleep(0.01)
+    state = store.update(hourly_buckets(hour_frame(1, [20.0, 30.0], [50.0, 50.0])), "run-1")
+    # Averages are only computed for the batch's devices
+    assert set(state["device_id"]) == {"D0001", "D0002"}
+    touched = {path for path, mtime in written.items() if os.path.getmtime(path) != mtime}
+    assert 1 <= len(touched) <= 2
+    assert len(store.read()) == 42
+
+def test_retry_with_other_devices_drops_its_earlier_buckets(tmp_path):
+    store = AggregateStateStore(str(tmp_path / "state"), partitions=8)
+    store.update(hourly_buckets(hour_frame(0, [10.0, 20.0], [50.0, 60.0])), "run-0")
+    store.update(hourly_buckets(hour_frame(0, [10.0], [50.0], devices=("D0003",))), "run-0")
+    assert store.read()["device_id"].tolist() == ["D0003"]
+
+def test_single_file_state_is_split_on_first_update(tmp_path):
+    legacy = AggregateStateStore(str(tmp_path / "old"), partitions=1)
+    legacy.update(hourly_buckets(hour_frame(0, [10.0, 20.0], [50.0, 60.0])), "run-0")
+    os.rename(tmp_path / "old" / "part-0000.parquet", tmp_path / "state.parquet")
+
+    store = AggregateStateStore(str(tmp_path / "state"), partitions=8)
+    result = run_hour(store, 1, [20.0, 30.0], [50.0, 60.0], batch_id="run-0")
+    assert not os.path.exists(tmp_path / "state.parquet")
+    # run-0 was retried: its legacy buckets were replaced, not added to
+    assert result["day_avg_temp"].tolist() == [20.0, 30.0]
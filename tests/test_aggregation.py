@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+from modules.aggregation import compute_device_aggregates
+
+
+def make_frame(rows=2000, devices=25, seed=7):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "device_id": [f"D{i:04}" for i in rng.integers(0, devices, rows)],
+        "event_ts": pd.Timestamp("2025-08-01") + pd.to_timedelta(rng.integers(0, 14 * 24 * 60, rows), unit="min"),
+        "calibrated_temperature": rng.uniform(-10, 50, rows),
+        "calibrated_humidity": rng.uniform(0, 100, rows),
+    })
+    df.loc[rng.choice(rows, 50, replace=False), "calibrated_temperature"] = np.nan
+    df = df.drop_duplicates(subset=["device_id", "event_ts"])
+    df["event_date"] = df["event_ts"].dt.date
+    df["event_hour"] = df["event_ts"].dt.hour
+    return df
+
+def pandas_reference(df, rolling):
+    ref = df.copy()
+    for column, suffix in [("calibrated_temperature", "temp"), ("calibrated_humidity", "humid")]:
+        ref[f"hour_avg_{suffix}"] = ref.groupby(["device_id", "event_hour"])[column].transform("mean")
+        ref[f"day_avg_{suffix}"] = ref.groupby(["device_id", "event_date"])[column].transform("mean")
+    ref = ref.sort_values(by=["device_id", "event_ts"]).reset_index(drop=True)
+    for column, suffix in [("calibrated_temperature", "temp"), ("calibrated_humidity", "humid")]:
+        ref[f"rolling_7d_{suffix}"] = ref.groupby("device_id")[column].transform(rolling)
+    return ref
+
+def test_matches_pandas_row_window():
+    df = make_frame()
+    result = compute_device_aggregates(df, window=7)
+    expected = pandas_reference(df, lambda x: x.rolling(window=7, min_periods=1).mean())
+
+    assert result["device_id"].tolist() == expected["device_id"].tolist()
+    for col in ["hour_avg_temp", "hour_avg_humid", "day_avg_temp", "day_avg_humid", "rolling_7d_temp", "rolling_7d_humid"]:
+        np.testing.assert_allclose(result[col], expected[col], rtol=1e-9, atol=1e-9, err_msg=col)
+
+def test_matches_pandas_time_window():
+    df = make_frame()
+    result = compute_device_aggregates(df, time_window="7D")
+    expected = df.sort_values(by=["device_id", "event_ts"]).reset_index(drop=True)
+    for column, suffix in [("calibrated_temperature", "temp"), ("calibrated_humidity", "humid")]:
+        expected[f"rolling_7d_{suffix}"] = (
+            expected.set_index("event_ts").groupby("device_id")[column].rolling("7D").mean().to_numpy()
+        )
+        np.testing.assert_allclose(result[f"rolling_7d_{suffix}"], expected[f"rolling_7d_{suffix}"],
+                                   rtol=1e-9, atol=1e-9)
+
+def test_categorical_device_ids_keep_sorted_order():
+    # Arrow dictionaries arrive in first-seen order, not sorted order
+    df = make_frame()
+    categorical = df.assign(device_id=df["device_id"].astype(
+        pd.CategoricalDtype(list(dict.fromkeys(df["device_id"])) + ["unused"])
+    ))
+    expected = compute_device_aggregates(df, window=7)
+    result = compute_device_aggregates(categorical, window=7)
+
+    assert result["device_id"].astype(object).tolist() == expected["device_id"].tolist()
+    np.testing.assert_allclose(result["rolling_7d_temp"], expected["rolling_7d_temp"], rtol=1e-9)
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+from modules.anomaly import DeviceStatsStore, BASE_BATCH, apply_anomaly_model, batch_moments, combine_moments
+
+
+def readings(device, temperatures, humidity=50.0):
+    return pd.DataFrame({
+        "device_id": device,
+        "calibrated_temperature": temperatures,
+        "calibrated_humidity": [humidity] * len(temperatures),
+    })
+
+
+def test_combined_moments_match_one_pass():
+    rng = np.random.default_rng(0)
+    batches = [readings("D1", rng.normal(20, 2, size)) for size in (5, 40, 1)]
+    batches[1].loc[3, "calibrated_temperature"] = np.nan
+    combined = combine_moments(pd.concat([batch_moments(batch) for batch in batches], ignore_index=True))
+
+    values = pd.concat(batches)["calibrated_temperature"].dropna().to_numpy()
+    assert combined.loc[0, "temp_count"] == len(values)
+    np.testing.assert_allclose(combined.loc[0, "temp_mean"], values.mean())
+    np.testing.assert_allclose(combined.loc[0, "temp_m2"], values.var() * len(values))
+
+
+def test_store_replaces_retried_batches_and_folds_old_ones(tmp_path):
+    store = DeviceStatsStore(str(tmp_path / "moments.parquet"), keep_batches=2)
+    for batch in range(4):
+        store.update(batch_moments(readings("D1", [20.0 + batch] * 10)), f"run-{batch}")
+    # A retry replaces its own moments rather than adding them again
+    baseline = store.update(batch_moments(readings("D1", [23.0] * 10)), "run-3")
+
+    state = store.read()
+    assert sorted(state["batch_id"]) == [BASE_BATCH, "run-2", "run-3"]
+    assert baseline.loc[0, "temp_count"] == 30
+    np.testing.assert_allclose(baseline.loc[0, "temp_mean"], 21.0)
+    assert combine_moments(state).loc[0, "temp_count"] == 40
+
+
+def test_zscore_flags_per_device_and_falls_back_to_thresholds(tmp_path):
+    store = DeviceStatsStore(str(tmp_path / "moments.parquet"))
+    rng = np.random.default_rng(1)
+    history = pd.concat([readings("D1", rng.normal(10, 0.5, 100)), readings("D2", rng.normal(30, 0.5, 100))])
+    apply_anomaly_model(history, "run-1", store)
+
+    batch = pd.concat([
+        readings("D1", [10.2, 16.0]),   # 16 is ordinary globally but far outside D1's history
+        readings("D2", [30.1]),
+        readings("D3", [20.0, 50.0]),   # no history: static thresholds only
+    ], ignore_index=True)
+    flagged = apply_anomaly_model(batch, "run-2", store)
+
+    assert flagged["anomaly_flag"].tolist() == [False, True, False, False, True]
+    assert flagged["anomaly_score"].iloc[1] > 4
+    assert flagged["anomaly_score"].iloc[3:].isna().all()
+    # The run's own rows never feed its baseline, so a retry scores the same
+    retried = apply_anomaly_model(batch, "run-2", store)
+    np.testing.assert_array_equal(retried["anomaly_score"].to_numpy(), flagged["anomaly_score"].to_numpy())
+
+
+def test_retry_of_a_folded_batch_is_not_counted_twice(tmp_path):
+    store = DeviceStatsStore(str(tmp_path / "moments.parquet"), keep_batches=2)
+    for batch in range(4):
+        store.update(batch_moments(readings("D1", [20.0 + batch] * 10)), f"run-{batch}")
+    assert store.folded_batches() == {"run-0", "run-1"}
+
+    # A late retry of run-0, whose moments are already in the base row
+    store.update(batch_moments(readings("D1", [20.0] * 10)), "run-0")
+    state = store.read()
+    assert sorted(state["batch_id"]) == [BASE_BATCH, "run-2", "run-3"]
+    assert combine_moments(state).loc[0, "temp_count"] == 40
+    np.testing.assert_allclose(combine_moments(state).loc[0, "temp_mean"], 21.5)
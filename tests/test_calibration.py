@@ -0,0 +1,53 @@
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from modules.calibration import CalibrationLookup, load_calibration_lookup
+
+
+def make_config(scale=1.1):
+    return pd.DataFrame({
+        "device_id": ["D0001", "D0002", "D0003"],
+        "device_type": ["soil", "weather", "irrigation"],
+        "scale": [scale, 0.9, 1.0],
+        "offset": [0.5, -1.0, 0.0],
+        "calibration_date": pd.to_datetime(["2025-07-29"] * 3).date,
+    })
+
+def test_lookup_matches_left_merge():
+    rng = np.random.default_rng(0)
+    telemetry = pd.DataFrame({
+        "device_id": rng.choice(["D0001", "D0002", "D0003", "D9999", None], 500),
+        "temperature": rng.uniform(10, 40, 500),
+        "humidity": rng.uniform(30, 90, 500),
+    })
+    telemetry.loc[::17, "temperature"] = np.nan
+    config = make_config()
+
+    expected = pd.merge(telemetry, config, on="device_id", how="left")
+    for sensor in ["temperature", "humidity"]:
+        expected[f"calibrated_{sensor}"] = expected[sensor] * expected["scale"] + expected["offset"]
+
+    result, missing = CalibrationLookup(config).apply(telemetry)
+    assert missing == ["D9999"]
+    assert isinstance(result["device_type"].dtype, pd.CategoricalDtype)
+    result["device_type"] = result["device_type"].astype(object)
+    assert list(result.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+def write_cache(cache_dir, version, scale):
+    cache_dir.mkdir(exist_ok=True)
+    pq.write_table(pa.Table.from_pandas(make_config(scale), preserve_index=False), cache_dir / "devices.parquet")
+    (cache_dir / "manifest.json").write_text(json.dumps({"version": version, "checked_at": 0}))
+
+def test_lookup_cached_per_config_version(tmp_path):
+    cache_dir = tmp_path / "config"
+    write_cache(cache_dir, "devices.csv@1", 1.1)
+    first = load_calibration_lookup(str(cache_dir))
+    assert load_calibration_lookup(str(cache_dir)) is first
+
+    write_cache(cache_dir, "devices.csv@2", 2.0)
+    second = load_calibration_lookup(str(cache_dir))
+    assert second is not first
+    assert second.scale[0] == 2.0
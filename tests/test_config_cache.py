@@ -0,0 +1,82 @@
+import os
+import multiprocessing
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+import modules.config_cache as config_cache_module
+from modules.config_cache import DeviceConfigCache, load_device_config, table_version
+from modules.utils.constants import BUCKET_NAME, CONFIG_PREFIX
+
+
+def write_config(root, date_str, scale):
+    path = root / BUCKET_NAME / CONFIG_PREFIX / date_str
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / "devices.csv", "w") as fp:
+        fp.write("device_id,device_type,scale,offset,calibration_date\n")
+        fp.write(f"D0001,soil,{scale},0.5,{date_str}\n")
+        fp.write(f"D0002,weather,1.0,-1.0,{date_str}\n")
+
+def test_config_cache_downloads_only_on_change(tmp_path, monkeypatch):
+    s3_root = tmp_path / "s3"
+    cache_dir = str(tmp_path / "cache")
+    write_config(s3_root, "2025-07-22", 0.9)
+    write_config(s3_root, "2025-07-29", 1.1)
+
+    downloads = []
+    real_read_csv = config_cache_module.pacsv.read_csv
+    monkeypatch.setattr(config_cache_module.pacsv, "read_csv",
+                        lambda *a, **kw: downloads.append(1) or real_read_csv(*a, **kw))
+
+    fs = pafs.SubTreeFileSystem(str(s3_root), pafs.LocalFileSystem())
+    cache = DeviceConfigCache(fs, cache_dir=cache_dir, max_age=0)
+
+    manifest = cache.resolve()
+    assert manifest["path"].endswith("2025-07-29/devices.csv")
+    assert len(downloads) == 1
+
+    # Unchanged object: listing only, no re-download
+    cache.resolve()
+    assert len(downloads) == 1
+
+    table = load_device_config(cache_dir)
+    assert table.schema.field("calibration_date").type == pa.date32()
+    assert table.schema.field("scale").type == pa.float64()
+    assert table.column("scale").to_pylist()[0] == 1.1
+
+    # A new weekly folder is picked up
+    write_config(s3_root, "2025-08-05", 1.2)
+    manifest = cache.resolve()
+    assert manifest["path"].endswith("2025-08-05/devices.csv")
+    assert len(downloads) == 2
+    assert load_device_config(cache_dir).column("scale").to_pylist()[0] == 1.2
+
+def test_config_cache_skips_listing_within_max_age(tmp_path):
+    s3_root = tmp_path / "s3"
+    write_config(s3_root, "2025-07-29", 1.1)
+    fs = pafs.SubTreeFileSystem(str(s3_root), pafs.LocalFileSystem())
+    cache = DeviceConfigCache(fs, cache_dir=str(tmp_path / "cache"), max_age=3600)
+    cache.resolve()
+
+    # Within max_age the cache must not touch the filesystem at all
+    cache.filesystem = None
+    assert cache.resolve()["path"].endswith("2025-07-29/devices.csv")
+
+def resolve_repeatedly(s3_root, cache_dir, times=5):
+    fs = pafs.SubTreeFileSystem(s3_root, pafs.LocalFileSystem())
+    cache = DeviceConfigCache(fs, cache_dir=cache_dir, max_age=0)
+    return [cache.resolve(force=True)["version"] for _ in range(times)]
+
+def test_concurrent_processes_refresh_one_consistent_cache(tmp_path):
+    s3_root = tmp_path / "s3"
+    cache_dir = str(tmp_path / "cache")
+    write_config(s3_root, "2025-07-29", 1.1)
+
+    # Concurrent DAG runs refreshing the same cache directory
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        versions = pool.starmap(resolve_repeatedly, [(str(s3_root), cache_dir)] * 4)
+
+    manifest = DeviceConfigCache(None, cache_dir=cache_dir).read_manifest()
+    assert {version for run in versions for version in run} == {manifest["version"]}
+    assert table_version(pq.read_schema(os.path.join(cache_dir, "devices.parquet"))) == manifest["version"]
+    assert load_device_config(cache_dir).num_rows == 2
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(".tmp")]
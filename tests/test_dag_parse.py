@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAG_FOLDER = os.path.join(REPO_ROOT, "dags")
+# Scheduler parse budget for the DAG file itself (Airflow already imported)
+DAG_PARSE_BUDGET_SEC = 1.0
+HEAVY_MODULES = ["pyarrow", "duckdb", "modules.ingestion", "modules.storage", "modules.pipeline", "modules.transformation"]
+
+
+def run_python(code, tmp_path):
+    # Fresh interpreter: sys.modules and import timings are not shared with the test session
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, TELEMETRY_DATA_ROOT=str(tmp_path / "data"))
+    output = subprocess.run([sys.executable, "-c", code], env=env, cwd=REPO_ROOT,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def test_task_modules_import_without_side_effects(tmp_path):
+    # No S3 client, DuckDB connection or directories until a task runs
+    result = run_python(
+        "import json, os, modules.ingestion as i, modules.storage, modules.reporting, modules.pipeline, modules.maintenance;"
+        "from modules.utils.duckdb_session import _sessions;"
+        "print(json.dumps([i.get_s3_filesystem.cache_info().currsize, len(_sessions), os.path.exists(os.environ['TELEMETRY_DATA_ROOT'])]))",
+        tmp_path
+    )
+    assert result == [0, 0, False]
+
+def test_dag_parse_stays_light(tmp_path):
+    pytest.importorskip("airflow")
+    result = run_python(
+        "import sys, json, time, airflow; from airflow.models import DagBag;"
+        "before = set(sys.modules); started = time.perf_counter();"
+        f"bag = DagBag(dag_folder={DAG_FOLDER!r}, include_examples=False);"
+        "elapsed = time.perf_counter() - started;"
+        f"print(json.dumps({{'elapsed': elapsed, 'errors': {{k: str(v) for k, v in bag.import_errors.items()}},"
+        f"'dags': list(bag.dag_ids), 'imported': sorted(m for m in {HEAVY_MODULES!r} if m in set(sys.modules) - before)}}))",
+        tmp_path
+    )
+    assert result["errors"] == {}
+    assert "telemetry_pipeline" in result["dags"]
+    assert result["imported"] == []
+    assert result["elapsed"] < DAG_PARSE_BUDGET_SEC, f"DAG parse took {result['elapsed']:.2f}s"
@@ -0,0 +1,30 @@
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from datetime import datetime
+from telemetry_data_generator import generate_telemetry_table, write_telemetry_data
+from config_data_generator import write_config_data
+import numpy as np
+
+
+def test_generators_are_seeded(tmp_path):
+    first = write_telemetry_data(str(tmp_path / "a"), datetime(2025, 8, 1), 3, 20, 2, seed=7, verbose=False)
+    write_telemetry_data(str(tmp_path / "b"), datetime(2025, 8, 1), 3, 20, 2, seed=7, verbose=False)
+    assert first == 3 * 20 * 2
+
+    hour = "raw/telemetry/2025-08-01/02/telemetry.parquet"
+    assert pq.read_table(tmp_path / "a" / hour).equals(pq.read_table(tmp_path / "b" / hour))
+
+    write_config_data(str(tmp_path / "a"), "2025-07-29", 20, seed=7, verbose=False)
+    assert len((tmp_path / "a" / "raw/config/2025-07-29/devices.csv").read_text().splitlines()) == 21
+
+
+def test_injected_nulls_duplicates_outliers():
+    table = generate_telemetry_table(datetime(2025, 8, 1, 5), num_devices=1000, rows_per_device=4, null_rate=0.05,
+                                     duplicate_rate=0.02, outlier_rate=0.05, rng=np.random.default_rng(1))
+    rows = 1000 * 4
+    assert table.num_rows == rows + int(rows * 0.02)
+    assert 0.03 * rows < table.column("temperature").null_count < 0.07 * rows
+    assert table.group_by(["device_id", "event_ts"]).aggregate([]).num_rows == rows
+    hot_or_cold = pc.or_(pc.greater(table.column("temperature"), 45), pc.less(table.column("temperature"), -5))
+    assert 0.03 * rows < pc.sum(hot_or_cold).as_py() < 0.07 * rows
+    assert pc.min(table.column("event_ts")).as_py() == "2025-08-01 05:00:00"
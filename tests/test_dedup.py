@@ -0,0 +1,81 @@
+import pyarrow as pa
+import pytest
+from datetime import date, datetime
+import modules.ingestion as ingestion
+import modules.storage as storage
+from modules.dedup import DedupIndex
+from modules.utils.constants import ICEBERG_TABLE
+from tests.test_storage import local_table, telemetry_batch
+
+
+def keys(device_ids, hours, day=1):
+    return pa.table({
+        "device_id": pa.array(device_ids).dictionary_encode(),
+        "event_ts": pa.array([datetime(2025, 8, day, h) if h is not None else None for h in hours], pa.timestamp("us")),
+    })
+
+
+def test_probe_sees_only_committed_keys(tmp_path):
+    index = DedupIndex(str(tmp_path / "index"), compact_files=2)
+    index.stage(keys(["d1", "d2"], [1, 1]), 1)
+    probe = keys(["d1", "d2", "d3", None, "d1"], [1, 2, 1, 1, None])
+    assert not index.contains(probe).any()
+    assert index.contains(probe, include_pending=True).tolist() == [True, False, False, False, False]
+
+    index.commit(1)
+    assert index.indexed_through() == 1
+    index.stage(keys(["d3"], [1]), 2)
+    index.abort(2)
+    assert index.contains(probe).tolist() == [True, False, False, False, False]
+
+    # Keys are kept per event_date; the third file of a date triggers compaction
+    index.stage(keys(["d2"], [2]), 3)
+    index.commit(3)
+    index.stage(keys(["d1", "d9"], [1, 5], day=2), 4)
+    index.commit(4)
+    index.stage(keys(["d2", "d4"], [2, 7]), 5)
+    index.commit(5)
+    assert len(index._files("2025-08-01", include_pending=False)) == 1
+    assert index.contains(probe).tolist() == [True, True, False, False, False]
+    assert index.contains(keys(["d9", "d9"], [5, 5], day=1)).tolist() == [False, False]
+
+
+def test_recover_settles_interrupted_loads(tmp_path):
+    index = DedupIndex(str(tmp_path / "index"))
+    index.stage(keys(["d1"], [1]), 7)  # committed, crashed before promotion
+    index.stage(keys(["d2"], [1]), 8)  # never committed
+    index.recover(last_snapshot_id=7)
+    assert index.contains(keys(["d1", "d2"], [1, 1]), include_pending=True).tolist() == [True, False]
+
+
+def test_upsert_appends_new_keys_and_merges_resent_ones(local_table, tmp_path, monkeypatch):
+    index = DedupIndex(str(tmp_path / "index"))
+    monkeypatch.setattr(storage, "get_dedup_index", lambda: index)
+    # A load before the index was enabled is picked up by the bootstrap
+    storage.upsert_table(telemetry_batch(["d0"], [0], 5.0))
+    monkeypatch.setattr(storage, "DEDUP_INDEX", True)
+
+    storage.upsert_table(telemetry_batch(["d1", "d2"], [1, 1], 10.0))
+    storage.upsert_table(telemetry_batch(["d0", "d3"], [0, 2], 20.0))  # re-sent d0
+    storage.upsert_table(telemetry_batch(["d4"], [3], 30.0))
+
+    operations = [row[0] for row in local_table.execute(
+        f"SELECT operation FROM iceberg.{storage.SNAPSHOT_TABLE} ORDER BY snapshot_id"
+    ).fetchall()]
+    assert operations[1:] == ["append", "merge" if storage.supports_merge() else "delete_insert", "append"]
+    rows = local_table.execute(
+        f"SELECT device_id, calibrated_temperature FROM iceberg.{ICEBERG_TABLE} ORDER BY device_id"
+    ).fetchall()
+    assert rows == [("d0", 20.0), ("d1", 10.0), ("d2", 10.0), ("d3", 20.0), ("d4", 30.0)]
+
+    # A rolled-back load leaves no keys behind
+    monkeypatch.setattr(storage, "update_latest", lambda con, source: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        storage.upsert_table(telemetry_batch(["d5"], [4], 40.0))
+    assert not index.contains(telemetry_batch(["d5"], [4], 40.0), include_pending=True).any()
+
+    # Ingest can drop events that are already stored
+    monkeypatch.setattr(ingestion, "get_dedup_index", lambda: index)
+    monkeypatch.setattr(ingestion, "DEDUP_INGEST_MODE", "drop")
+    batch = ingestion.probe_stored(telemetry_batch(["d1", "d5"], [1, 4], 0.0), "raw/telemetry.parquet")
+    assert batch.column("device_id").to_pylist() == ["d5"]
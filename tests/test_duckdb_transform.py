@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pytest
+from datetime import datetime, timedelta
+import modules.transformation as transformation
+import modules.duckdb_transform as duckdb_transform
+from modules.aggregate_state import AggregateStateStore
+from modules.anomaly import DeviceStatsStore, apply_anomaly_model, batch_moments
+from modules.calibration import CalibrationLookup
+from modules.duckdb_transform import connect, transform_dataset
+from modules.transformation import transform_frame
+from modules.utils.interim import HOUR_PARTITIONING, read_telemetry_table
+from modules.utils.parquet_profiles import get_profile, sort_table
+from modules.utils.schema import TELEMETRY_SCHEMA, conform_frame, conform_table
+from telemetry_data_generator import generate_telemetry_table
+from config_data_generator import generate_config_table
+
+
+def write_interim(path, hours=3, devices=40):
+    rng = np.random.default_rng(3)
+    for hour in range(hours):
+        start = datetime(2025, 8, 1, 22) + timedelta(hours=hour)
+        table = generate_telemetry_table(start, num_devices=devices, rows_per_device=5, null_rate=0.05,
+                                         duplicate_rate=0.05, outlier_rate=0.05, rng=rng)
+        # A device missing from config, a row without device_id and one without event_ts
+        extra = pa.table({
+            "device_id": ["D9999", None, "D0002"],
+            "event_ts": [f"{start:%Y-%m-%d %H}:10:00", f"{start:%Y-%m-%d %H}:20:00", None],
+            "temperature": [21.0, 22.0, 23.0],
+            "humidity": [40.0, float("nan"), 60.0],
+            "sensor_type": ["temp", "temp", "humid"],
+        })
+        table = conform_table(pa.concat_tables([table.select(extra.column_names).cast(extra.schema), extra]), TELEMETRY_SCHEMA)
+        table = table.append_column("date", pa.array([f"{start:%Y-%m-%d}"] * table.num_rows))
+        table = table.append_column("hour", pa.array([f"{start:%H}"] * table.num_rows))
+        ds.write_dataset(table, str(path), format="parquet", partitioning=HOUR_PARTITIONING,
+                         basename_template=f"part-{hour}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore")
+
+def write_config(path, devices=40):
+    config = generate_config_table("2025-07-29", devices, np.random.default_rng(5)).to_pandas()
+    # Duplicated device: the last row wins
+    config = pd.concat([config, config.iloc[[0]].assign(scale=2.0)], ignore_index=True)
+    config["calibration_date"] = pd.to_datetime(config["calibration_date"]).dt.date
+    pq.write_table(pa.Table.from_pandas(config, preserve_index=False), path)
+
+@pytest.mark.parametrize("incremental,time_window,detector", [
+    (True, None, "static"), (False, None, "static"), (False, "3h", "static"), (True, None, "zscore"),
+])
+def test_duckdb_engine_matches_pandas(tmp_path, monkeypatch, incremental, time_window, detector):
+    interim, config_path = tmp_path / "telemetry", str(tmp_path / "devices.parquet")
+    write_interim(interim)
+    write_config(config_path)
+
+    # Each engine updates its own aggregate state
+    monkeypatch.setattr(transformation, "AggregateStateStore", lambda: AggregateStateStore(str(tmp_path / "pandas_state.parquet")))
+    monkeypatch.setattr(duckdb_transform, "AggregateStateStore", lambda: AggregateStateStore(str(tmp_path / "duckdb_state.parquet")))
+    monkeypatch.setattr(transformation, "INCREMENTAL_AGGREGATES", incremental)
+    monkeypatch.setattr(transformation, "ROLLING_TIME_WINDOW", time_window)
+    monkeypatch.setattr(transformation, "ANOMALY_DETECTOR", detector)
+    if detector == "zscore":
+        # Same earlier batch in both anomaly stores, with enough readings per device to score
+        history, _ = CalibrationLookup(pq.read_table(config_path)).apply(read_telemetry_table(str(interim)).to_pandas())
+        moments = batch_moments(history)
+        moments[[col for col in moments.columns if col.endswith(("_count", "_m2"))]] *= 3
+        for name in ("pandas_moments.parquet", "duckdb_moments.parquet"):
+            DeviceStatsStore(str(tmp_path / name)).update(moments, "run-0")
+        monkeypatch.setattr(transformation, "apply_anomaly_model", lambda df, batch_id, key: apply_anomaly_model(
+            df, batch_id, DeviceStatsStore(str(tmp_path / "pandas_moments.parquet")), key))
+        monkeypatch.setattr(duckdb_transform, "DeviceStatsStore", lambda: DeviceStatsStore(str(tmp_path / "duckdb_moments.parquet")))
+
+    frame = transform_frame(read_telemetry_table(str(interim)).to_pandas(), CalibrationLookup(pq.read_table(config_path)), "run-1")
+    # Rows as the pandas path writes them, in the write profile's order
+    expected = sort_table(conform_frame(frame), get_profile()).to_pandas()
+
+    output = str(tmp_path / "transformed.parquet")
+    con = connect(memory_limit="256MB", threads=2, spill_dir=str(tmp_path / "spill"))
+    records, anomalies = transform_dataset(str(interim), output, "run-1", config_path,
+                                           incremental=incremental, time_window=time_window, con=con, detector=detector)
+    result = pq.read_table(output).to_pandas()
+
+    assert (records, anomalies) == (len(expected), int(expected["anomaly_flag"].sum()))
+    if detector == "zscore":
+        assert expected["anomaly_score"].notna().any()
+    assert list(result.columns) == list(expected.columns)
+    assert pq.read_schema(output).field("event_hour").type == pa.int16()
+    for column in expected.columns:
+        if column == "ingestion_ts":
+            continue
+        left, right = result[column], expected[column]
+        if isinstance(right.dtype, pd.CategoricalDtype):
+            right = right.astype(object)
+        if pd.api.types.is_float_dtype(right):
+            np.testing.assert_allclose(left.to_numpy(), right.to_numpy(), rtol=1e-6, err_msg=column)
+        else:
+            assert left.astype(object).where(left.notna(), None).tolist() == right.astype(object).where(right.notna(), None).tolist(), column
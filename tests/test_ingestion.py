@@ -1,17 +1,126 @@
+import os
+import threading
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+from datetime import datetime
+import modules.ingestion as ingestion
 from modules.ingestion import ingest_raw_data, is_already_processed, mark_as_processed
-from modules.ingestion import CHECKPOINT_FILE
+from modules.ingestion import discover_telemetry_files, ingest_file, resolve_hour_range
+from modules.checkpoint import SQLiteCheckpointStore, TextCheckpointStore
+from modules.utils.interim import read_telemetry_table
+from modules.utils.constants import BUCKET_NAME, RAW_PREFIX
 
 
-def test_already_processed(tmp_path):
-    with open(CHECKPOINT_FILE, "w") as fp:
+def test_already_processed(tmp_path, monkeypatch):
+    legacy_file = tmp_path / "processed_files.txt"
+    with open(legacy_file, "w") as fp:
         fp.write("foo\nbar\n")
-    
+
+    # Legacy text checkpoints are migrated into the indexed store on first open
+    store = SQLiteCheckpointStore(str(tmp_path / "processed_files.db"), legacy_file=str(legacy_file))
+    monkeypatch.setattr(ingestion, "get_checkpoint_store", lambda: store)
+
     assert is_already_processed("foo")
     assert not is_already_processed("baz")
+    assert not os.path.exists(legacy_file)
+    assert os.path.exists(f"{legacy_file}.migrated")
+
+def test_concurrent_first_opens_migrate_once(tmp_path):
+    legacy_file = str(tmp_path / "processed_files.txt")
+    with open(legacy_file, "w") as fp:
+        fp.write("foo\nbar\n")
+
+    # Two workers opening the store at once both saw the legacy file; the second one
+    # migrates after the first has already renamed it
+    db_path = str(tmp_path / "processed_files.db")
+    first, second = (SQLiteCheckpointStore(db_path, legacy_file=None) for _ in range(2))
+    first.migrate_from_text(legacy_file)
+    second.migrate_from_text(legacy_file)
+
+    assert second.is_processed("foo") and second.is_processed("bar")
+    assert os.path.exists(f"{legacy_file}.migrated")
+
+def test_mark_processed(tmp_path, monkeypatch):
+    store = SQLiteCheckpointStore(str(tmp_path / "processed_files.db"), legacy_file=None)
+    monkeypatch.setattr(ingestion, "get_checkpoint_store", lambda: store)
+
+    mark_as_processed("x", etag="100-1", size=100, row_count=10)
+    record = store.get("x")
+    assert record["etag"] == "100-1"
+    assert record["row_count"] == 10
+
+    assert is_already_processed("x", etag="100-1", size=100)
+    # Re-uploaded object: same path, new etag
+    assert not is_already_processed("x", etag="120-2", size=120)
+
+def test_mark_processed_concurrent_writers(tmp_path):
+    db_path = str(tmp_path / "processed_files.db")
+    stores = [SQLiteCheckpointStore(db_path, legacy_file=None) for _ in range(4)]
+
+    def writer(store, worker):
+        store.mark_many([{"path": f"w{worker}/f{i}", "size": i} for i in range(50)])
+
+    threads = [threading.Thread(target=writer, args=(store, i)) for i, store in enumerate(stores)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(stores[0].is_processed(f"w{w}/f{i}") for w in range(4) for i in range(50))
+
+def test_text_checkpoint_backend(tmp_path):
+    store = TextCheckpointStore(str(tmp_path / "processed_files.txt"))
+    store.mark_many([{"path": "a"}, {"path": "b"}])
+    assert store.is_processed("a")
+    assert not store.is_processed("c")
+
+def write_raw_file(root, date_str, hour_str, name, rows):
+    path = root / BUCKET_NAME / RAW_PREFIX / date_str / hour_str
+    path.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.table({
+        "device_id": [f"D{i:04}" for i in range(rows)],
+        "event_ts": [f"{date_str} {hour_str}:00:00"] * rows,
+        "temperature": [20.0] * rows,
+        "humidity": [50.0] * rows,
+        "sensor_type": ["temp"] * rows,
+        "firmware_blob": ["x" * 32] * rows,
+    }), path / name, row_group_size=16)
+
+def test_resolve_hour_range():
+    hours = resolve_hour_range({
+        "execution_date": datetime(2025, 8, 1, 22),
+        "params": {"end_hour": "2025-08-02T01:30:00"},
+    })
+    assert [h.strftime("%d %H") for h in hours] == ["01 22", "01 23", "02 00", "02 01"]
+    assert resolve_hour_range({"execution_date": datetime(2025, 8, 1, 5)}) == [datetime(2025, 8, 1, 5)]
+
+def test_parallel_multi_file_ingestion(tmp_path, monkeypatch):
+    raw_root = tmp_path / "s3"
+    write_raw_file(raw_root, "2025-08-01", "23", "part-0.parquet", 40)
+    write_raw_file(raw_root, "2025-08-01", "23", "part-1.parquet", 25)
+    write_raw_file(raw_root, "2025-08-02", "00", "telemetry.parquet", 10)
+    write_raw_file(raw_root, "2025-08-02", "05", "telemetry.parquet", 10)  # outside the range
+    fs = pafs.SubTreeFileSystem(str(raw_root), pafs.LocalFileSystem())
+    monkeypatch.setattr(ingestion, "get_s3_filesystem", lambda: fs)
+
+    hours = resolve_hour_range({
+        "execution_date": datetime(2025, 8, 1, 23),
+        "end_hour": datetime(2025, 8, 2, 0),
+    })
+    files = discover_telemetry_files(hours)
+    assert [(d, h, os.path.basename(info.path)) for d, h, info in files] == [
+        ("2025-08-01", "23", "part-0.parquet"),
+        ("2025-08-01", "23", "part-1.parquet"),
+        ("2025-08-02", "00", "telemetry.parquet"),
+    ]
 
-def test_mark_processed(tmp_path):
-    mark_as_processed("x")
-    with open(CHECKPOINT_FILE, "r") as fp:
-        data = fp.read().splitlines()
-        assert "x" in data
+    output_dir = str(tmp_path / "interim" / "telemetry")
+    rows = [ingest_file(info, d, h, output_dir, batch_size=8) for d, h, info in files]
+    assert rows == [40, 25, 10]
 
+    assert os.path.isdir(os.path.join(output_dir, "date=2025-08-01", "hour=23"))
+    table = read_telemetry_table(output_dir)
+    assert table.num_rows == 75
+    assert "firmware_blob" not in table.column_names
+    assert "hour" not in table.column_names
@@ -0,0 +1,57 @@
+import os
+import time
+from datetime import datetime
+from modules.utils.interim import run_paths, resolve_path, cleanup_run_intermediates
+from modules.utils.interim import write_metrics_sidecar, read_metrics_sidecar
+
+
+class FakeTaskInstance:
+    def __init__(self):
+        self.xcom = {}
+
+    def xcom_push(self, key, value):
+        self.xcom[key] = value
+
+    def xcom_pull(self, task_ids, key):
+        return self.xcom.get(key)
+
+
+def test_run_paths_are_scoped_per_logical_date():
+    first = run_paths({"logical_date": datetime(2025, 8, 1, 5)})
+    second = run_paths({"logical_date": datetime(2025, 8, 1, 6)})
+    assert "runs/20250801T050000" in first["telemetry_dir"]
+    assert all(first[name] != second[name] for name in first)
+
+    # No run context: legacy fixed locations
+    assert run_paths({})["transformed_path"].endswith("/transformed.parquet")
+    assert "runs/" not in run_paths({})["transformed_path"]
+
+def test_resolve_path_prefers_xcom_reference():
+    ti = FakeTaskInstance()
+    context = {"ti": ti, "logical_date": datetime(2025, 8, 1, 5)}
+    assert resolve_path(context, "transformed_path") == run_paths(context)["transformed_path"]
+
+    ti.xcom_push(key="transformed_path", value="/elsewhere/transformed.parquet")
+    assert resolve_path(context, "transformed_path") == "/elsewhere/transformed.parquet"
+
+def test_cleanup_run_intermediates(tmp_path):
+    old_run = tmp_path / "runs" / "20250801T050000"
+    new_run = tmp_path / "runs" / "20250801T060000"
+    old_run.mkdir(parents=True)
+    new_run.mkdir(parents=True)
+    stale = time.time() - 72 * 3600
+    os.utime(old_run, (stale, stale))
+
+    removed = cleanup_run_intermediates(retention_hours=48, base_dirs=[str(tmp_path)])
+    assert removed == [str(old_run)]
+    assert new_run.exists()
+
+def test_metrics_sidecar_ignored_when_stale(tmp_path):
+    path = tmp_path / "transformed.parquet"
+    path.write_bytes(b"v1")
+    write_metrics_sidecar(str(path), {"records": 3})
+    assert read_metrics_sidecar(str(path))["records"] == 3
+
+    # Rewritten without a new sidecar
+    path.write_bytes(b"version 2")
+    assert read_metrics_sidecar(str(path)) is None
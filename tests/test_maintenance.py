@@ -0,0 +1,55 @@
+import os
+import pyarrow as pa
+import pytest
+from datetime import date, datetime
+import modules.storage as storage
+from modules.maintenance import run_maintenance, expire_snapshots, table_layout
+from modules.storage import SNAPSHOT_TABLE
+from modules.utils.constants import ICEBERG_TABLE
+from modules.utils.duckdb_session import DuckDBSession
+
+
+@pytest.fixture
+def warehouse(tmp_path, monkeypatch):
+    session = DuckDBSession(str(tmp_path / "telemetry.duckdb"), extensions=[], s3=False)
+    monkeypatch.setattr(storage, "get_session", lambda: session)
+    yield tmp_path, session.cursor()
+    session.close()
+
+def hourly_batch(hour, devices=50):
+    return pa.table({
+        "device_id": [f"D{d:03}" for d in range(devices)],
+        "event_ts": pa.array([datetime(2025, 8, 1 + hour // 24, hour % 24)] * devices, pa.timestamp("us")),
+        "device_type": ["A"] * devices,
+        "calibrated_temperature": [float(hour)] * devices,
+        "event_date": pa.array([date(2025, 8, 1 + hour // 24)] * devices, pa.date32()),
+    })
+
+def test_compaction_keeps_rows_and_sorts(warehouse):
+    path, con = warehouse
+    for hour in range(30):
+        storage.upsert_table(hourly_batch(hour))
+    # Re-deliver an hour so the table carries replaced rows
+    storage.upsert_table(hourly_batch(3))
+    (path / "_staging").mkdir()
+    orphan = path / "_staging" / "run.parquet.tmp"
+    orphan.write_bytes(b"x")
+    os.utime(orphan, (0, 0))
+
+    result = run_maintenance(warehouse=str(path), con=con)
+
+    assert result["before"]["rows"] == result["after"]["rows"] == 30 * 50
+    assert result["after"]["row_groups"] <= result["before"]["row_groups"]
+    assert result["orphan_files_removed"] == 1
+    ordered = con.execute(f"SELECT device_id, event_ts FROM iceberg.{ICEBERG_TABLE}").fetchall()
+    assert ordered == sorted(ordered, key=lambda row: (row[1].date(), row[0], row[1]))
+    assert table_layout(con)["rows"] == 30 * 50
+
+def test_expire_snapshots_keeps_latest(warehouse):
+    _, con = warehouse
+    storage.upsert_table(hourly_batch(0))
+    storage.upsert_table(hourly_batch(1))
+    con.execute(f"UPDATE iceberg.{SNAPSHOT_TABLE} SET committed_at = TIMESTAMP '2000-01-01'")
+
+    assert expire_snapshots(con, retention_days=7) == 1
+    assert con.execute(f"SELECT snapshot_id FROM iceberg.{SNAPSHOT_TABLE}").fetchall() == [(2,)]
@@ -0,0 +1,82 @@
+import os
+import time
+import duckdb
+import pyarrow as pa
+from datetime import datetime, timedelta
+import modules.microbatch as microbatch
+import modules.storage as storage
+from modules.microbatch import MicroBatchWorker, batch_context
+from modules.utils.duckdb_session import DuckDBSession
+
+
+def test_batch_context_covers_lookback_hours():
+    context = batch_context(datetime(2025, 8, 1, 10, 25, 3, 500), lookback_hours=2)
+    assert context["run_id"] == "microbatch__20250801T102503"
+    assert context["start_hour"] == datetime(2025, 8, 1, 8, 25, 3)
+    assert context["end_hour"] == context["logical_date"] == datetime(2025, 8, 1, 10, 25, 3)
+
+def test_failed_batch_retries_under_its_run_id(monkeypatch):
+    runs, flushes = [], []
+
+    def fused(**context):
+        runs.append(context["run_id"])
+        if len(runs) == 1:
+            raise RuntimeError("MinIO unavailable")
+        return 10
+
+    monkeypatch.setattr(microbatch, "run_fused_pipeline", fused)
+    monkeypatch.setattr(microbatch, "flush_staged", lambda **kwargs: flushes.append(kwargs))
+    worker = MicroBatchWorker(interval_min=5, commit_sec=0)
+
+    assert worker.run_once(datetime(2025, 8, 1, 10, 0)) is None
+    assert worker.run_once(datetime(2025, 8, 1, 10, 5)) == 10
+    assert worker.run_once(datetime(2025, 8, 1, 10, 10)) == 10
+    # The retry keeps the failed batch's id so its aggregate buckets are replaced, not added
+    assert runs == ["microbatch__20250801T100000", "microbatch__20250801T100000", "microbatch__20250801T101000"]
+    assert flushes[0] == {"force": True, "max_age": 0}
+
+def test_worker_loop_stops_after_iterations(monkeypatch):
+    polls = []
+    monkeypatch.setattr(microbatch, "run_fused_pipeline", lambda **context: polls.append(context) or 0)
+    monkeypatch.setattr(microbatch, "flush_staged", lambda **kwargs: 0)
+    monkeypatch.setattr(microbatch, "cleanup_run_intermediates", lambda: 0)
+    monkeypatch.setattr(MicroBatchWorker, "warm_up", lambda self: None)
+
+    MicroBatchWorker(interval_min=0).run(iterations=3)
+    assert len(polls) == 3
+
+def test_worker_releases_the_write_lock_between_batches(tmp_path, monkeypatch):
+    session = DuckDBSession(str(tmp_path / "telemetry.duckdb"), extensions=[], s3=False)
+    monkeypatch.setattr(microbatch, "get_session", lambda: session)
+    monkeypatch.setattr(microbatch, "run_fused_pipeline", lambda **context: session.cursor().execute("SELECT 1").fetchone()[0])
+    monkeypatch.setattr(microbatch, "flush_staged", lambda **kwargs: 0)
+
+    assert MicroBatchWorker(commit_sec=0).run_once(datetime(2025, 8, 1, 10, 0)) == 1
+    # Another writer (a DAG load, maintenance) can open the file between polls; DuckDB
+    # refuses a differently configured connection while the session is still open
+    duckdb.connect(session.database, config={"access_mode": "READ_WRITE"}).close()
+
+def test_batches_stay_staged_until_commit_sec_old(tmp_path, monkeypatch):
+    staging_dir = str(tmp_path / "staging")
+    upserts = []
+    monkeypatch.setattr(storage, "upsert_table", lambda table, profile=None: upserts.append(table.num_rows))
+    monkeypatch.setattr(microbatch, "flush_staged", lambda **kwargs: storage.flush_staged(staging_dir, **kwargs))
+    monkeypatch.setattr(microbatch, "get_session", lambda: DuckDBSession(":memory:", extensions=[], s3=False))
+
+    def fused(**context):
+        storage.load_table(pa.table({"device_id": ["d1"]}), context, staging_dir=staging_dir)
+        return 1
+
+    monkeypatch.setattr(microbatch, "run_fused_pipeline", fused)
+    worker = MicroBatchWorker(commit_sec=300)
+
+    # The batch hour has not ended, yet the load waits for commit_sec
+    now = datetime.utcnow()
+    assert worker.run_once(now) == 1
+    staged = storage.staged_files(staging_dir)
+    assert len(staged) == 1 and upserts == []
+
+    old = time.time() - 301
+    os.utime(staged[0], (old, old))
+    assert worker.run_once(now + timedelta(minutes=5)) == 1
+    assert upserts == [2] and storage.staged_files(staging_dir) == []
@@ -0,0 +1,53 @@
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from datetime import datetime, timedelta
+from modules.utils.parquet_profiles import SUPPORTED_OPTIONS, copy_options, get_profile, write_parquet
+
+
+def telemetry(rows=1000):
+    start = datetime(2025, 8, 1)
+    return pa.table({
+        "device_id": pa.array([f"D{i % 7}" for i in range(rows)]).dictionary_encode(),
+        "event_ts": pa.array([start + timedelta(minutes=rows - i) for i in range(rows)], pa.timestamp("us")),
+        "calibrated_temperature": pa.array([float(i) for i in range(rows)], pa.float32()),
+    })
+
+
+def test_profile_sorts_and_lays_out_row_groups(tmp_path):
+    table = telemetry()
+    profile = dict(get_profile("read_optimized"), row_group_size=300)
+    path = str(tmp_path / "telemetry.parquet")
+    write_parquet(table, path, profile)
+
+    stored = pq.read_table(path)
+    assert stored.num_rows == table.num_rows
+    keys = list(zip(stored.column("device_id").to_pylist(), stored.column("event_ts").to_pylist()))
+    assert keys == sorted(keys)
+
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups == 4
+    column = metadata.row_group(0).column(0)
+    assert column.compression == "ZSTD"
+    assert column.is_stats_set and column.has_column_index
+    if "bloom_filter_options" in SUPPORTED_OPTIONS:
+        assert column.bloom_filter_length > 0
+    assert [sort.column_index for sort in metadata.row_group(0).sorting_columns] == [0, 1]
+
+
+def test_default_profile_keeps_input_order(tmp_path):
+    table = telemetry(10)
+    path = str(tmp_path / "telemetry.parquet")
+    write_parquet(table, path, "default")
+    assert pq.read_table(path).equals(table)
+    with pytest.raises(ValueError):
+        get_profile("missing")
+
+
+def test_copy_options_are_valid_duckdb(tmp_path):
+    path = str(tmp_path / "telemetry.parquet")
+    con = duckdb.connect()
+    con.execute(f"COPY (SELECT range AS v FROM range(10)) TO '{path}' ({copy_options('compact')})")
+    assert pq.ParquetFile(path).metadata.row_group(0).column(0).compression == "ZSTD"
+    assert con.execute(f"SELECT COUNT(*) FROM read_parquet('{path}')").fetchone()[0] == 10
@@ -0,0 +1,46 @@
+import os
+import pyarrow.fs as pafs
+from datetime import datetime
+import modules.ingestion as ingestion
+import modules.pipeline as pipeline
+from modules.checkpoint import SQLiteCheckpointStore
+from modules.config_cache import DeviceConfigCache
+from modules.calibration import load_calibration_lookup
+
+REPO_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def test_fused_pipeline_passes_tables_in_memory(tmp_path, monkeypatch):
+    # The sample data under data/ laid out as the bucket
+    s3_root = tmp_path / "s3"
+    s3_root.mkdir()
+    os.symlink(REPO_DATA, s3_root / "satsure-iot-data")
+    fs = pafs.SubTreeFileSystem(str(s3_root), pafs.LocalFileSystem())
+    cache_dir = str(tmp_path / "config_cache")
+    store = SQLiteCheckpointStore(str(tmp_path / "checkpoints.db"), legacy_file=None)
+
+    monkeypatch.setattr(ingestion, "get_s3_filesystem", lambda: fs)
+    monkeypatch.setattr(ingestion, "get_config_cache", lambda: DeviceConfigCache(fs, cache_dir=cache_dir))
+    monkeypatch.setattr(ingestion, "get_checkpoint_store", lambda: store)
+    monkeypatch.setattr(pipeline, "load_calibration_lookup", lambda: load_calibration_lookup(cache_dir))
+    monkeypatch.setattr(pipeline, "batch_id_from_context", lambda context: "test")
+    monkeypatch.setattr("modules.transformation.INCREMENTAL_AGGREGATES", False)
+
+    loaded, reports = [], []
+    monkeypatch.setattr(pipeline, "load_table", lambda table, context: loaded.append(table))
+    monkeypatch.setattr(pipeline, "write_report", lambda *args: reports.append(args))
+    monkeypatch.setattr(pipeline, "stored_table_stats", lambda: {})
+    monkeypatch.setattr(pipeline, "write_quality_report", lambda issues, path: None)
+
+    context = {"execution_date": datetime(2025, 8, 1, 0), "end_hour": datetime(2025, 8, 1, 5)}
+    pipeline.run_fused_pipeline(**context)
+
+    assert loaded[0].num_rows == 60
+    assert "calibrated_temperature" in loaded[0].column_names
+    assert reports[0][0] == 60
+    assert set(reports[0][3]) == {"ingest_raw_data", "transform_data", "validate_data", "load_to_iceberg", "generate_report"}
+
+    # Files are checkpointed after the load, so a second run has nothing to do
+    assert store.is_processed("satsure-iot-data/raw/telemetry/2025-08-01/00/telemetry.parquet")
+    pipeline.run_fused_pipeline(**context)
+    assert len(loaded) == 1
@@ -0,0 +1,89 @@
+import os
+import pytest
+from modules.utils.decorators import record_task_timing
+from modules.utils.profiling import span, record
+from modules.utils.metrics_sinks import PrometheusTextfileSink, StatsDSink
+import modules.utils.decorators as decorators
+
+
+class FakeTaskInstance:
+    task_id = "transform_data"
+
+    def __init__(self):
+        self.xcom = {}
+
+    def xcom_push(self, key, value):
+        self.xcom[key] = value
+
+
+@record_task_timing
+def instrumented_task(**context):
+    with span("read"):
+        record(rows_in=10, bytes_read=2048)
+    with span("compute"):
+        sum(range(10000))
+    with span("write"):
+        record(rows_out=8)
+    if context.get("fail"):
+        raise RuntimeError("boom")
+
+
+def test_task_metrics_pushed_to_xcom():
+    ti = FakeTaskInstance()
+    instrumented_task(ti=ti)
+
+    metrics = ti.xcom["task_timing"]
+    assert metrics["task_id"] == "transform_data"
+    assert metrics["status"] == "success"
+    assert set(metrics["spans"]) == {"read", "compute", "write"}
+    assert metrics["rows_in"] == 10 and metrics["rows_out"] == 8 and metrics["bytes_read"] == 2048
+    assert metrics["cpu_sec"] >= 0 and metrics["task_peak_rss_mb"] > 0
+
+    # Spans and counters outside a task are no-ops
+    with span("read"):
+        record(rows_in=1)
+
+@record_task_timing
+def allocating_task(mb=0, **context):
+    block = bytearray(mb * 2**20)
+    block[::4096] = b"x" * len(block[::4096])
+
+
+def test_peak_rss_is_per_task():
+    heavy, light = FakeTaskInstance(), FakeTaskInstance()
+    allocating_task(mb=200, ti=heavy)
+    allocating_task(ti=light)
+
+    heavy_peak = heavy.xcom["task_timing"]["task_peak_rss_mb"]
+    light_peak = light.xcom["task_timing"]["task_peak_rss_mb"]
+    assert heavy_peak > 200
+    # A later task in the same process does not inherit the earlier task's high-water mark
+    assert light_peak is None or light_peak < heavy_peak - 150
+    assert light.xcom["task_timing"]["peak_rss_growth_mb"] < 1
+
+def test_failed_task_still_reports(tmp_path, monkeypatch):
+    exported = []
+    monkeypatch.setattr(decorators, "export_metrics", exported.append)
+    ti = FakeTaskInstance()
+    with pytest.raises(RuntimeError):
+        instrumented_task(ti=ti, fail=True)
+    assert ti.xcom["task_timing"]["status"] == "failed"
+    assert exported[0].task_id == "transform_data"
+
+def test_cprofile_dump_and_sinks(tmp_path, monkeypatch):
+    import modules.utils.profiling as profiling
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path / "profiles"))
+    exported = []
+    monkeypatch.setattr(decorators, "export_metrics", exported.append)
+    instrumented_task(ti=FakeTaskInstance(), profiler="cprofile")
+    assert any(name.endswith(".prof") for name in os.listdir(tmp_path / "profiles"))
+
+    metrics = exported[0]
+    PrometheusTextfileSink(str(tmp_path / "metrics")).emit(metrics)
+    text = (tmp_path / "metrics" / "telemetry_transform_data.prom").read_text()
+    assert 'telemetry_task_rows_in{task="transform_data",status="success"} 10.0' in text
+    assert 'telemetry_task_span_seconds{task="transform_data",status="success",span="read"}' in text
+
+    lines = StatsDSink().lines(metrics)
+    assert "telemetry.transform_data.task_rows_out:8|c" in lines
+    assert any(line.startswith("telemetry.transform_data.read.task_span:") and line.endswith("|ms") for line in lines)
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from modules.quality_rules import run_quality_checks
+from modules.utils.constants import QUALITY_RULES
+
+
+def issues_by_key(issues):
+    return {(issue["issue_type"], issue["column"]): issue["count"] for issue in issues}
+
+def test_rules_match_row_level_semantics(tmp_path):
+    df = pd.DataFrame({
+        "device_id": ["D1", "D1", "D1", "D2"],
+        "event_ts": pd.to_datetime(["2025-08-01 01:00", "2025-08-01 01:00", "2025-08-01 02:00", "2025-08-01 02:00"]),
+        "calibrated_temperature": [100.0, np.nan, 20.0, -10.0],
+        "calibrated_humidity": [5.0, 10.0, 20.0, np.nan],
+    })
+    path = tmp_path / "transformed.parquet"
+    df.to_parquet(path)
+
+    issues = issues_by_key(run_quality_checks(str(path), QUALITY_RULES))
+    assert issues == {
+        ("null_check", "calibrated_temperature"): 1,
+        ("null_check", "calibrated_humidity"): 1,
+        ("duplicate_check", "device_id + event_ts"): 1,
+        ("outlier_check", "calibrated_temperature"): 2,
+        ("outlier_check", "calibrated_humidity"): 1,
+    }
+
+def test_arrow_source_nan_and_schema_checks():
+    # In-memory Arrow can carry NaN (not null); types come from the schema, not the values
+    table = pa.table({
+        "device_id": ["D1", "D2"],
+        "event_ts": pa.array([0, 1], pa.timestamp("us")),
+        "temperature": ["12.5", "oops"],
+        "calibrated_temperature": pa.array([float("nan"), 20.0]),
+    })
+    issues = run_quality_checks(table, QUALITY_RULES)
+    found = issues_by_key(issues)
+
+    assert found[("null_check", "calibrated_temperature")] == 1
+    assert found[("type_mismatch", "temperature")] == 2
+    assert found[("calibration_check", "calibrated_temperature/humidity")] == 0
+    assert ("outlier_check", "calibrated_temperature") not in found
@@ -0,0 +1,123 @@
+import sys
+import json
+import time
+import subprocess
+import threading
+import duckdb
+import urllib.request
+import pytest
+import pyarrow as pa
+from datetime import date, datetime
+import modules.storage as storage
+import modules.utils.duckdb_session as duckdb_session
+from modules.query import TelemetryQueries, make_server
+from modules.utils.duckdb_session import DuckDBSession, replica_path
+
+
+def readings(device_ids, hours, temperature, anomaly=False, day=1):
+    return pa.table({
+        "device_id": device_ids,
+        "event_ts": pa.array([datetime(2025, 8, day, h) for h in hours], pa.timestamp("us")),
+        "device_type": ["soil"] * len(device_ids),
+        "calibrated_temperature": pa.array([temperature] * len(device_ids), pa.float32()),
+        "calibrated_humidity": pa.array([50.0] * len(device_ids), pa.float32()),
+        "anomaly_flag": [anomaly] * len(device_ids),
+        "event_date": pa.array([date(2025, 8, day)] * len(device_ids), pa.date32()),
+    })
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    session = DuckDBSession(str(tmp_path / "telemetry.duckdb"), extensions=[], s3=False)
+    monkeypatch.setattr(storage, "get_session", lambda: session)
+    monkeypatch.setattr(duckdb_session, "QUERY_REPLICA", True)
+    storage.upsert_table(readings(["d1", "d2"], [1, 2], 20.0))
+    storage.upsert_table(readings(["d1"], [3], 50.0, anomaly=True))
+    yield session
+    session.close()
+
+def test_series_latest_and_anomalies(session):
+    queries = TelemetryQueries(session)
+
+    series = queries.get_device_series("d1", "2025-08-01T00:00", "2025-08-01T03:00")
+    assert series["event_ts"].dt.hour.tolist() == [1]
+    series = queries.get_device_series("d1", "2025-08-01T00:00", "2025-08-02T00:00")
+    assert series["event_ts"].dt.hour.tolist() == [1, 3]
+
+    latest = queries.latest_reading(["d1", "d2", "unknown"])
+    assert latest["device_id"].tolist() == ["d1", "d2"]
+    assert latest["calibrated_temperature"].tolist() == [50.0, 20.0]
+
+    found = queries.anomalies("1h")
+    assert found[["device_id", "calibrated_temperature"]].values.tolist() == [["d1", 50.0]]
+
+def test_latest_index_ignores_older_backfills(session):
+    storage.upsert_table(readings(["d1", "d3"], [0, 0], 10.0))
+    latest = TelemetryQueries(session).latest_reading()
+    assert latest.set_index("device_id")["event_ts"].dt.hour.to_dict() == {"d1": 3, "d2": 2, "d3": 0}
+
+def test_cache_is_invalidated_by_new_snapshot(session):
+    queries = TelemetryQueries(session)
+    first = queries.latest_reading(["d2"])
+    assert queries.latest_reading(["d2"]) is first
+
+    storage.upsert_table(readings(["d2"], [5], 30.0))
+    refreshed = queries.latest_reading(["d2"])
+    assert refreshed is not first
+    assert refreshed["calibrated_temperature"].tolist() == [30.0]
+
+def test_replica_serves_while_another_process_writes(session):
+    replica = DuckDBSession(replica_path(session.database), extensions=[], s3=False, read_only=True, lock_timeout=0)
+    queries = TelemetryQueries(replica, release=True)
+    session.close()
+
+    # A pipeline process holding the write lock on the database file
+    writer = subprocess.Popen(
+        [sys.executable, "-c", "import sys, time, duckdb; con = duckdb.connect(sys.argv[1]); print('locked', flush=True); time.sleep(60)",
+         session.database],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert writer.stdout.readline().strip() == "locked"
+        with pytest.raises(duckdb.IOException):
+            duckdb.connect(session.database, read_only=True)
+        started = time.monotonic()
+        assert len(queries.latest_reading()) == 2
+        assert time.monotonic() - started < 5
+    finally:
+        writer.kill()
+        writer.wait()
+
+    # The next commit swaps in a new replica; the cache notices it
+    storage.upsert_table(readings(["d4"], [6], 25.0))
+    assert len(queries.latest_reading()) == 3
+
+def test_http_endpoint(session):
+    server = make_server(TelemetryQueries(session), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(f"{base}/latest?device_id=d2") as response:
+            assert json.load(response)[0]["device_id"] == "d2"
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"{base}/series?device_id=d1")
+        assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_empty_replica_is_unavailable(tmp_path):
+    # A replica published before the first load has no telemetry tables
+    duckdb.connect(str(tmp_path / "telemetry.replica.duckdb")).close()
+    replica = DuckDBSession(str(tmp_path / "telemetry.replica.duckdb"), extensions=[], s3=False, read_only=True)
+    server = make_server(TelemetryQueries(replica, release=True), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/latest")
+        assert error.value.code == 503
+        assert "error" in json.load(error.value)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,43 @@
+import pandas as pd
+import pyarrow as pa
+from modules.utils.schema import TELEMETRY_SCHEMA, conform_frame, conform_table
+
+
+def test_conform_raw_telemetry():
+    raw = pa.table({
+        "device_id": ["D0001", "D0002", "D0001"],
+        "event_ts": ["2025-08-01 00:00:00", "2025-08-01 00:15:00", None],
+        "temperature": [20.5, 21.0, None],
+        "humidity": [50.0, 51.0, 52.0],
+        "sensor_type": ["temp", "temp", "humid"],
+        "firmware": ["x", "y", "z"],
+    })
+    table = conform_table(raw, TELEMETRY_SCHEMA)
+
+    assert table.schema.field("device_id").type == pa.dictionary(pa.int32(), pa.string())
+    assert table.schema.field("event_ts").type == pa.timestamp("us")
+    assert table.schema.field("temperature").type == pa.float32()
+    assert table.schema.field("firmware").type == pa.string()
+    assert table.column("device_id").to_pylist() == ["D0001", "D0002", "D0001"]
+    assert table.column("event_ts").null_count == 1
+
+def test_unparseable_column_keeps_type():
+    # Left for the type_mismatch quality rule to report
+    table = conform_table(pa.table({"temperature": ["20.5", "hot"]}), TELEMETRY_SCHEMA)
+    assert table.schema.field("temperature").type == pa.string()
+
+def test_conform_transformed_frame():
+    df = pd.DataFrame({
+        "device_id": pd.Categorical(["D2", "D1"]),
+        "event_date": pd.to_datetime(["2025-08-01", "2025-08-02"]),
+        "event_hour": [0.0, float("nan")],
+        "calibrated_temperature": [20.123456789, 21.0],
+        "anomaly_flag": [False, True],
+    })
+    table = conform_frame(df)
+
+    assert table.schema.field("event_date").type == pa.date32()
+    assert table.schema.field("event_hour").type == pa.int16()
+    assert table.schema.field("calibrated_temperature").type == pa.float32()
+    assert table.column("device_id").to_pylist() == ["D2", "D1"]
+    assert table.column("event_hour").to_pylist() == [0, None]
@@ -0,0 +1,80 @@
+import os
+import multiprocessing
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import modules.transformation as transformation
+from modules.aggregate_state import AggregateStateStore
+from modules.calibration import CalibrationLookup
+from modules.quality_rules import run_quality_checks, run_quality_checks_sharded
+import modules.sharding as sharding
+from modules.sharding import get_shard_pool, shard_table, shutdown_shard_pools, to_ipc, from_ipc
+from modules.transformation import transform_frame, transform_sharded
+from modules.utils.constants import QUALITY_RULES
+from modules.utils.interim import read_telemetry_table
+from modules.utils.schema import conform_frame
+from tests.test_duckdb_transform import write_interim, write_config
+
+
+def test_shards_are_disjoint_by_device():
+    table = pa.table({"device_id": ["D1", "D2", "D3", "D1", None, "D2", None], "value": list(range(7))})
+    shards = shard_table(table, "device_id", 3)
+
+    assert sum(shard.num_rows for shard in shards) == table.num_rows
+    devices = [set(shard.column("device_id").to_pylist()) for shard in shards]
+    for i, left in enumerate(devices):
+        for right in devices[i + 1:]:
+            assert not left & right
+    # Input order is kept within a shard, and the same key always maps to the same shard
+    for shard in shards:
+        assert shard.column("value").to_pylist() == sorted(shard.column("value").to_pylist())
+    assert [s.num_rows for s in shard_table(table, "device_id", 3)] == [s.num_rows for s in shards]
+    assert from_ipc(to_ipc(table)).equals(table)
+
+
+def test_sharded_transform_and_checks_match_single_process(tmp_path, monkeypatch):
+    interim, cache_dir = tmp_path / "telemetry", tmp_path / "config"
+    os.makedirs(cache_dir)
+    write_interim(interim)
+    write_config(str(cache_dir / "devices.parquet"))
+    telemetry = read_telemetry_table(str(interim))
+
+    monkeypatch.setattr(transformation, "INCREMENTAL_AGGREGATES", True)
+    monkeypatch.setattr(transformation, "AggregateStateStore", lambda: AggregateStateStore(str(tmp_path / "single.parquet")))
+    expected = conform_frame(transform_frame(
+        telemetry.to_pandas(), CalibrationLookup(pq.read_table(cache_dir / "devices.parquet")), "run-1"
+    ))
+    monkeypatch.setattr(transformation, "AggregateStateStore", lambda: AggregateStateStore(str(tmp_path / "sharded.parquet")))
+    result = conform_frame(transform_sharded(telemetry, "run-1", shards=3, cache_dir=str(cache_dir)))
+
+    assert result.schema.names == expected.schema.names
+
+    def rows(table):
+        # Shards come back in shard order; compare as one (device, time, reading) ordering
+        df = table.drop(["ingestion_ts"]).to_pandas()
+        df = df.astype({col: object for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)})
+        keys = ["device_id", "event_ts", "temperature", "humidity"]
+        return df.sort_values(keys, kind="mergesort").reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(rows(result), rows(expected))
+
+    issues = run_quality_checks_sharded(expected, QUALITY_RULES, shards=3)
+    assert issues == run_quality_checks(expected, QUALITY_RULES)
+    assert any(issue["issue_type"] == "duplicate_check" for issue in issues)
+
+
+def test_shard_pool_is_shut_down_and_not_inherited_by_forks():
+    pool = get_shard_pool(2)
+    worker_pid = pool.submit(os.getpid).result()
+    assert worker_pid != os.getpid()
+
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if not sharding._pools else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+
+    shutdown_shard_pools()
+    assert not sharding._pools
+    assert worker_pid not in [child.pid for child in multiprocessing.active_children()]
+    assert get_shard_pool(2) is not pool
+    shutdown_shard_pools()
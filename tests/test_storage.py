@@ -1,6 +1,14 @@
 import pandas as pd
 import os
-from modules.storage import load_to_iceberg, con
+import pytest
+import pyarrow as pa
+from datetime import date, datetime, timedelta, timezone
+import modules.storage as storage
+import modules.utils.duckdb_session as duckdb_session
+from modules.storage import load_to_iceberg
+from modules.utils.decorators import releases_duckdb_session
+from modules.utils.duckdb_session import DuckDBSession, get_session
+from modules.utils.schema import conform_table
 from modules.utils.constants import ICEBERG_TABLE, PROCESSED_PATH, MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_REGION, MINIO_SECRET_KEY
 import duckdb
 
@@ -31,13 +39,123 @@ def test_storage_upsert(tmp_path, monkeypatch):
     df.to_parquet(processed_file)
     load_to_iceberg()
     
-    # verify Iceberg table via duckdb
-    # con = duckdb.connect(database=":memory:")
-    con.execute("INSTALL iceberg; LOAD iceberg;")
-    con.execute(f"SET s3_endpoint='{MINIO_ENDPOINT}';")
-    con.execute(f"SET s3_region='{MINIO_REGION}';")
-    con.execute(f"SET s3_access_key_id='{MINIO_ACCESS_KEY}';")
-    con.execute(f"SET s3_secret_access_key='{MINIO_SECRET_KEY}';")
+    # verify Iceberg table via the worker's DuckDB session
+    con = get_session().cursor()
     res = con.execute(f"SELECT COUNT(*) FROM iceberg.{ICEBERG_TABLE}").fetchdf()
     print(f"Table data count in iceberg is: {res.iloc[0,0]}")
     assert res.iloc[0,0] == 2, "Iceberge table count mismatch."
+
+
+def telemetry_batch(device_ids, hours, temperature):
+    return pa.table({
+        "device_id": device_ids,
+        "event_ts": pa.array([datetime(2025, 8, 1, h) for h in hours], pa.timestamp("us")),
+        "device_type": ["A"] * len(device_ids),
+        "calibrated_temperature": [temperature] * len(device_ids),
+        "event_date": pa.array([date(2025, 8, 1)] * len(device_ids), pa.date32()),
+    })
+
+@pytest.fixture
+def local_table(tmp_path, monkeypatch):
+    # Plain DuckDB file instead of the MinIO-backed extension setup
+    session = DuckDBSession(str(tmp_path / "telemetry.duckdb"), extensions=[], s3=False)
+    monkeypatch.setattr(storage, "get_session", lambda: session)
+    yield session.cursor()
+    session.close()
+
+@pytest.mark.parametrize("merge", [True, False])
+def test_upsert_replaces_existing_keys(local_table, monkeypatch, merge):
+    monkeypatch.setattr(storage, "supports_merge", lambda: merge)
+
+    storage.upsert_table(telemetry_batch(["d1", "d2"], [1, 1], 10.0))
+    # Re-delivered d1 row, a new d3 row, and a duplicate key inside the batch (last wins)
+    storage.upsert_table(pa.concat_tables([
+        telemetry_batch(["d1", "d3"], [1, 2], 20.0),
+        telemetry_batch(["d3"], [2], 30.0),
+    ]))
+
+    rows = local_table.execute(
+        f"SELECT device_id, calibrated_temperature FROM iceberg.{ICEBERG_TABLE} ORDER BY device_id"
+    ).fetchall()
+    assert rows == [("d1", 20.0), ("d2", 10.0), ("d3", 30.0)]
+
+def test_staged_runs_flush_in_one_commit(local_table, tmp_path, monkeypatch):
+    staging_dir = str(tmp_path / "_staging")
+    upserts = []
+    upsert_table = storage.upsert_table
+    monkeypatch.setattr(storage, "upsert_table", lambda table, profile=None: upserts.append(table) or upsert_table(table, profile))
+
+    for hour in range(3):
+        storage.stage_table(telemetry_batch(["d1", "d2"], [hour, hour], float(hour)), f"run{hour}", staging_dir)
+    assert storage.flush_staged(staging_dir) == 0  # below LOAD_BUFFER_HOURS
+
+    assert storage.flush_staged(staging_dir, force=True) == 6
+    assert len(upserts) == 1
+    assert storage.staged_files(staging_dir) == []
+    count = local_table.execute(f"SELECT COUNT(*) FROM iceberg.{ICEBERG_TABLE}").fetchone()[0]
+    assert count == 6
+
+def test_last_run_of_a_catchup_flushes_everything_staged(local_table, tmp_path):
+    staging_dir = str(tmp_path / "_staging")
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    def run_context(interval_start):
+        return {
+            "logical_date": interval_start,
+            "data_interval_start": interval_start,
+            "data_interval_end": interval_start + timedelta(hours=1),
+        }
+
+    # Catchup hours are buffered: later runs are due right away
+    for hour in range(3):
+        catchup = run_context(datetime(2025, 8, 1, hour, tzinfo=timezone.utc))
+        assert not storage.is_latest_run(catchup)
+        storage.load_table(telemetry_batch(["d1", "d2"], [hour, hour], float(hour)), catchup, staging_dir)
+    assert len(storage.staged_files(staging_dir)) == 3
+
+    # The run of the latest interval has no successor yet and commits everything
+    storage.load_table(telemetry_batch(["d3"], [3], 3.0), run_context(now - timedelta(hours=1)), staging_dir)
+    assert storage.staged_files(staging_dir) == []
+    count = local_table.execute(f"SELECT COUNT(*) FROM iceberg.{ICEBERG_TABLE}").fetchone()[0]
+    assert count == 7
+
+def test_session_persists_between_workers(tmp_path):
+    database = str(tmp_path / "telemetry.duckdb")
+    session = DuckDBSession(database, extensions=[], s3=False)
+    session.cursor().execute("CREATE TABLE iceberg.t AS SELECT 42 AS v")
+    assert session.cursor() is session.cursor()
+    session.close()
+
+    reopened = DuckDBSession(database, extensions=[], s3=False)
+    assert reopened.cursor().execute("SELECT v FROM iceberg.t").fetchone() == (42,)
+    reopened.close()
+
+def test_task_releases_the_write_lock(tmp_path, monkeypatch):
+    database = str(tmp_path / "telemetry.duckdb")
+    session = DuckDBSession(database, extensions=[], s3=False)
+    monkeypatch.setitem(duckdb_session._sessions, (database, os.getpid()), session)
+
+    @releases_duckdb_session
+    def task():
+        get_session(database).cursor().execute("CREATE TABLE iceberg.t AS SELECT 42 AS v")
+
+    task()
+    # Another worker process can write once the task is done; DuckDB refuses a differently
+    # configured connection while this process still has the file open
+    duckdb.connect(database, config={"access_mode": "READ_WRITE"}).close()
+    assert get_session(database).cursor().execute("SELECT v FROM iceberg.t").fetchone() == (42,)
+    session.close()
+
+def test_upsert_canonical_types(local_table):
+    # Dictionary ids and float32 / int16 columns land in the VARCHAR / FLOAT / SMALLINT table
+    table = conform_table(telemetry_batch(["d1", "d2"], [1, 2], 21.5).append_column(
+        "event_hour", pa.array([1, 2], pa.int64())
+    ))
+    assert pa.types.is_dictionary(table.schema.field("device_id").type)
+    storage.upsert_table(table)
+    storage.upsert_table(table)
+
+    types = dict(local_table.execute(f"SELECT column_name, column_type FROM (DESCRIBE iceberg.{ICEBERG_TABLE})").fetchall())
+    assert types["calibrated_temperature"] == "FLOAT" and types["event_hour"] == "SMALLINT"
+    rows = local_table.execute(f"SELECT device_id, calibrated_temperature FROM iceberg.{ICEBERG_TABLE} ORDER BY 1").fetchall()
+    assert rows == [("d1", 21.5), ("d2", 21.5)]